@@ -15,7 +15,11 @@ from database import (
 )
 # Ajuste na importação dos solvers para pegar do módulo correto
 from routing.cvrp import solver_cvrp
-from routing.cvrp_flex import solver_cvrp
+from routing.cvrp_flex import solver_cvrp as solver_cvrp_flex
+from routing.ortools_utils import parar_sem_melhoria
+from routing.cache_resultados import executar_com_cache
+from routing.decomposicao import solver_cvrp_decomposto
+from routing.lns import melhorar_com_lns
 # Modificado para importar também INFINITE_VALUE
 from routing.distancias import calcular_matriz_distancias, INFINITE_VALUE
 from pedidos import obter_coordenadas # Para geocodificação do endereço de partida
@@ -129,7 +133,7 @@ def show():
         # --- NOVA LÓGICA: Rodízio só para pedidos com destino SP ---
         if frota is not None and not frota.empty:
             if 'Placa' in frota.columns:
-                from routing.utils import placa_em_rodizio_sp, pedido_destino_sp
+                from routing.utils import placa_em_rodizio_sp
                 if considerar_rodizio and dia_roteirizacao in range(5):
                     frota['Rodizio_SP'] = frota['Placa'].apply(lambda p: placa_em_rodizio_sp(p, dia_roteirizacao))
                     st.info(f"{frota['Rodizio_SP'].sum()} veículos em rodízio para {dias_semana[dia_roteirizacao]}.")
@@ -249,23 +253,54 @@ def show():
         st.subheader("Configuração da Roteirização")
         tipo = st.selectbox(
             "Selecione o tipo de problema de roteirização",
-            ["CVRP", "CVRP Flex"],
+            ["CVRP", "CVRP Flex", "CVRP Decomposto"],
             key="tipo_roteirizacao_select",
             help="Escolha o algoritmo de roteirização baseado nas restrições do seu problema."
         )
         explicacoes = {
             "CVRP": "CVRP (Capacitated VRP): Considera a capacidade máxima (Kg ou Cx) dos veículos.",
-            "CVRP Flex": "CVRP Flex: Permite ajustar a capacidade dos veículos de 0% a 120% para simular sobrecarga controlada."
+            "CVRP Flex": "CVRP Flex: Permite ajustar a capacidade dos veículos de 0% a 120% para simular sobrecarga controlada.",
+            "CVRP Decomposto": "CVRP Decomposto: Para milhares de pedidos. Divide os pedidos em setores angulares balanceados pela demanda, resolve cada setor em paralelo e repara as rotas nas fronteiras."
         }
         st.info(explicacoes.get(tipo, ""))
 
         ajuste_capacidade_pct = 100
-        if tipo in ["CVRP", "CVRP Flex"]:
+        max_pedidos_subproblema = 300
+        if tipo == "CVRP Decomposto":
+            max_pedidos_subproblema = st.number_input(
+                "Máximo de pedidos por subproblema",
+                min_value=50, max_value=2000, value=300, step=50,
+                help="Setores maiores dão rotas melhores, mas cada subproblema demora mais para resolver."
+            )
+        if tipo in ["CVRP", "CVRP Flex", "CVRP Decomposto"]:
             ajuste_capacidade_pct = st.slider(
                 "Ajuste de Capacidade dos Veículos (%)",
                 min_value=80, max_value=120, value=100, step=1,
                 help="Permite simular veículos carregando menos ou até 20% a mais que a capacidade cadastrada."
             )
+        col_tempo1, col_tempo2 = st.columns(2)
+        with col_tempo1:
+            tempo_limite_solver = st.number_input(
+                "Tempo limite do solver (s)",
+                min_value=5, max_value=600, value=30, step=5,
+                help="Tempo máximo de busca do OR-Tools."
+            )
+        with col_tempo2:
+            parar_apos_estagnacao = st.number_input(
+                "Parar após N s sem melhoria (0 = usar todo o tempo)",
+                min_value=0, max_value=600, value=0, step=5,
+                help="Interrompe a busca quando o plano não melhora por N segundos, mantendo a melhor solução encontrada."
+            )
+        tempo_lns = st.number_input(
+            "Tempo extra de melhoria contínua (LNS) após o solver (s, 0 = desligado)",
+            min_value=0, max_value=600, value=0, step=10,
+            help="Continua melhorando o plano do solver removendo e reinserindo grupos de pedidos (ruin-and-recreate)."
+        )
+        usar_cache_resultados = st.checkbox(
+            "Reutilizar resultado em cache quando pedidos, frota e parâmetros forem idênticos",
+            value=True,
+            help="Desmarque para forçar um novo cálculo do solver (o novo resultado substitui o do cache)."
+        )
 
         # --- Agrupamento Inicial de Pedidos (sempre exibe se possível) ---
         st.subheader("Agrupamento Inicial de Pedidos (por proximidade geográfica)")
@@ -408,7 +443,7 @@ def show():
                  st.error(f"Erro: A frota está vazia, não é possível calcular rotas para {tipo}.")
             else:
                 # --- Validações adicionais antes de calcular matrizes ---
-                if tipo == "CVRP":
+                if tipo in ["CVRP", "CVRP Decomposto"]:
                     # 1. Demanda maior que qualquer veículo
                     if 'Peso dos Itens' in pedidos_validos.columns and 'Capacidade (Kg)' in frota.columns:
                         demandas_pedidos = pedidos_validos['Peso dos Itens'].fillna(0).astype(float)
@@ -489,6 +524,26 @@ def show():
                     status_solver = "Não executado"
 
                     with st.spinner(f"Executando o solver {tipo}..."):
+                        status_text_solver = st.empty()
+
+                        # Callback de progresso do solver: exibe cada melhoria do objetivo
+                        def callback_solver(info):
+                            status_text_solver.text(
+                                f"Melhor solução: {info['objetivo'] / 1000:,.1f} km | "
+                                f"{info['n_melhorias']} melhorias em {info['n_solucoes']} soluções | "
+                                f"Decorrido: {info['tempo_decorrido_s']:.0f}s"
+                            )
+                        kwargs_progresso = {
+                            'progress_callback': callback_solver,
+                            'cancelar': parar_sem_melhoria(parar_apos_estagnacao),
+                            'tempo_limite_s': tempo_limite_solver,
+                        }
+                        # O critério de parada é um callable (fora da chave do cache): entra pelo valor configurado
+                        kwargs_cache = {
+                            'usar_cache': usar_cache_resultados,
+                            'parametros_chave': {'parar_apos_estagnacao': parar_apos_estagnacao},
+                        }
+                        veio_do_cache = False
                         try:
                             if tipo == "CVRP":
                                 # CVRP também minimiza distância, mas considera capacidade
@@ -499,21 +554,23 @@ def show():
                                      st.error("Coluna 'Capacidade (Kg)' necessária para CVRP não encontrada na frota.")
                                      raise ValueError("Faltando 'Capacidade (Kg)'")
                                 else:
-                                     rotas = solver_cvrp(
-                                         pedidos_validos, frota, matriz_distancias,
+                                     rotas, metricas_solver, veio_do_cache = executar_com_cache(
+                                         solver_cvrp, pedidos_validos, frota, matriz_distancias, **kwargs_cache,
                                          pos_processamento=aplicar_pos,
                                          tipo_heuristica=tipo_heuristica if aplicar_pos else '2opt',
                                          kwargs_heuristica={"max_paradas_por_subrota": max_paradas_split} if aplicar_pos and tipo_heuristica == "split" else {},
-                                         ajuste_capacidade_pct=ajuste_capacidade_pct
+                                         ajuste_capacidade_pct=ajuste_capacidade_pct,
+                                         **kwargs_progresso
                                      )
                                      rotas_df = rotas # Resultado já é DataFrame
                                      status_solver = "OK" if rotas_df is not None and not rotas_df.empty else "Falha ou Sem Solução"
                             elif tipo == "CVRP Flex":
-                                rotas = solver_cvrp_flex(
-                                    pedidos_validos, frota, matriz_distancias, depot_index=depot_index, ajuste_capacidade_pct=ajuste_capacidade_pct,
+                                rotas, metricas_solver, veio_do_cache = executar_com_cache(
+                                    solver_cvrp_flex, pedidos_validos, frota, matriz_distancias, **kwargs_cache, depot_index=depot_index, ajuste_capacidade_pct=ajuste_capacidade_pct,
                                     pos_processamento=aplicar_pos,
                                     tipo_heuristica=tipo_heuristica if aplicar_pos else '2opt',
-                                    kwargs_heuristica={"max_paradas_por_subrota": max_paradas_split} if aplicar_pos and tipo_heuristica == "split" else {}
+                                    kwargs_heuristica={"max_paradas_por_subrota": max_paradas_split} if aplicar_pos and tipo_heuristica == "split" else {},
+                                    **kwargs_progresso
                                 )
                                 # Se o solver retornar dict, tenta extrair o DataFrame
                                 if isinstance(rotas, dict):
@@ -529,6 +586,14 @@ def show():
                                 else:
                                     rotas_df = rotas
                                 status_solver = "OK" if rotas_df is not None and isinstance(rotas_df, pd.DataFrame) and not rotas_df.empty else "Falha ou Sem Solução"
+                            elif tipo == "CVRP Decomposto":
+                                rotas_df, metricas_solver, veio_do_cache = executar_com_cache(
+                                    solver_cvrp_decomposto, pedidos_validos, frota, matriz_distancias, **kwargs_cache,
+                                    coord_deposito=(lat_partida, lon_partida),
+                                    max_pedidos_por_subproblema=max_pedidos_subproblema,
+                                    **kwargs_progresso
+                                )
+                                status_solver = "OK" if rotas_df is not None and not rotas_df.empty else "Falha ou Sem Solução"
 
                         except ValueError as ve:
                              st.error(f"Erro de dados ao preparar para {tipo}: {ve}")
@@ -544,97 +609,66 @@ def show():
                              st.session_state['rotas_calculadas'] = None
                              st.session_state['mapa_necessario'] = False
 
+                        if veio_do_cache:
+                            st.info("Resultado reaproveitado do cache (entradas e parâmetros idênticos). Desmarque a opção de cache para recalcular.")
+
                         # Relatório automático de causas para inviabilidade
                         if status_solver and ("INFEASIBLE" in str(status_solver).upper() or "NENHUMA SOLUÇÃO" in str(status_solver).upper() or "Falha" in str(status_solver)):
                             st.warning("\n**Diagnóstico automático para problema inviável:**\n\n- Verifique se algum pedido tem demanda maior que a capacidade máxima dos veículos.\n- Revise as janelas de tempo dos veículos e pedidos (se existirem).\n- Confira se todos os pedidos possuem coordenadas válidas e não há outliers muito distantes.\n- Certifique-se de que a frota é suficiente para atender todos os pedidos.\n- Tente relaxar restrições (aumentar janelas, frota, capacidade) e rode novamente.\n\nSe o problema persistir, revise os dados de entrada e tente com um conjunto menor de pedidos.")
 
-                    if rotas_df is not None and not rotas_df.empty:
-                        from routing.pos_processamento import balanceamento_iterativo, reservar_veiculos_para_regioes, mover_para_vizinho_proximo, sugerir_agrupamento_ml
+                    if rotas_df is not None and not rotas_df.empty and tempo_lns > 0:
+                        with st.spinner(f"Melhorando o plano com LNS por {tempo_lns}s..."):
+                            import os
+                            rotas_df = melhorar_com_lns(
+                                rotas_df, matriz_distancias, frota=frota, limite_pct=ajuste_capacidade_pct,
+                                tempo_limite_s=tempo_lns, n_processos=os.cpu_count() or 1
+                            )
 
-
-                        # Priorizar regiões preferidas da frota (restrição dura)
-
-                        from routing.pos_processamento import priorizar_regioes_preferidas, restringir_1_regiao_por_veiculo, realocar_pedidos_restritos
-                        # Ajuste do raio máximo pode ser feito aqui:
-                        raio_max_km = 20  # Altere conforme necessidade operacional
-                        rotas_df, n_realocados = priorizar_regioes_preferidas(rotas_df, frota, pedidos_validos)
+                    if rotas_df is not None and not rotas_df.empty:
+                        from routing.pipeline import PipelinePosProcessamento, etapas_padrao
+
+                        # Pós-processamento declarativo: cada etapa é pulada quando desativada ou sem efeito.
+                        # A memória de etapas sem efeito fica na sessão para valer entre execuções.
+                        pipeline = PipelinePosProcessamento(etapas_padrao(
+                            usar_ml=usar_ml, usar_reserva_regioes=usar_reserva_regioes,
+                            balanceamento_auto=balanceamento_auto, usar_vizinhanca=usar_vizinhanca
+                        ), memoria=st.session_state.setdefault('memoria_pipeline', {}))
+                        contexto, relatorio_etapas = pipeline.executar({
+                            'rotas_df': rotas_df, 'frota': frota, 'pedidos': pedidos_validos, 'matriz_distancias': matriz_distancias,
+                            'raio_km': 20,  # Altere conforme necessidade operacional
+                            'limite_pct': ajuste_capacidade_pct,
+                        })
+                        rotas_df, pedidos_validos = contexto['rotas_df'], contexto['pedidos']
+                        executadas = set(relatorio_etapas.loc[relatorio_etapas['Status'] != 'pulada', 'Etapa'])
+
+                        n_realocados = contexto.get('n_realocados', 0)
                         if n_realocados > 0:
                             st.info(f"{n_realocados} pedidos foram realocados para veículos com regiões preferidas.")
-
-                        # Restringir cada veículo a até 2 regiões próximas
-                        rotas_df = restringir_1_regiao_por_veiculo(rotas_df, raio_km=raio_max_km, pedidos=pedidos_validos)
-                        n_restritos = rotas_df['Alocacao_Restrita'].sum() if 'Alocacao_Restrita' in rotas_df.columns else 0
-                        if n_restritos > 0:
-                            st.warning(f"{n_restritos} pedidos estão fora das regiões permitidas do veículo e foram marcados como restritos.")
-
-                        # Realocação automática de pedidos restritos
-                        rotas_df, n_realocados_restritos = realocar_pedidos_restritos(rotas_df, frota, pedidos_validos, raio_km=raio_max_km)
+                        n_realocados_restritos = contexto.get('n_realocados_restritos', 0)
                         if n_realocados_restritos > 0:
                             st.success(f"{n_realocados_restritos} pedidos restritos foram realocados automaticamente para veículos vizinhos com capacidade e região compatível.")
                         n_restritos_final = rotas_df['Alocacao_Restrita'].sum() if 'Alocacao_Restrita' in rotas_df.columns else 0
                         if n_restritos_final > 0:
                             st.warning(f"{n_restritos_final} pedidos permanecem restritos após tentativa de realocação automática.")
-
-                        # ML agrupamento (placeholder)
-                        if usar_ml:
-                            pedidos_validos = sugerir_agrupamento_ml(pedidos_validos)
+                        if 'Agrupamento por ML' in executadas:
                             st.info("Agrupamento sugerido por ML aplicado (experimental).")
-                        # Reserva de veículos para regiões críticas
-                        if usar_reserva_regioes:
-                            rotas_df = reservar_veiculos_para_regioes(rotas_df, frota, pedidos_validos, n_reservas=min(2, len(frota)))
+                        if 'Reservar veículos para regiões' in executadas:
                             st.info("Reserva de veículos para regiões críticas aplicada.")
-                        # Balanceamento iterativo (peso, paradas, região)
-                        if balanceamento_auto:
-                            rotas_df = balanceamento_iterativo(rotas_df, frota, pedidos_validos, matriz_distancias)
+                        if 'Balanceamento iterativo' in executadas:
                             st.info("Balanceamento avançado aplicado: peso, paradas, região e vizinhança.")
-                        # Heurística de vizinhança extra (opcional)
-                        if usar_vizinhanca:
-                            rotas_df = mover_para_vizinho_proximo(rotas_df, matriz_distancias)
+                        if 'Vizinhança (relocate)' in executadas:
                             st.info("Heurística de vizinhança aplicada após balanceamento.")
 
-                        # --- Checagem de excesso de carga (ajuste conforme slider) ---
-                        from routing.pos_processamento import checar_e_corrigir_excesso_carga
-                        rotas_df, excesso_final = checar_e_corrigir_excesso_carga(rotas_df, frota, limite_pct=ajuste_capacidade_pct)
+                        excesso_final = contexto.get('excesso_final') or []
                         if excesso_final:
                             st.error(f"Atenção: Alguns veículos ultrapassaram o limite de {ajuste_capacidade_pct}% da capacidade após o balanceamento!")
                             for veic, demanda, cap in excesso_final:
                                 st.warning(f"Veículo {veic}: {demanda:.1f} kg (limite: {cap:.1f} kg)")
+                        if 'Latitude' not in rotas_df.columns:
+                            st.warning("Não foi possível adicionar coordenadas ao DataFrame de rotas (coluna 'Pedido_Index_DF' ou 'pedidos_validos' ausente/vazio).")
 
-                        # Garante que a coluna 'Região' existe em rotas_df
-                        if 'Região' not in rotas_df.columns:
-                            rotas_df['Região'] = None
-
-                        # Propaga a coluna 'Região' dos pedidos para rotas_df, se existir
-                        if 'Pedido_Index_DF' in rotas_df.columns and 'Região' in pedidos_validos.columns:
-                            try:
-                                regioes_to_merge = pedidos_validos.reset_index(drop=True).reset_index()[['index', 'Região']].copy()
-                                regioes_to_merge = regioes_to_merge.rename(columns={'index': 'Pedido_Index_DF'})
-                                rotas_df = pd.merge(
-                                    rotas_df,
-                                    regioes_to_merge,
-                                    on='Pedido_Index_DF',
-                                    how='left',
-                                    suffixes=(None, '_pedido')
-                                )
-                            except Exception as merge_reg_err:
-                                st.warning(f"Não foi possível adicionar a coluna 'Região' ao DataFrame de rotas: {merge_reg_err}")
-
-                        if 'Pedido_Index_DF' in rotas_df.columns and not pedidos_validos.empty:
-                            try:
-                                coords_to_merge = pedidos_validos.reset_index(drop=True).reset_index()[['index', 'Latitude', 'Longitude']].copy()
-                                coords_to_merge = coords_to_merge.rename(columns={'index': 'Pedido_Index_DF'})
-                                rotas_df = pd.merge(
-                                    rotas_df,
-                                    coords_to_merge,
-                                    on='Pedido_Index_DF',
-                                    how='left',
-                                    suffixes=(None, '_pedido')
-                                )
-                                st.info("Coordenadas adicionadas ao DataFrame de rotas.")
-                            except Exception as merge_err:
-                                st.warning(f"Não foi possível adicionar coordenadas ao DataFrame de rotas: {merge_err}")
-                        else:
-                             st.warning("Não foi possível adicionar coordenadas ao DataFrame de rotas (coluna 'Pedido_Index_DF' ou 'pedidos_validos' ausente/vazio).")
+                        with st.expander("Etapas do pós-processamento (tempo e distância)", expanded=False):
+                            st.dataframe(relatorio_etapas, use_container_width=True)
 
                         with st.expander("Visualizar Tabela de Rotas Geradas (com Coordenadas)", expanded=True):
                             st.dataframe(rotas_df, use_container_width=True)
@@ -762,6 +796,22 @@ def show():
                             'pedidos_nao_alocados': pedidos_nao_alocados
                         }
                         st.session_state.cenarios_roteirizacao.insert(0, cenario)
+
+                        # Persiste o cenário no repositório (sobrevive ao reinício da aplicação)
+                        try:
+                            from routing.repositorio_cenarios import salvar_cenario
+                            salvar_cenario(
+                                rotas_df,
+                                metricas={k: cenario[k] for k in (
+                                    'qtd_pedidos_roteirizados', 'qtd_veiculos_utilizados', 'qtd_veiculos_disponiveis',
+                                    'peso_total_empenhado_kg', 'distancia_total_real_m', 'custo_solver_sec', 'tempo_operacao_sec'
+                                )},
+                                parametros={k: cenario[k] for k in ('endereco_partida', 'lat_partida', 'lon_partida')},
+                                matriz_distancias=matriz_distancias, tipo=tipo, status=status_solver,
+                                tabelas_extras={'pedidos_nao_alocados': pedidos_nao_alocados},
+                            )
+                        except Exception as repo_err:
+                            st.warning(f"Não foi possível gravar o cenário no repositório: {repo_err}")
                     else:
                         st.info(f"Nenhuma rota gerada para {tipo}. Status: {status_solver}")
 
@@ -810,6 +860,14 @@ Se necessário, revise os dados de entrada, relaxe restrições ou tente com um
             ])
             st.dataframe(df_cenarios_display, use_container_width=True, hide_index=True)
 
+            with st.expander("Comparar cenários gravados (últimos 30 dias)", expanded=False):
+                from routing.repositorio_cenarios import comparar_cenarios
+                comparacao = comparar_cenarios(inicio=pd.Timestamp.now() - pd.Timedelta(days=30))
+                if comparacao.empty:
+                    st.info("Nenhum cenário gravado no período.")
+                else:
+                    st.dataframe(comparacao, use_container_width=True)
+
             cenario_indices = range(len(st.session_state.cenarios_roteirizacao))
             selected_idx = st.selectbox(
                 "Visualizar detalhes e mapa do cenário:",
@@ -0,0 +1,198 @@
+"""
+Busca local entre rotas sobre um PlanoRotas (routing.plano_rotas).
+
+Operadores (todos com custo delta em O(1) e checagem de capacidade):
+- relocate: move um pedido para junto de um vizinho em outra rota (ou para uma rota vazia);
+- swap: troca dois pedidos de rotas diferentes;
+- 2opt*: troca as caudas de duas rotas, criando o arco (u, v);
+- cross: troca trechos de 1 a max_segmento pedidos entre duas rotas (cross-exchange).
+
+Vizinhança granular: só são avaliados pares (u, v) em que v está entre os k vizinhos mais próximos de u.
+"""
+import time
+import logging
+
+import numpy as np
+
+from routing.busca_local import vizinhos_mais_proximos, dois_opt
+from routing.plano_rotas import PlanoRotas
+
+OPERADORES_INTER_ROTAS = ('relocate', 'swap', '2opt*', 'cross')
+
+
+def listas_de_vizinhos(plano, k=10):
+    """Para cada nó atendido, os k nós atendidos mais próximos (distância simetrizada). Retorna dict nó -> lista."""
+    nos = plano.nos_atendidos()
+    if len(nos) == 0:
+        return {}
+    sub = plano.matriz[np.ix_(nos, nos)]
+    vizinhos = nos[vizinhos_mais_proximos(sub + sub.T, k)]
+    return dict(zip(nos.tolist(), vizinhos.tolist()))
+
+
+def _cabe(plano, r, nova_carga):
+    # Aceita se respeita a capacidade ou, em rota já excedida, se não piora o excesso
+    return nova_carga <= plano.capacidades[r] + 1e-9 or nova_carga <= plano.cargas[r]
+
+
+def _relocate(plano, u, vizinhos):
+    d, dem = plano.d, plano.demandas
+    r, i = int(plano.rota_do_no[u]), int(plano.posicao_do_no[u])
+    a, b = plano.anterior(r, i), plano.seguinte(r, i)
+    ganho_remocao = d[a][u] + d[u][b] - d[a][b]
+    melhor = None
+    for v in vizinhos:
+        s = int(plano.rota_do_no[v])
+        if s == r or not _cabe(plano, s, plano.cargas[s] + dem[u]):
+            continue
+        j = int(plano.posicao_do_no[v])
+        for pos, x, y in ((j, plano.anterior(s, j), v), (j + 1, v, plano.seguinte(s, j))):
+            delta = d[x][u] + d[u][y] - d[x][y] - ganho_remocao
+            if delta < -1e-9 and (melhor is None or delta < melhor[0]):
+                melhor = (delta, s, pos)
+    vazias = np.flatnonzero(plano.cargas + dem[u] <= plano.capacidades)
+    vazias = [s for s in vazias if len(plano.rotas[s]) == 0]
+    if vazias:
+        dep = plano.depot_index
+        delta = d[dep][u] + d[u][dep] - ganho_remocao
+        if delta < -1e-9 and (melhor is None or delta < melhor[0]):
+            melhor = (delta, int(vazias[0]), 0)
+    if melhor is None:
+        return 0.0
+    delta, s, pos = melhor
+    plano.atualizar_rota(r, np.delete(plano.rotas[r], i))
+    plano.atualizar_rota(s, np.insert(plano.rotas[s], pos, u))
+    return -delta
+
+
+def _swap(plano, u, vizinhos):
+    d, dem = plano.d, plano.demandas
+    r, i = int(plano.rota_do_no[u]), int(plano.posicao_do_no[u])
+    a, b = plano.anterior(r, i), plano.seguinte(r, i)
+    for v in vizinhos:
+        s = int(plano.rota_do_no[v])
+        if s == r:
+            continue
+        if not (_cabe(plano, r, plano.cargas[r] - dem[u] + dem[v]) and _cabe(plano, s, plano.cargas[s] - dem[v] + dem[u])):
+            continue
+        j = int(plano.posicao_do_no[v])
+        c, e = plano.anterior(s, j), plano.seguinte(s, j)
+        delta = (d[a][v] + d[v][b] - d[a][u] - d[u][b]) + (d[c][u] + d[u][e] - d[c][v] - d[v][e])
+        if delta < -1e-9:
+            rota_r, rota_s = plano.rotas[r].copy(), plano.rotas[s].copy()
+            rota_r[i], rota_s[j] = v, u
+            plano.atualizar_rota(r, rota_r)
+            plano.atualizar_rota(s, rota_s)
+            return -delta
+    return 0.0
+
+
+def _dois_opt_estrela(plano, u, vizinhos):
+    d = plano.d
+    r, i = int(plano.rota_do_no[u]), int(plano.posicao_do_no[u])
+    nu = plano.seguinte(r, i)
+    pref_r = plano.prefixo_carga[r]
+    for v in vizinhos:
+        s = int(plano.rota_do_no[v])
+        if s == r:
+            continue
+        j = int(plano.posicao_do_no[v])
+        pv = plano.anterior(s, j)
+        pref_s = plano.prefixo_carga[s]
+        carga_r = pref_r[i + 1] + (plano.cargas[s] - pref_s[j])
+        carga_s = pref_s[j] + (plano.cargas[r] - pref_r[i + 1])
+        if not (_cabe(plano, r, carga_r) and _cabe(plano, s, carga_s)):
+            continue
+        delta = d[u][v] + d[pv][nu] - d[u][nu] - d[pv][v]
+        if delta < -1e-9:
+            rota_r, rota_s = plano.rotas[r], plano.rotas[s]
+            plano.atualizar_rota(r, np.r_[rota_r[:i + 1], rota_s[j:]])
+            plano.atualizar_rota(s, np.r_[rota_s[:j], rota_r[i + 1:]])
+            return -delta
+    return 0.0
+
+
+def _cross(plano, u, vizinhos, max_segmento):
+    d = plano.d
+    r, i = int(plano.rota_do_no[u]), int(plano.posicao_do_no[u])
+    rota_r, pref_r = plano.rotas[r], plano.prefixo_carga[r]
+    pu = plano.anterior(r, i)
+    for v in vizinhos:
+        s = int(plano.rota_do_no[v])
+        if s == r:
+            continue
+        j = int(plano.posicao_do_no[v])
+        rota_s, pref_s = plano.rotas[s], plano.prefixo_carga[s]
+        pv = plano.anterior(s, j)
+        for a in range(1, min(max_segmento, len(rota_r) - i) + 1):
+            fim_r, nr = int(rota_r[i + a - 1]), plano.seguinte(r, i + a - 1)
+            carga_seg_r = pref_r[i + a] - pref_r[i]
+            for b in range(1, min(max_segmento, len(rota_s) - j) + 1):
+                if a == 1 and b == 1:
+                    continue  # equivale ao swap
+                fim_s, ns = int(rota_s[j + b - 1]), plano.seguinte(s, j + b - 1)
+                carga_seg_s = pref_s[j + b] - pref_s[j]
+                if not (_cabe(plano, r, plano.cargas[r] - carga_seg_r + carga_seg_s)
+                        and _cabe(plano, s, plano.cargas[s] - carga_seg_s + carga_seg_r)):
+                    continue
+                delta = (d[pu][v] + d[fim_s][nr] + d[pv][u] + d[fim_r][ns]
+                         - d[pu][u] - d[fim_r][nr] - d[pv][v] - d[fim_s][ns])
+                if delta < -1e-9:
+                    plano.atualizar_rota(r, np.r_[rota_r[:i], rota_s[j:j + b], rota_r[i + a:]])
+                    plano.atualizar_rota(s, np.r_[rota_s[:j], rota_r[i:i + a], rota_s[j + b:]])
+                    return -delta
+    return 0.0
+
+
+def busca_inter_rotas(plano, operadores=OPERADORES_INTER_ROTAS, k_vizinhos=10, max_segmento=3, tempo_limite_s=None):
+    """
+    Aplica os operadores (primeira melhoria) sobre todos os nós até uma passada sem melhoria ou até o
+    limite de tempo. Modifica o plano no lugar e retorna o ganho total de distância.
+    """
+    for operador in operadores:
+        if operador not in OPERADORES_INTER_ROTAS:
+            raise ValueError(f"Operador entre rotas desconhecido: {operador}")
+    vizinhos = listas_de_vizinhos(plano, k_vizinhos)
+    limite = time.perf_counter() + tempo_limite_s if tempo_limite_s else None
+    ganho_total = 0.0
+    melhorou = True
+    while melhorou:
+        melhorou = False
+        for u in list(vizinhos):
+            if limite is not None and time.perf_counter() > limite:
+                logging.info("Busca entre rotas interrompida pelo limite de tempo.")
+                return ganho_total
+            for operador in operadores:
+                if operador == 'relocate':
+                    ganho = _relocate(plano, u, vizinhos[u])
+                elif operador == 'swap':
+                    ganho = _swap(plano, u, vizinhos[u])
+                elif operador == '2opt*':
+                    ganho = _dois_opt_estrela(plano, u, vizinhos[u])
+                else:
+                    ganho = _cross(plano, u, vizinhos[u], max_segmento)
+                if ganho > 0:
+                    ganho_total += ganho
+                    melhorou = True
+                    break
+    return ganho_total
+
+
+def melhorar_rotas_df(rotas_df, matriz_distancias, frota=None, depot_index=0, limite_pct=100, reotimizar_intra=True, **kwargs):
+    """
+    Melhora um rotas_df com a busca entre rotas e (opcionalmente) 2-opt em cada rota no final.
+    kwargs vão para busca_inter_rotas. Retorna o rotas_df re-sequenciado.
+    """
+    if rotas_df is None or rotas_df.empty or 'Node_Index_OR' not in rotas_df.columns:
+        return rotas_df
+    plano = PlanoRotas.de_rotas_df(rotas_df, matriz_distancias, frota, depot_index, limite_pct)
+    custo_inicial = plano.custo_total()
+    busca_inter_rotas(plano, **kwargs)
+    if reotimizar_intra:
+        for r, nos in enumerate(plano.rotas):
+            if len(nos) > 2:
+                rota, ganho = dois_opt([depot_index] + nos.tolist() + [depot_index], plano.matriz)
+                if ganho > 0:
+                    plano.atualizar_rota(r, rota[1:-1])
+    logging.info(f"Busca entre rotas: distância {custo_inicial:.0f} -> {plano.custo_total():.0f}.")
+    return plano.para_rotas_df(rotas_df)
@@ -0,0 +1,410 @@
+"""
+Busca local intra-rota com avaliação incremental (delta) dos movimentos.
+
+2-opt:
+- cada movimento é avaliado em O(1) a partir dos arcos afetados; em matrizes assimétricas o custo do trecho
+  invertido vem de somas prefixadas nos dois sentidos (atualizadas só quando um movimento é aplicado);
+- candidatos restritos aos k vizinhos mais próximos de cada nó;
+- don't-look bits: só nós cujos arcos mudaram voltam para a fila;
+- inversões aplicadas no próprio array da rota.
+
+Or-opt (trechos de 1 a 3 paradas, com ou sem inversão) e 3-opt (as quatro reconexões puras) avaliam todos os
+candidatos de uma vez com NumPy, em modo 'first' (aplica a primeira origem que melhora) ou 'best' (aplica o
+melhor movimento da vizinhança), sempre com limite de tempo opcional.
+
+As rotas são listas de índices da matriz de distâncias com extremidades fixas (normalmente o depósito).
+
+otimizar_rotas otimiza todas as rotas de um plano de uma vez, em paralelo: as rotas são independentes, então
+cada processo recebe só a sequência e lê a matriz de um bloco de memória compartilhada (sem copiá-la por rota).
+"""
+import os
+import time
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+
+def vizinhos_mais_proximos(matriz, k):
+    """Para cada linha da matriz, os índices dos k nós mais próximos (excluindo o próprio), do mais próximo ao mais distante."""
+    matriz = np.asarray(matriz, dtype=float)
+    n = matriz.shape[0]
+    k = max(0, min(k, n - 1))
+    if k == 0:
+        return np.zeros((n, 0), dtype=np.int64)
+    dist = matriz.copy()
+    np.fill_diagonal(dist, np.inf)
+    candidatos = np.argpartition(dist, k - 1, axis=1)[:, :k]
+    ordem = np.argsort(np.take_along_axis(dist, candidatos, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidatos, ordem, axis=1)
+
+
+class _RotaIndexada:
+    """
+    Rota em índices locais (0..m-1 = nós distintos da rota) com posição de cada nó e somas prefixadas
+    dos custos nos dois sentidos. As extremidades (depósito) são fixas.
+    """
+
+    def __init__(self, rota, matriz):
+        rota = np.asarray(rota, dtype=np.int64)
+        self.nos_globais, caminho = np.unique(rota, return_inverse=True)
+        sub = np.asarray(matriz)[np.ix_(self.nos_globais, self.nos_globais)]
+        self.simetrica = bool(np.array_equal(sub, sub.T))
+        self.sub = sub
+        self.d = sub.tolist()
+        self.caminho = caminho.tolist()
+        self.pos = [0] * len(self.nos_globais)
+        for p, no in enumerate(self.caminho):
+            self.pos[no] = p
+        self.inicio, self.fim = self.caminho[0], self.caminho[-1]
+        self._atualizar_prefixos()
+
+    def _atualizar_prefixos(self):
+        if self.simetrica:
+            return
+        c = np.asarray(self.caminho)
+        self.ida = np.r_[0, np.cumsum(self.sub[c[:-1], c[1:]])].tolist()
+        self.volta = np.r_[0, np.cumsum(self.sub[c[1:], c[:-1]])].tolist()
+
+    def posicoes(self, no):
+        """Posições possíveis de um nó (as extremidades podem ser o mesmo nó)."""
+        if no == self.inicio or no == self.fim:
+            return [p for p, e in ((0, self.inicio), (len(self.caminho) - 1, self.fim)) if e == no]
+        return [self.pos[no]]
+
+    def delta_inversao(self, s, e):
+        """Variação do custo ao inverter o trecho caminho[s..e] (1 <= s < e <= len-2)."""
+        c, d = self.caminho, self.d
+        a, b, x, y = c[s - 1], c[s], c[e], c[e + 1]
+        delta = d[a][x] + d[b][y] - d[a][b] - d[x][y]
+        if not self.simetrica:
+            delta += (self.volta[e] - self.volta[s]) - (self.ida[e] - self.ida[s])
+        return delta
+
+    def inverter(self, s, e):
+        c = self.caminho
+        c[s:e + 1] = c[s:e + 1][::-1]
+        for p in range(s, e + 1):
+            self.pos[c[p]] = p
+        self._atualizar_prefixos()
+
+    def rota_global(self):
+        return self.nos_globais[self.caminho].tolist()
+
+
+def _candidatos_2opt(p, q, ultimo):
+    """Trechos (s, e) cuja inversão cria o arco entre as posições p e q (variantes sucessor e predecessor)."""
+    s1, e1 = (p + 1, q) if q > p else (q + 1, p)
+    s2, e2 = (p, q - 1) if q > p else (q, p - 1)
+    return [(s, e) for s, e in ((s1, e1), (s2, e2)) if 1 <= s < e <= ultimo - 1]
+
+
+def dois_opt(rota, matriz_distancias, k_vizinhos=10, tempo_limite_s=None):
+    """
+    2-opt com avaliação em O(1), listas de k vizinhos e don't-look bits.
+    Retorna (rota_otimizada, ganho_total). As extremidades da rota não se movem.
+    """
+    rota = list(rota)
+    if len(rota) <= 3:
+        return rota, 0
+    r = _RotaIndexada(rota, matriz_distancias)
+    vizinhos = vizinhos_mais_proximos(r.sub, k_vizinhos).tolist()
+    ultimo = len(r.caminho) - 1
+    fila = deque(no for no in r.caminho[1:-1])
+    na_fila = [False] * len(r.nos_globais)
+    for no in fila:
+        na_fila[no] = True
+    limite = time.perf_counter() + tempo_limite_s if tempo_limite_s else None
+    ganho_total = 0
+
+    while fila:
+        if limite is not None and time.perf_counter() > limite:
+            logging.info("2-opt interrompido pelo limite de tempo.")
+            break
+        x = fila.popleft()
+        na_fila[x] = False
+        p = r.pos[x]
+        melhor = (-1e-9, None)
+        for y in vizinhos[x]:
+            for q in r.posicoes(y):
+                for s, e in _candidatos_2opt(p, q, ultimo):
+                    delta = r.delta_inversao(s, e)
+                    if delta < melhor[0]:
+                        melhor = (delta, (s, e))
+        if melhor[1] is None:
+            continue
+        s, e = melhor[1]
+        afetados = (r.caminho[s - 1], r.caminho[s], r.caminho[e], r.caminho[e + 1])
+        r.inverter(s, e)
+        ganho_total -= melhor[0]
+        for no in afetados + (x,):
+            if not na_fila[no] and no != r.inicio and no != r.fim:
+                na_fila[no] = True
+                fila.append(no)
+    return r.rota_global(), ganho_total
+
+
+def _preparar(rota, matriz):
+    """Converte a rota para índices locais e devolve (nos_globais, caminho, submatriz float)."""
+    nos_globais, caminho = np.unique(np.asarray(rota, dtype=np.int64), return_inverse=True)
+    sub = np.asarray(matriz, dtype=float)[np.ix_(nos_globais, nos_globais)]
+    return nos_globais, caminho.astype(np.int64), sub
+
+
+def _prefixos(sub, c):
+    """Somas prefixadas dos custos no sentido da rota (ida) e no sentido inverso (volta)."""
+    ida = np.r_[0.0, np.cumsum(sub[c[:-1], c[1:]])]
+    volta = np.r_[0.0, np.cumsum(sub[c[1:], c[:-1]])]
+    return ida, volta
+
+
+def _melhor_or_opt(sub, c, max_segmento, modo):
+    """Melhor movimento Or-opt: (delta, s, e, j, invertido) ou None. Move c[s..e] para entre c[j] e c[j+1]."""
+    ultimo = len(c) - 1
+    ida, volta = _prefixos(sub, c)
+    arestas = np.arange(ultimo)
+    custo_aresta = sub[c[arestas], c[arestas + 1]]
+    melhor = None
+    for s in range(1, ultimo):
+        for m in range(1, max_segmento + 1):
+            e = s + m - 1
+            if e > ultimo - 1:
+                break
+            p, n = c[s - 1], c[e + 1]
+            ganho_remocao = sub[p, c[s]] + sub[c[e], n] - sub[p, n]
+            validas = (arestas < s - 1) | (arestas > e)
+            j = arestas[validas]
+            base = custo_aresta[validas] + ganho_remocao
+            delta_ida = sub[c[j], c[s]] + sub[c[e], c[j + 1]] - base
+            delta_volta = sub[c[j], c[e]] + sub[c[s], c[j + 1]] - base + (volta[e] - volta[s]) - (ida[e] - ida[s])
+            for delta, invertido in ((delta_ida, False), (delta_volta, True)):
+                if len(delta) == 0:
+                    continue
+                k = int(np.argmin(delta))
+                if delta[k] < -1e-9 and (melhor is None or delta[k] < melhor[0]):
+                    melhor = (float(delta[k]), s, e, int(j[k]), invertido)
+        if modo == 'first' and melhor is not None:
+            break
+    return melhor
+
+
+def _aplicar_or_opt(c, s, e, j, invertido):
+    trecho = c[s:e + 1][::-1] if invertido else c[s:e + 1]
+    resto = np.r_[c[:s], c[e + 1:]]
+    destino = j + 1 if j < s else j + 1 - (e - s + 1)
+    return np.r_[resto[:destino], trecho, resto[destino:]]
+
+
+def or_opt(rota, matriz_distancias, max_segmento=3, modo='first', tempo_limite_s=None):
+    """
+    Or-opt: move trechos de 1 a max_segmento paradas para outra posição da rota (também invertidos).
+    modo='first' aplica o melhor destino da primeira origem que melhora; 'best' o melhor movimento global.
+    Retorna (rota_otimizada, ganho_total).
+    """
+    rota = list(rota)
+    if len(rota) <= 3:
+        return rota, 0
+    nos_globais, c, sub = _preparar(rota, matriz_distancias)
+    limite = time.perf_counter() + tempo_limite_s if tempo_limite_s else None
+    ganho_total = 0.0
+    while limite is None or time.perf_counter() < limite:
+        movimento = _melhor_or_opt(sub, c, max_segmento, modo)
+        if movimento is None:
+            break
+        delta, s, e, j, invertido = movimento
+        c = _aplicar_or_opt(c, s, e, j, invertido)
+        ganho_total -= delta
+    return nos_globais[c].tolist(), ganho_total
+
+
+def _melhor_tres_opt_a_partir(sub, c, i, ida, volta):
+    """Melhor reconexão 3-opt pura que remove a aresta (c[i], c[i+1]): (delta, i, j, k, caso) ou None."""
+    ultimo = len(c) - 1
+    if i > ultimo - 3:
+        return None
+    J = np.arange(i + 1, ultimo - 1)[:, None]
+    K = np.arange(i + 2, ultimo)[None, :]
+    valido = K > J
+    a, b1, b2, c1, c2, d = c[i], c[i + 1], c[J], c[J + 1], c[K], c[K + 1]
+    base = sub[a, b1] + sub[b2, c1] + sub[c2, d]
+    inv_b = (volta[J] - volta[i + 1]) - (ida[J] - ida[i + 1])
+    inv_c = (volta[K] - volta[J + 1]) - (ida[K] - ida[J + 1])
+    casos = (
+        sub[a, b2] + sub[b1, c2] + sub[c1, d] + inv_b + inv_c - base,  # A B' C' D
+        sub[a, c1] + sub[c2, b1] + sub[b2, d] - base,                  # A C B D
+        sub[a, c1] + sub[c2, b2] + sub[b1, d] + inv_b - base,          # A C B' D
+        sub[a, c2] + sub[c1, b1] + sub[b2, d] + inv_c - base,          # A C' B D
+    )
+    melhor = None
+    for caso, delta in enumerate(casos):
+        delta = np.where(valido, delta, np.inf)
+        pos = np.unravel_index(int(np.argmin(delta)), delta.shape)
+        if delta[pos] < -1e-9 and (melhor is None or delta[pos] < melhor[0]):
+            melhor = (float(delta[pos]), i, int(J[pos[0], 0]), int(K[0, pos[1]]), caso)
+    return melhor
+
+
+def _aplicar_tres_opt(c, i, j, k, caso):
+    A, B, C, D = c[:i + 1], c[i + 1:j + 1], c[j + 1:k + 1], c[k + 1:]
+    meio = (
+        (B[::-1], C[::-1]),
+        (C, B),
+        (C, B[::-1]),
+        (C[::-1], B),
+    )[caso]
+    return np.r_[A, meio[0], meio[1], D]
+
+
+def tres_opt(rota, matriz_distancias, modo='first', tempo_limite_s=None):
+    """
+    3-opt com as quatro reconexões puras (sem os casos que se reduzem a 2-opt), avaliadas em blocos NumPy.
+    Retorna (rota_otimizada, ganho_total).
+    """
+    rota = list(rota)
+    if len(rota) <= 4:
+        return rota, 0
+    nos_globais, c, sub = _preparar(rota, matriz_distancias)
+    limite = time.perf_counter() + tempo_limite_s if tempo_limite_s else None
+    ganho_total = 0.0
+    melhorou = True
+    while melhorou:
+        melhorou = False
+        ida, volta = _prefixos(sub, c)
+        melhor = None
+        for i in range(len(c) - 3):
+            if limite is not None and time.perf_counter() > limite:
+                break
+            movimento = _melhor_tres_opt_a_partir(sub, c, i, ida, volta)
+            if movimento is not None and (melhor is None or movimento[0] < melhor[0]):
+                melhor = movimento
+                if modo == 'first':
+                    break
+        if melhor is not None:
+            delta, i, j, k, caso = melhor
+            c = _aplicar_tres_opt(c, i, j, k, caso)
+            ganho_total -= delta
+            melhorou = limite is None or time.perf_counter() < limite
+    return nos_globais[c].tolist(), ganho_total
+
+
+def otimizar_rota(rota, matriz_distancias, operadores=('2opt', 'oropt', '3opt'), modo='first', tempo_limite_s=None):
+    """
+    Descida em vizinhança variável: aplica os operadores em sequência e recomeça do primeiro sempre que
+    algum melhora a rota. Retorna (rota_otimizada, ganho_total).
+    """
+    limite = time.perf_counter() + tempo_limite_s if tempo_limite_s else None
+    ganho_total = 0.0
+    rota = list(rota)
+    indice = 0
+    while indice < len(operadores):
+        restante = None if limite is None else limite - time.perf_counter()
+        if restante is not None and restante <= 0:
+            break
+        operador = operadores[indice]
+        if operador == '2opt':
+            rota, ganho = dois_opt(rota, matriz_distancias, tempo_limite_s=restante)
+        elif operador == 'oropt':
+            rota, ganho = or_opt(rota, matriz_distancias, modo=modo, tempo_limite_s=restante)
+        elif operador == '3opt':
+            rota, ganho = tres_opt(rota, matriz_distancias, modo=modo, tempo_limite_s=restante)
+        else:
+            raise ValueError(f"Operador de busca local desconhecido: {operador}")
+        ganho_total += ganho
+        indice = 0 if ganho > 1e-9 and indice > 0 else indice + 1
+    return rota, ganho_total
+
+
+# Matriz vista pelos processos de otimizar_rotas (array sobre o bloco de memória compartilhada)
+_matriz_trabalhador = None
+_memoria_trabalhador = None
+
+
+def _iniciar_trabalhador(nome, forma):
+    global _matriz_trabalhador, _memoria_trabalhador
+    _memoria_trabalhador = shared_memory.SharedMemory(name=nome)
+    _matriz_trabalhador = np.ndarray(forma, dtype=float, buffer=_memoria_trabalhador.buf)
+
+
+def _otimizar_com_estatisticas(rota, matriz, kwargs):
+    inicio = time.perf_counter()
+    caminho = np.asarray(rota, dtype=np.int64)
+    custo_inicial = float(matriz[caminho[:-1], caminho[1:]].sum()) if len(caminho) > 1 else 0.0
+    nova, ganho = otimizar_rota(rota, matriz, **kwargs)
+    return nova, {
+        'paradas': max(0, len(caminho) - 2), 'custo_inicial': custo_inicial, 'custo_final': custo_inicial - ganho,
+        'ganho': ganho, 'ganho_pct': 100.0 * ganho / custo_inicial if custo_inicial > 0 else 0.0,
+        'tempo_s': time.perf_counter() - inicio,
+    }
+
+
+def _otimizar_no_trabalhador(rota, kwargs):
+    return _otimizar_com_estatisticas(rota, _matriz_trabalhador, kwargs)
+
+
+def otimizar_rotas(rotas, matriz_distancias, n_processos=None, **kwargs):
+    """
+    Aplica otimizar_rota (kwargs repassados) a cada rota, em n_processos processos (padrão: número de CPUs).
+    A matriz vai uma única vez para memória compartilhada; as rotas são distribuídas da maior para a menor.
+    Retorna (rotas_otimizadas, estatisticas), na ordem recebida, com um dict por rota: paradas,
+    custo_inicial, custo_final, ganho, ganho_pct e tempo_s.
+    """
+    matriz = np.ascontiguousarray(matriz_distancias, dtype=float)
+    rotas = [list(rota) for rota in rotas]
+    # Rotas com até uma parada não têm o que otimizar
+    pendentes = sorted((i for i, rota in enumerate(rotas) if len(rota) > 3), key=lambda i: -len(rotas[i]))
+    resultados = [(rota, None) for rota in rotas]
+    n_processos = min(n_processos or os.cpu_count() or 1, len(pendentes))
+    if n_processos <= 1:
+        for i in pendentes:
+            resultados[i] = _otimizar_com_estatisticas(rotas[i], matriz, kwargs)
+    else:
+        memoria = shared_memory.SharedMemory(create=True, size=max(1, matriz.nbytes))
+        try:
+            np.ndarray(matriz.shape, dtype=float, buffer=memoria.buf)[:] = matriz
+            with ProcessPoolExecutor(
+                max_workers=n_processos, initializer=_iniciar_trabalhador, initargs=(memoria.name, matriz.shape)
+            ) as executor:
+                futuros = {i: executor.submit(_otimizar_no_trabalhador, rotas[i], kwargs) for i in pendentes}
+                for i, futuro in futuros.items():
+                    resultados[i] = futuro.result()
+        finally:
+            memoria.close()
+            memoria.unlink()
+    otimizadas, estatisticas = [], []
+    for rota, stats in resultados:
+        if stats is None:
+            custo = float(matriz[rota[:-1], rota[1:]].sum()) if len(rota) > 1 else 0.0
+            stats = {'paradas': max(0, len(rota) - 2), 'custo_inicial': custo, 'custo_final': custo, 'ganho': 0.0,
+                     'ganho_pct': 0.0, 'tempo_s': 0.0}
+        otimizadas.append(rota)
+        estatisticas.append(stats)
+    ganho = sum(s['ganho'] for s in estatisticas)
+    logging.info(f"Busca local em lote: {len(pendentes)} rotas otimizadas em {n_processos} processo(s), ganho total {ganho:.0f}.")
+    return otimizadas, estatisticas
+
+
+def otimizar_rotas_df(rotas_df, matriz_distancias, depot_index=0, n_processos=1, **kwargs):
+    """
+    Aplica otimizar_rota à sequência de cada veículo de um rotas_df (colunas 'Veículo', 'Sequencia',
+    'Node_Index_OR'), em lote via otimizar_rotas. Reordena as linhas, renumera 'Sequencia' e recalcula
+    'Carga_Acumulada' se existir.
+    """
+    if rotas_df is None or rotas_df.empty:
+        return rotas_df
+    grupos = list(rotas_df.sort_values(['Veículo', 'Sequencia'], kind='stable').groupby('Veículo', sort=False))
+    rotas = [[depot_index] + grupo['Node_Index_OR'].astype(np.int64).tolist() + [depot_index] for _, grupo in grupos]
+    rotas, _ = otimizar_rotas(rotas, matriz_distancias, n_processos=n_processos, **kwargs)
+    partes = []
+    for (veiculo, grupo), rota in zip(grupos, rotas):
+        nos = grupo['Node_Index_OR'].to_numpy(dtype=np.int64)
+        ordem = {no: p for p, no in enumerate(rota[1:-1])}
+        grupo = grupo.iloc[np.argsort([ordem[no] for no in nos], kind='stable')].copy()
+        grupo['Sequencia'] = np.arange(1, len(grupo) + 1)
+        if 'Carga_Acumulada' in grupo.columns and 'Demanda' in grupo.columns:
+            demanda = grupo['Demanda'].to_numpy()
+            grupo['Carga_Acumulada'] = np.cumsum(demanda) - demanda
+        partes.append(grupo)
+    return pd.concat(partes, ignore_index=True)
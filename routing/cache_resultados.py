@@ -0,0 +1,197 @@
+"""
+Cache de resultados do solver endereçado por conteúdo.
+
+A chave é um hash SHA-256 dos pedidos, da frota, da matriz de distâncias e dos parâmetros do solver.
+Os resultados (rotas_df + métricas) ficam em SQLite em database/cache_solver.db, com remoção das
+entradas menos usadas recentemente (LRU) quando o limite de entradas é ultrapassado. O rotas_df é gravado
+coluna a coluna com o mesmo formato do repositório de cenários (sem pickle).
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+CACHE_DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'database', 'cache_solver.db')
+MAX_ENTRADAS_CACHE = 50
+
+
+def _conexao(db_path=None):
+    conn = sqlite3.connect(db_path or CACHE_DB_PATH, check_same_thread=False)
+    conn.execute('''CREATE TABLE IF NOT EXISTS cache_solver (
+        chave TEXT PRIMARY KEY,
+        metricas TEXT,
+        criado_em REAL,
+        ultimo_acesso REAL,
+        n_acessos INTEGER DEFAULT 0
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS cache_colunas (
+        chave TEXT,
+        ordem INTEGER,
+        coluna TEXT,
+        tipo TEXT,
+        dados BLOB,
+        PRIMARY KEY (chave, ordem)
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS cache_tabelas (
+        chave TEXT PRIMARY KEY,
+        n_linhas INTEGER,
+        metadados TEXT
+    )''')
+    return conn
+
+
+def impressao_digital_df(df):
+    """Hash do conteúdo de um DataFrame (valores, índice, nomes e tipos das colunas)."""
+    h = hashlib.sha256()
+    if df is None:
+        return h.hexdigest()
+    h.update(json.dumps([str(c) for c in df.columns]).encode())
+    h.update(json.dumps([str(t) for t in df.dtypes]).encode())
+    try:
+        valores = pd.util.hash_pandas_object(df, index=True).values
+    except TypeError:
+        # Células com listas/dicts (ex.: Regiões Preferidas) não são hasheáveis: usa a representação textual
+        valores = pd.util.hash_pandas_object(df.astype(str), index=True).values
+    h.update(np.ascontiguousarray(valores).tobytes())
+    return h.hexdigest()
+
+
+def impressao_digital_matriz(matriz):
+    """Hash da matriz de distâncias (forma, tipo e bytes)."""
+    arr = np.ascontiguousarray(np.asarray(matriz))
+    h = hashlib.sha256()
+    h.update(f"{arr.shape}|{arr.dtype}".encode())
+    h.update(arr.tobytes())
+    return h.hexdigest()
+
+
+def _parametros_serializaveis(kwargs):
+    """Remove callbacks, eventos e objetos não determinísticos dos parâmetros do solver."""
+    params = {}
+    for k, v in sorted(kwargs.items()):
+        if callable(v) or isinstance(v, threading.Event):
+            continue
+        params[k] = v
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def chave_cache(pedidos, frota, matriz_distancias, nome_solver='', **kwargs):
+    """Gera a chave do cache a partir das impressões digitais das entradas e dos parâmetros do solver."""
+    partes = [
+        str(nome_solver),
+        impressao_digital_df(pedidos),
+        impressao_digital_df(frota),
+        impressao_digital_matriz(matriz_distancias),
+        _parametros_serializaveis(kwargs),
+    ]
+    return hashlib.sha256('|'.join(partes).encode()).hexdigest()
+
+
+def buscar_resultado(chave, db_path=None):
+    """Retorna (rotas_df, metricas) do cache ou None se a chave não existir."""
+    from routing.repositorio_cenarios import _montar_tabela
+    try:
+        conn = _conexao(db_path)
+        row = conn.execute(
+            'SELECT s.metricas, t.n_linhas, t.metadados FROM cache_solver s JOIN cache_tabelas t ON t.chave = s.chave WHERE s.chave = ?',
+            (chave,)
+        ).fetchone()
+        if row is None:
+            # Entradas gravadas com pickle por versões anteriores não têm cache_tabelas: tratadas como ausentes
+            conn.close()
+            return None
+        colunas = conn.execute('SELECT ordem, coluna, tipo, dados FROM cache_colunas WHERE chave = ?', (chave,)).fetchall()
+        conn.execute('UPDATE cache_solver SET ultimo_acesso = ?, n_acessos = n_acessos + 1 WHERE chave = ?', (time.time(), chave))
+        conn.commit()
+        conn.close()
+        return _montar_tabela(row[1], row[2], colunas), json.loads(row[0] or '{}')
+    except Exception as e:
+        logging.error(f"Erro ao ler cache de resultados: {e}")
+        return None
+
+
+def salvar_resultado(chave, rotas_df, metricas=None, db_path=None, max_entradas=MAX_ENTRADAS_CACHE):
+    """Grava o resultado no cache e remove as entradas menos usadas recentemente além de max_entradas."""
+    from routing.repositorio_cenarios import _serializar_tabela
+    try:
+        agora = time.time()
+        linhas, (_, _, n_linhas, metadados) = _serializar_tabela(chave, 'rotas', rotas_df)
+        conn = _conexao(db_path)
+        conn.execute(
+            'INSERT OR REPLACE INTO cache_solver (chave, metricas, criado_em, ultimo_acesso, n_acessos) VALUES (?, ?, ?, ?, 0)',
+            (chave, json.dumps(metricas or {}, default=str), agora, agora)
+        )
+        conn.execute('DELETE FROM cache_colunas WHERE chave = ?', (chave,))
+        conn.executemany(
+            'INSERT INTO cache_colunas (chave, ordem, coluna, tipo, dados) VALUES (?, ?, ?, ?, ?)',
+            [(chave, *linha[2:]) for linha in linhas]
+        )
+        conn.execute('INSERT OR REPLACE INTO cache_tabelas (chave, n_linhas, metadados) VALUES (?, ?, ?)', (chave, n_linhas, metadados))
+        conn.execute(
+            'DELETE FROM cache_solver WHERE chave NOT IN (SELECT chave FROM cache_solver ORDER BY ultimo_acesso DESC LIMIT ?)',
+            (int(max_entradas),)
+        )
+        conn.execute('DELETE FROM cache_colunas WHERE chave NOT IN (SELECT chave FROM cache_solver)')
+        conn.execute('DELETE FROM cache_tabelas WHERE chave NOT IN (SELECT chave FROM cache_solver)')
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logging.error(f"Erro ao gravar cache de resultados: {e}")
+
+
+def limpar_cache(db_path=None):
+    """Remove todas as entradas do cache."""
+    conn = _conexao(db_path)
+    conn.execute('DELETE FROM cache_solver')
+    conn.execute('DELETE FROM cache_colunas')
+    conn.execute('DELETE FROM cache_tabelas')
+    conn.commit()
+    conn.close()
+
+
+def metricas_rotas(rotas_df, tempo_solver_s=None):
+    """Métricas resumidas de um rotas_df para guardar junto ao resultado."""
+    if rotas_df is None or rotas_df.empty:
+        return {'n_paradas': 0, 'n_veiculos': 0, 'tempo_solver_s': tempo_solver_s}
+    return {
+        'n_paradas': int(len(rotas_df)),
+        'n_veiculos': int(rotas_df['Veículo'].nunique()) if 'Veículo' in rotas_df.columns else 0,
+        'demanda_total': float(rotas_df['Demanda'].sum()) if 'Demanda' in rotas_df.columns else 0.0,
+        'tempo_solver_s': tempo_solver_s,
+    }
+
+
+def executar_com_cache(solver, pedidos, frota, matriz_distancias, usar_cache=True, parametros_chave=None,
+                       db_path=None, **kwargs):
+    """
+    Executa solver(pedidos, frota, matriz_distancias, **kwargs) reaproveitando o resultado se as entradas forem idênticas.
+    - usar_cache=False ignora o cache (força novo cálculo) mas grava o novo resultado.
+    - parametros_chave: dict extra que entra na chave (ex.: critério de parada representado por callable em kwargs).
+    Retorna (rotas_df, metricas, veio_do_cache). Resultados vazios e de buscas interrompidas (cancelamento ou
+    critério de parada antecipada) não são gravados: cancelar/progress_callback não entram na chave.
+    """
+    nome_solver = f"{getattr(solver, '__module__', '')}.{getattr(solver, '__name__', '')}"
+    chave = chave_cache(pedidos, frota, matriz_distancias, nome_solver, **{**kwargs, **(parametros_chave or {})})
+    if usar_cache:
+        encontrado = buscar_resultado(chave, db_path)
+        if encontrado is not None:
+            logging.info(f"Cache de resultados: reutilizando solução {chave[:12]}.")
+            rotas_df, metricas = encontrado
+            return rotas_df, metricas, True
+
+    inicio = time.perf_counter()
+    rotas_df = solver(pedidos, frota, matriz_distancias, **kwargs)
+    metricas = metricas_rotas(rotas_df if isinstance(rotas_df, pd.DataFrame) else None, time.perf_counter() - inicio)
+    if isinstance(rotas_df, pd.DataFrame) and not rotas_df.empty:
+        cancelar = kwargs.get('cancelar')
+        if rotas_df.attrs.get('busca_interrompida') or (hasattr(cancelar, 'is_set') and cancelar.is_set()):
+            logging.info(f"Cache de resultados: busca interrompida, solução {chave[:12]} não será gravada.")
+        else:
+            salvar_resultado(chave, rotas_df, metricas, db_path)
+    return rotas_df, metricas, False
@@ -1,4 +1,5 @@
-def solver_cvrp(pedidos, frota, matriz_distancias, pos_processamento=None, **kwargs):
+def solver_cvrp(pedidos, frota, matriz_distancias, pos_processamento=None, progress_callback=None, cancelar=None,
+                tempo_limite_s=30, incluir_rotas_progresso=False, **kwargs):
     # Validação automática das coordenadas dos pedidos e do depósito
     from routing.utils import validar_coordenadas_dataframe
     ok_coord, msg_coord, df_invalidos = validar_coordenadas_dataframe(pedidos, lat_col='Latitude', lon_col='Longitude', nome_df='Pedidos')
@@ -10,6 +11,12 @@ def solver_cvrp(pedidos, frota, matriz_distancias, pos_processamento=None, **kwa
         return pd.DataFrame() # Retorna DataFrame vazio se houver coordenadas inválidas
     """Capacitated VRP: considera a capacidade máxima de carga dos veículos além da roteirização.
     Aceita argumentos extras para compatibilidade retroativa.
+    - progress_callback: função chamada a cada melhoria do objetivo durante a busca (recebe dict de progresso,
+      ver routing.ortools_utils.MonitorProgressoSolver).
+    - cancelar: função (recebe o dict de progresso e retorna True para parar) ou threading.Event; interrompe a
+      busca de forma cooperativa mantendo a melhor solução encontrada.
+    - tempo_limite_s: limite de tempo da busca em segundos (default: 30).
+    - incluir_rotas_progresso: se True, o dict de progresso inclui as rotas atuais ('rotas').
     """
     import pandas as pd
     from ortools.constraint_solver import pywrapcp, routing_enums_pb2
@@ -46,6 +53,7 @@ def solver_cvrp(pedidos, frota, matriz_distancias, pos_processamento=None, **kwa
         demands_series = pd.Series([1] * n_pedidos)
     # Adiciona 0 para o depósito no início da lista de demandas
     demands = [0] + demands_series.astype(int).tolist()
+    demands_arr = np.asarray(demands, dtype=np.int64)
 
     # Capacidade (garantir que seja numérica e tratar NaNs/zeros)
     if 'Capacidade (Kg)' in frota.columns:
@@ -58,8 +66,17 @@ def solver_cvrp(pedidos, frota, matriz_distancias, pos_processamento=None, **kwa
     # Garante que capacidade seja pelo menos 1
     capacities = capacities_series.astype(int).clip(lower=1).tolist()
 
+    # Agrupa veículos idênticos em classes (contíguas no modelo) e descarta excedentes que nunca seriam usados
+    from routing.ortools_utils import (
+        preparar_classes_de_veiculos, mapear_rotas_para_placas,
+        extrair_rotas_solucao, calcular_cargas_e_custos, montar_rotas_df, MonitorProgressoSolver
+    )
+    frota, capacities, classes_veiculos = preparar_classes_de_veiculos(frota, capacities, n_pedidos, logger=logger)
+    n_veiculos = len(frota)
+
     # Matriz de distâncias (já deve incluir o depósito no índice 0)
-    distance_matrix = np.array(matriz_distancias).astype(int).tolist() # Garante formato lista de listas de int
+    matriz_np = np.array(matriz_distancias).astype(int)
+    distance_matrix = matriz_np.tolist() # Garante formato lista de listas de int
     num_locations = len(distance_matrix)
 
     if num_locations != n_pedidos + 1:
@@ -101,7 +118,6 @@ def solver_cvrp(pedidos, frota, matriz_distancias, pos_processamento=None, **kwa
             True,  # Começar cumulativo em zero
             'Capacity'
         )
-        capacity_dimension = routing.GetDimensionOrDie('Capacity')
 
     except Exception as e:
         logger.error(f"Erro na configuração do OR-Tools: {e}")
@@ -115,79 +131,54 @@ def solver_cvrp(pedidos, frota, matriz_distancias, pos_processamento=None, **kwa
     search_parameters.local_search_metaheuristic = (
         routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
     )
-    search_parameters.time_limit.seconds = 30 # Adiciona um limite de tempo
+    search_parameters.time_limit.seconds = int(tempo_limite_s) # Adiciona um limite de tempo
+
+    # Monitor de progresso: transmite cada melhoria e permite cancelamento cooperativo
+    monitor = None
+    if progress_callback is not None or cancelar is not None:
+        monitor = MonitorProgressoSolver(
+            routing, manager, n_veiculos, progress_callback=progress_callback,
+            cancelar=cancelar, incluir_rotas=incluir_rotas_progresso, logger=logger
+        ).registrar()
 
     # --- Resolução ---
     logger.info("Iniciando a resolução do CVRP com OR-Tools...")
     solution = routing.SolveWithParameters(search_parameters)
+    if monitor is not None and monitor.cancelado:
+        solution = monitor.solucao_final(solution)
+        logger.info(f"Resolução do CVRP interrompida após {monitor.n_solucoes} soluções; usando a melhor encontrada.")
     logger.info("Resolução do CVRP concluída.")
 
     # --- Montagem do Resultado ---
-    routes_data = []
     if solution:
         logger.info("Solução encontrada. Processando rotas...")
-        total_distance_solution = 0
-        pedidos_roteirizados_indices = set()
-
-        for vehicle_id in range(n_veiculos):
-            index = routing.Start(vehicle_id)
-            sequence = 1 # Começa a sequência em 1 para o primeiro cliente
-            vehicle_identifier = (
-                frota['ID Veículo'].iloc[vehicle_id]
-                if 'ID Veículo' in frota.columns and not frota.empty else
-                frota['Placa'].iloc[vehicle_id] if 'Placa' in frota.columns and not frota.empty else f'veiculo_{vehicle_id+1}'
-            )
-            route_distance_vehicle = 0
-            route_load_vehicle = 0
-
-            while not routing.IsEnd(index):
-                node_index = manager.IndexToNode(index)
-                load_var = capacity_dimension.CumulVar(index)
-                current_load = solution.Value(load_var)
-
-                if node_index != depot_index: # Não adiciona o depósito como uma parada na sequência
-                    pedido_original_index = node_index - 1 # Ajusta para índice do DataFrame 'pedidos'
-                    if 0 <= pedido_original_index < n_pedidos:
-                        # Verifica se o pedido já foi roteirizado (não deveria acontecer com CVRP padrão)
-                        if pedido_original_index in pedidos_roteirizados_indices:
-                             logger.warning(f"Pedido {pedido_original_index} aparecendo em múltiplas rotas (Veículo {vehicle_identifier}). Verifique a lógica.")
-                        else:
-                            pedidos_roteirizados_indices.add(pedido_original_index)
-                            pedido_info = pedidos.iloc[pedido_original_index]
-                            routes_data.append({
-                                'Veículo': vehicle_identifier,
-                                'Sequencia': sequence,
-                                'Node_Index_OR': node_index, # Índice do nó no OR-Tools (inclui depósito)
-                                'Pedido_Index_DF': pedido_original_index, # Índice no DataFrame 'pedidos' original
-                                'ID Pedido': pedido_info.get('ID Pedido', f'Pedido_{pedido_original_index}'),
-                                'Cliente': pedido_info.get('Cliente', 'N/A'),
-                                'Endereço': pedido_info.get('Endereço', 'N/A'),
-                                'Demanda': demands[node_index],
-                                'Carga_Acumulada': current_load,
-                                # Adicionar Lat/Lon aqui pode ser útil, mas será feito merge depois
-                            })
-                            sequence += 1
-                            route_load_vehicle += demands[node_index] # Soma a demanda do nó atual
-                    else:
-                         logger.warning(f"Índice de pedido inválido ({pedido_original_index}) encontrado na rota do veículo {vehicle_identifier}.")
-
-                previous_index = index
-                index = solution.Value(routing.NextVar(index))
-                # Calcula a distância do arco
-                arc_distance = routing.GetArcCostForVehicle(previous_index, index, vehicle_id)
-                route_distance_vehicle += arc_distance
-
-            # Adiciona a distância do último nó de volta ao depósito (se houver rota)
-            if routing.IsEnd(index) and manager.IndexToNode(previous_index) != depot_index:
-                 end_node_index = routing.End(vehicle_id)
-                 arc_distance = routing.GetArcCostForVehicle(previous_index, end_node_index, vehicle_id)
-                 route_distance_vehicle += arc_distance
-
-            if sequence > 1: # Se o veículo fez alguma entrega
-                 logger.info(f"Veículo {vehicle_identifier}: {sequence-1} paradas, Carga={route_load_vehicle}, Dist={route_distance_vehicle/1000:.1f}km")
-                 total_distance_solution += route_distance_vehicle
-
-        rotas_df = pd.DataFrame(routes_data)
+        identificadores = [
+            frota['ID Veículo'].iloc[vehicle_id]
+            if 'ID Veículo' in frota.columns and not frota.empty else
+            frota['Placa'].iloc[vehicle_id] if 'Placa' in frota.columns and not frota.empty else f'veiculo_{vehicle_id+1}'
+            for vehicle_id in range(n_veiculos)
+        ]
+        # Extração em arrays (veículo, sequência, nó) e cálculo vetorizado de carga acumulada e custo por arco
+        veiculos_arr, sequencias_arr, nos_arr = extrair_rotas_solucao(routing, manager, solution, n_veiculos, n_pedidos)
+        resumo = calcular_cargas_e_custos(veiculos_arr, sequencias_arr, nos_arr, demands_arr, matriz_np, n_veiculos, depot_index)
+        total_distance_solution = resumo['distancia_por_veiculo'].sum()
+        pedidos_roteirizados_indices = np.unique(nos_arr) - 1
+        if len(pedidos_roteirizados_indices) < len(nos_arr):
+            logger.warning("Pedidos aparecendo em múltiplas rotas. Verifique a lógica.")
+
+        # Rotas de uma classe são anônimas: atribui as placas concretas da classe por ordem de carga
+        placas = mapear_rotas_para_placas(classes_veiculos, resumo['carga_por_veiculo'], identificadores)
+        paradas_por_veiculo = np.bincount(veiculos_arr, minlength=n_veiculos)
+        for vehicle_id in np.flatnonzero(paradas_por_veiculo):
+            logger.info(f"Veículo {placas[vehicle_id]}: {paradas_por_veiculo[vehicle_id]} paradas, Carga={resumo['carga_por_veiculo'][vehicle_id]:.0f}, Dist={resumo['distancia_por_veiculo'][vehicle_id]/1000:.1f}km")
+
+        rotas_df = montar_rotas_df(
+            pedidos, np.asarray(placas, dtype=object)[veiculos_arr], sequencias_arr, nos_arr,
+            resumo['demanda'], resumo['carga_acumulada']
+        )
+        if monitor is not None and monitor.cancelado:
+            # Marca o resultado parcial para que não seja reaproveitado como solução completa (ex.: cache)
+            rotas_df.attrs['busca_interrompida'] = True
 
         if rotas_df.empty:
              logger.warning("Solver CVRP encontrou uma solução, mas nenhuma rota válida foi gerada (talvez nenhum pedido atribuído).")
@@ -203,11 +194,13 @@ def solver_cvrp(pedidos, frota, matriz_distancias, pos_processamento=None, **kwa
 
     else:
         logger.warning("Solver CVRP não encontrou solução.")
+        # Versões recentes do OR-Tools expõem os status em routing_enums_pb2.RoutingSearchStatus
+        origem_status = routing if hasattr(routing, 'ROUTING_NOT_SOLVED') else routing_enums_pb2.RoutingSearchStatus
         status_map = {
-            routing.ROUTING_NOT_SOLVED: 'NOT_SOLVED',
-            routing.ROUTING_FAIL: 'FAIL',
-            routing.ROUTING_FAIL_TIMEOUT: 'FAIL_TIMEOUT',
-            routing.ROUTING_INVALID: 'INVALID',
+            origem_status.ROUTING_NOT_SOLVED: 'NOT_SOLVED',
+            origem_status.ROUTING_FAIL: 'FAIL',
+            origem_status.ROUTING_FAIL_TIMEOUT: 'FAIL_TIMEOUT',
+            origem_status.ROUTING_INVALID: 'INVALID',
         }
         logger.warning(f"Status da solução: {routing.status()} ({status_map.get(routing.status(), 'UNKNOWN')})")
         # Tentar fornecer mais detalhes sobre a inviabilidade, se possível
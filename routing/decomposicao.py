@@ -0,0 +1,339 @@
+"""
+Decomposição de instâncias grandes (2k–10k pedidos) em subproblemas CVRP.
+
+Fluxo:
+1. Varredura angular em torno do depósito: os pedidos são ordenados por ângulo (começando na maior lacuna
+   angular) e o setor com mais pedidos é dividido recursivamente ao meio pela demanda acumulada, até que
+   todos os setores tenham no máximo max_pedidos_por_subproblema pedidos.
+2. A frota é repartida entre os setores proporcionalmente à demanda (com folga).
+3. Cada setor é resolvido com solver_cvrp em paralelo (ProcessPoolExecutor). Cada tarefa recebe só a
+   submatriz e os pedidos do seu setor. Um setor que não é resolvido sozinho (sem solução ou com pedidos
+   de fora) é fundido com o setor vizinho de maior folga de capacidade, e o conjunto é re-resolvido com os
+   veículos dos dois.
+4. Reparo de fronteira: para cada par de setores vizinhos, as rotas mais próximas da fronteira são
+   re-resolvidas juntas e a nova solução é aceita se reduzir a distância.
+"""
+import os
+import time
+import heapq
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+def _demandas(pedidos):
+    if 'Peso dos Itens' in pedidos.columns:
+        return pd.to_numeric(pedidos['Peso dos Itens'], errors='coerce').fillna(1).astype(int).to_numpy()
+    if 'Qtde. dos Itens' in pedidos.columns:
+        return pd.to_numeric(pedidos['Qtde. dos Itens'], errors='coerce').fillna(1).astype(int).to_numpy()
+    return np.ones(len(pedidos), dtype=int)
+
+
+def _capacidades(frota):
+    if 'Capacidade (Kg)' in frota.columns:
+        serie = pd.to_numeric(frota['Capacidade (Kg)'], errors='coerce').fillna(1)
+    elif 'Capacidade (Cx)' in frota.columns:
+        serie = pd.to_numeric(frota['Capacidade (Cx)'], errors='coerce').fillna(1)
+    else:
+        serie = pd.Series([1000] * len(frota))
+    return serie.astype(int).clip(lower=1).to_numpy()
+
+
+def _identificadores_frota(frota):
+    """Mesmo identificador usado pelo solver na coluna 'Veículo'."""
+    if 'ID Veículo' in frota.columns:
+        return frota['ID Veículo'].to_numpy()
+    if 'Placa' in frota.columns:
+        return frota['Placa'].to_numpy()
+    return np.array([f'veiculo_{i+1}' for i in range(len(frota))], dtype=object)
+
+
+def ordem_varredura(pedidos, coord_deposito=None):
+    """
+    Ordena os pedidos por ângulo em torno do depósito, começando logo após a maior lacuna angular
+    (assim os setores contíguos nunca atravessam a região mais vazia).
+    Retorna (ordem, angulo_varredura) onde angulo_varredura é crescente ao longo da ordem.
+    """
+    lat = pd.to_numeric(pedidos['Latitude'], errors='coerce').to_numpy(dtype=float)
+    lon = pd.to_numeric(pedidos['Longitude'], errors='coerce').to_numpy(dtype=float)
+    if coord_deposito is None:
+        logging.warning("Decomposição: coordenada do depósito não informada; usando o centróide dos pedidos.")
+        coord_deposito = (np.nanmean(lat), np.nanmean(lon))
+    angulos = np.arctan2(lat - coord_deposito[0], (lon - coord_deposito[1]) * np.cos(np.radians(coord_deposito[0])))
+    angulos = np.nan_to_num(angulos)
+    ordem = np.argsort(angulos, kind='stable')
+    ordenados = angulos[ordem]
+    if len(ordenados) > 1:
+        lacunas = np.diff(np.r_[ordenados, ordenados[0] + 2 * np.pi])
+        inicio = (int(np.argmax(lacunas)) + 1) % len(ordenados)
+        ordem = np.roll(ordem, -inicio)
+    varredura = np.mod(angulos[ordem] - angulos[ordem[0]], 2 * np.pi)
+    return ordem, varredura
+
+
+def particionar_por_varredura(pedidos, max_pedidos_por_subproblema=300, max_setores=None, coord_deposito=None):
+    """
+    Divide os pedidos em setores angulares contíguos balanceados pela demanda.
+    O setor com mais pedidos é bissectado pela metade da demanda acumulada até que todos tenham
+    no máximo max_pedidos_por_subproblema pedidos (ou até atingir max_setores).
+    Retorna (setores, angulo_varredura): array com o setor de cada pedido (0..k-1, em ordem angular)
+    e o ângulo de varredura de cada pedido.
+    """
+    n = len(pedidos)
+    setores = np.zeros(n, dtype=np.int32)
+    if n == 0:
+        return setores, np.zeros(0)
+    ordem, varredura = ordem_varredura(pedidos, coord_deposito)
+    demanda_acum = np.cumsum(_demandas(pedidos)[ordem])
+    limite = max_setores if max_setores else n
+
+    # Heap de intervalos [ini, fim) da ordem angular, priorizando o maior
+    heap = [(-n, 0, n)]
+    while len(heap) < limite and -heap[0][0] > max_pedidos_por_subproblema:
+        _, ini, fim = heapq.heappop(heap)
+        base = demanda_acum[ini - 1] if ini > 0 else 0
+        meio_demanda = base + (demanda_acum[fim - 1] - base) / 2
+        corte = int(np.searchsorted(demanda_acum[ini:fim], meio_demanda)) + ini
+        corte = min(max(corte, ini + 1), fim - 1)
+        heapq.heappush(heap, (-(corte - ini), ini, corte))
+        heapq.heappush(heap, (-(fim - corte), corte, fim))
+
+    intervalos = sorted((ini, fim) for _, ini, fim in heap)
+    angulo_pedido = np.empty(n)
+    angulo_pedido[ordem] = varredura
+    for s, (ini, fim) in enumerate(intervalos):
+        setores[ordem[ini:fim]] = s
+    return setores, angulo_pedido
+
+
+def particionar_frota(capacidades, demanda_por_setor, folga=1.15):
+    """
+    Reparte os veículos entre os setores: cada veículo (do maior para o menor) vai para o setor com
+    maior déficit relativo de capacidade (demanda * folga - capacidade já atribuída).
+    Retorna array com o setor de cada veículo.
+    """
+    demanda = np.maximum(np.asarray(demanda_por_setor, dtype=float), 1.0)
+    atribuida = np.zeros(len(demanda))
+    setor_veiculo = np.zeros(len(capacidades), dtype=np.int32)
+    for v in np.argsort(-np.asarray(capacidades), kind='stable'):
+        s = int(np.argmax((demanda * folga - atribuida) / demanda))
+        setor_veiculo[v] = s
+        atribuida[s] += capacidades[v]
+    return setor_veiculo
+
+
+def custo_rotas_df(rotas_df, matriz_distancias, depot_index=0):
+    """Distância total das rotas (com saída e retorno ao depósito) a partir de 'Node_Index_OR'."""
+    if rotas_df is None or rotas_df.empty:
+        return 0
+    matriz = np.asarray(matriz_distancias)
+    df = rotas_df.sort_values(['Veículo', 'Sequencia'], kind='stable')
+    nos = df['Node_Index_OR'].to_numpy(dtype=np.int64)
+    inicio_rota = df['Veículo'].ne(df['Veículo'].shift()).to_numpy()
+    fim_rota = np.r_[inicio_rota[1:], True]
+    anteriores = np.r_[depot_index, nos[:-1]]
+    anteriores[inicio_rota] = depot_index
+    return int(matriz[anteriores, nos].sum() + matriz[nos[fim_rota], depot_index].sum())
+
+
+def _subproblema(pedidos, matriz_distancias, indices_globais):
+    """Pedidos e submatriz (depósito + pedidos do subproblema) recortados no processo principal."""
+    indices_matriz = np.r_[0, indices_globais + 1]
+    matriz_sub = np.asarray(matriz_distancias)[np.ix_(indices_matriz, indices_matriz)]
+    return pedidos.iloc[indices_globais].reset_index(drop=True), matriz_sub
+
+
+def _resolver_subproblema(solver, pedidos_sub, frota, matriz_sub, indices_globais, kwargs):
+    """Resolve um subproblema já recortado e converte os índices locais de nó/pedido para os globais."""
+    rotas_df = solver(pedidos_sub, frota.reset_index(drop=True), matriz_sub, **kwargs)
+    if rotas_df is None or rotas_df.empty:
+        return pd.DataFrame()
+    rotas_df = rotas_df.copy()
+    rotas_df['Pedido_Index_DF'] = indices_globais[rotas_df['Pedido_Index_DF'].to_numpy(dtype=np.int64)]
+    rotas_df['Node_Index_OR'] = rotas_df['Pedido_Index_DF'] + 1
+    return rotas_df
+
+
+def _tarefa_setor(solver, pedidos, frota, matriz_distancias, setores, setor_veiculo, grupo, kwargs):
+    """Argumentos de _resolver_subproblema para um grupo de setores (ou None se não há pedidos/veículos)."""
+    indices = np.flatnonzero(np.isin(setores, grupo))
+    frota_grupo = frota.iloc[np.flatnonzero(np.isin(setor_veiculo, grupo))]
+    if not len(indices) or frota_grupo.empty:
+        return None
+    pedidos_sub, matriz_sub = _subproblema(pedidos, matriz_distancias, indices)
+    return solver, pedidos_sub, frota_grupo, matriz_sub, indices, kwargs
+
+
+def _n_atendidos(rotas_df):
+    return 0 if rotas_df is None or rotas_df.empty else rotas_df['Pedido_Index_DF'].nunique()
+
+
+def _resolver_setores(solver, pedidos, frota, matriz_distancias, setores, setor_veiculo, n_processos, kwargs):
+    """
+    Resolve cada setor com a sua parte da frota. Setores que não atendem todos os seus pedidos são fundidos
+    com o vizinho angular (o de maior folga de capacidade) e re-resolvidos com os veículos dos dois, enquanto
+    a fusão atender mais pedidos. A coluna 'Setor' numera os grupos finais em ordem angular.
+    """
+    n_setores = int(setores.max()) + 1
+    grupos = [[s] for s in range(n_setores)]
+    tarefas = [_tarefa_setor(solver, pedidos, frota, matriz_distancias, setores, setor_veiculo, g, kwargs) for g in grupos]
+    if n_processos == 1 or sum(t is not None for t in tarefas) <= 1:
+        resultados = [_resolver_subproblema(*t) if t else pd.DataFrame() for t in tarefas]
+    else:
+        with ProcessPoolExecutor(max_workers=n_processos) as executor:
+            futuros = [executor.submit(_resolver_subproblema, *t) if t else None for t in tarefas]
+            resultados = [f.result() if f else pd.DataFrame() for f in futuros]
+
+    n_pedidos_setor = np.bincount(setores, minlength=n_setores)
+    folga_setor = (np.bincount(setor_veiculo, weights=_capacidades(frota), minlength=n_setores)
+                   - np.bincount(setores, weights=_demandas(pedidos), minlength=n_setores))
+    pendentes = [g for g in grupos if _n_atendidos(resultados[grupos.index(g)]) < n_pedidos_setor[g].sum()]
+    while pendentes:
+        grupo = pendentes.pop(0)
+        posicao = grupos.index(grupo)
+        vizinhos = [p for p in (posicao - 1, posicao + 1) if 0 <= p < len(grupos)]
+        if not vizinhos:
+            continue
+        vizinho = max(vizinhos, key=lambda p: folga_setor[grupos[p]].sum())
+        fundido = sorted(grupo + grupos[vizinho])
+        tarefa = _tarefa_setor(solver, pedidos, frota, matriz_distancias, setores, setor_veiculo, fundido, kwargs)
+        rotas_df = _resolver_subproblema(*tarefa) if tarefa else pd.DataFrame()
+        if _n_atendidos(rotas_df) <= _n_atendidos(resultados[posicao]) + _n_atendidos(resultados[vizinho]):
+            logging.warning(f"Decomposição: setor(es) {grupo} sem solução completa, nem fundido(s) com {grupos[vizinho]}.")
+            continue
+        logging.info(f"Decomposição: setor(es) {grupo} sem solução completa; re-resolvido(s) junto com {grupos[vizinho]}.")
+        primeiro, ultimo = min(posicao, vizinho), max(posicao, vizinho)
+        grupos[primeiro:ultimo + 1] = [fundido]
+        resultados[primeiro:ultimo + 1] = [rotas_df]
+        # O vizinho agora faz parte do grupo fundido
+        pendentes = [g for g in pendentes if g in grupos]
+        if _n_atendidos(rotas_df) < n_pedidos_setor[fundido].sum():
+            pendentes.insert(0, fundido)
+
+    partes = []
+    for s, rotas_df in enumerate(resultados):
+        if rotas_df.empty:
+            logging.warning(f"Decomposição: setor(es) {grupos[s]} sem solução.")
+            continue
+        rotas_df['Setor'] = s
+        partes.append(rotas_df)
+    return pd.concat(partes, ignore_index=True) if partes else pd.DataFrame()
+
+
+def reparar_fronteiras(solver, rotas_df, pedidos, frota, matriz_distancias, angulo_pedido, rotas_por_fronteira=2,
+                       tempo_limite_fronteira_s=5, kwargs=None):
+    """
+    Re-resolve, para cada par de setores vizinhos, as rotas_por_fronteira rotas de cada lado mais próximas
+    da fronteira angular. A nova solução substitui as rotas originais se atender todos os pedidos com
+    menor distância. Retorna (rotas_df, n_reparos_aceitos).
+    """
+    kwargs = dict(kwargs or {})
+    kwargs['tempo_limite_s'] = tempo_limite_fronteira_s
+    ids_frota = _identificadores_frota(frota)
+    n_setores = int(rotas_df['Setor'].max()) + 1 if not rotas_df.empty else 0
+    n_aceitos = 0
+    for s in range(n_setores - 1):
+        angulo_rota = pd.Series(angulo_pedido[rotas_df['Pedido_Index_DF'].to_numpy(dtype=np.int64)], index=rotas_df.index).groupby(rotas_df['Veículo']).mean()
+        setor_rota = rotas_df.groupby('Veículo')['Setor'].first()
+        lado_a = angulo_rota[setor_rota == s].nlargest(rotas_por_fronteira).index
+        lado_b = angulo_rota[setor_rota == s + 1].nsmallest(rotas_por_fronteira).index
+        veiculos = list(lado_a) + list(lado_b)
+        if len(lado_a) == 0 or len(lado_b) == 0:
+            continue
+        mascara = rotas_df['Veículo'].isin(veiculos)
+        atuais = rotas_df[mascara]
+        indices = np.sort(atuais['Pedido_Index_DF'].to_numpy(dtype=np.int64))
+        frota_fronteira = frota.iloc[np.flatnonzero(np.isin(ids_frota, veiculos))]
+        pedidos_sub, matriz_sub = _subproblema(pedidos, matriz_distancias, indices)
+        novas = _resolver_subproblema(solver, pedidos_sub, frota_fronteira, matriz_sub, indices, kwargs)
+        if novas.empty or len(novas) < len(indices):
+            continue
+        if custo_rotas_df(novas, matriz_distancias) < custo_rotas_df(atuais, matriz_distancias):
+            setor_por_veiculo = atuais.groupby('Veículo')['Setor'].first()
+            novas['Setor'] = novas['Veículo'].map(setor_por_veiculo).fillna(s).astype(int)
+            rotas_df = pd.concat([rotas_df[~mascara], novas], ignore_index=True)
+            n_aceitos += 1
+    return rotas_df, n_aceitos
+
+
+def solver_cvrp_decomposto(pedidos, frota, matriz_distancias, coord_deposito=None, max_pedidos_por_subproblema=300,
+                           n_processos=None, reparar=True, rotas_por_fronteira=2, tempo_limite_fronteira_s=5,
+                           solver=None, progress_callback=None, cancelar=None, **kwargs):
+    """
+    CVRP por decomposição para instâncias grandes. Instâncias com até max_pedidos_por_subproblema pedidos
+    são resolvidas diretamente. Os demais kwargs (ex.: tempo_limite_s) são repassados a cada subproblema.
+    - coord_deposito: (lat, lon) do depósito, centro da varredura angular.
+    - n_processos: processos paralelos (default: os.cpu_count()); 1 resolve em série.
+    - progress_callback/cancelar não são repassados aos subproblemas (rodam em outros processos).
+    Retorna DataFrame no formato do solver_cvrp (índices globais) com a coluna extra 'Setor'.
+    """
+    if solver is None:
+        from routing.cvrp import solver_cvrp as solver
+    if pedidos.empty or frota.empty:
+        return pd.DataFrame()
+    pedidos = pedidos.reset_index(drop=True)
+    frota = frota.reset_index(drop=True)
+    if len(pedidos) <= max_pedidos_por_subproblema:
+        rotas_df = solver(pedidos, frota, matriz_distancias, progress_callback=progress_callback, cancelar=cancelar, **kwargs)
+        if rotas_df is not None and not rotas_df.empty:
+            rotas_df['Setor'] = 0
+        return rotas_df
+
+    inicio = time.perf_counter()
+    setores, angulo_pedido = particionar_por_varredura(
+        pedidos, max_pedidos_por_subproblema, max_setores=len(frota), coord_deposito=coord_deposito
+    )
+    n_setores = int(setores.max()) + 1
+    demanda_por_setor = np.bincount(setores, weights=_demandas(pedidos), minlength=n_setores)
+    setor_veiculo = particionar_frota(_capacidades(frota), demanda_por_setor)
+    logging.info(f"Decomposição: {len(pedidos)} pedidos em {n_setores} setores (máx. {np.bincount(setores).max()} pedidos por setor).")
+
+    rotas_df = _resolver_setores(solver, pedidos, frota, matriz_distancias, setores, setor_veiculo,
+                                 n_processos or os.cpu_count() or 1, kwargs)
+    if rotas_df.empty:
+        return rotas_df
+    distancia_inicial = custo_rotas_df(rotas_df, matriz_distancias)
+    if reparar and n_setores > 1:
+        rotas_df, n_reparos = reparar_fronteiras(
+            solver, rotas_df, pedidos, frota, matriz_distancias, angulo_pedido,
+            rotas_por_fronteira, tempo_limite_fronteira_s, kwargs
+        )
+        logging.info(f"Decomposição: {n_reparos} reparos de fronteira aceitos; distância {distancia_inicial/1000:.1f} km -> {custo_rotas_df(rotas_df, matriz_distancias)/1000:.1f} km.")
+    nao_roteirizados = len(pedidos) - rotas_df['Pedido_Index_DF'].nunique()
+    if nao_roteirizados > 0:
+        logging.warning(f"Decomposição: {nao_roteirizados} pedidos não foram incluídos nas rotas.")
+    logging.info(f"Decomposição concluída em {time.perf_counter() - inicio:.1f}s.")
+    return rotas_df.sort_values(['Setor', 'Veículo', 'Sequencia'], kind='stable').reset_index(drop=True)
+
+
+def comparar_com_monolitico(pedidos, frota, matriz_distancias, coord_deposito=None, **kwargs):
+    """
+    Compara a decomposição com a resolução monolítica (útil em instâncias de benchmark menores).
+    kwargs são repassados às duas execuções (ex.: tempo_limite_s, max_pedidos_por_subproblema).
+    Retorna DataFrame com distância, veículos, paradas, tempo e gap (%) de cada método.
+    """
+    from routing.cvrp import solver_cvrp
+    kwargs_decomposicao = {k: kwargs.pop(k) for k in list(kwargs) if k in (
+        'max_pedidos_por_subproblema', 'n_processos', 'reparar', 'rotas_por_fronteira', 'tempo_limite_fronteira_s'
+    )}
+    linhas = []
+    for metodo, executar in (
+        ('Monolítico', lambda: solver_cvrp(pedidos, frota, matriz_distancias, **kwargs)),
+        ('Decomposto', lambda: solver_cvrp_decomposto(pedidos, frota, matriz_distancias, coord_deposito, **kwargs_decomposicao, **kwargs)),
+    ):
+        inicio = time.perf_counter()
+        rotas_df = executar()
+        vazio = rotas_df is None or rotas_df.empty
+        linhas.append({
+            'Método': metodo,
+            'Distância (km)': custo_rotas_df(rotas_df, matriz_distancias) / 1000,
+            'Veículos': 0 if vazio else rotas_df['Veículo'].nunique(),
+            'Paradas': 0 if vazio else len(rotas_df),
+            'Tempo (s)': time.perf_counter() - inicio,
+        })
+    resultado = pd.DataFrame(linhas)
+    referencia = resultado['Distância (km)'].iloc[0]
+    resultado['Gap (%)'] = (resultado['Distância (km)'] / referencia - 1) * 100 if referencia > 0 else np.nan
+    return resultado
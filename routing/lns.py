@@ -0,0 +1,203 @@
+"""
+Large Neighbourhood Search (ruin-and-recreate) sobre um PlanoRotas, para continuar melhorando um plano depois
+do limite de tempo do OR-Tools.
+
+A cada iteração um operador de remoção retira um conjunto de pedidos relacionados:
+- aleatoria: pedidos sorteados;
+- radial: um pedido semente e os mais próximos a ele;
+- rota: todos os pedidos de uma rota sorteada;
+- pior_custo: pedidos com maior economia de remoção (sorteio enviesado).
+Os pedidos removidos são reinseridos por inserção com arrependimento (regret-2). A nova solução é aceita pelo
+critério de simulated annealing. lns_paralelo roda vários processos com sementes diferentes e troca a melhor
+solução entre eles a cada época.
+"""
+import os
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from routing.plano_rotas import PlanoRotas
+
+OPERADORES_REMOCAO = ('aleatoria', 'radial', 'rota', 'pior_custo')
+
+
+def _remover(plano, nos):
+    """Remove os nós do plano, atualizando apenas as rotas afetadas."""
+    nos = np.asarray(nos, dtype=np.int64)
+    for r in np.unique(plano.rota_do_no[nos]):
+        rota = plano.rotas[r]
+        plano.atualizar_rota(r, rota[~np.isin(rota, nos)])
+    plano.rota_do_no[nos] = -1
+    plano.posicao_do_no[nos] = -1
+
+
+def _escolher_remocao(plano, operador, q, rng):
+    atendidos = plano.nos_atendidos()
+    q = min(q, len(atendidos))
+    if operador == 'aleatoria':
+        return rng.choice(atendidos, q, replace=False)
+    if operador == 'radial':
+        semente = rng.choice(atendidos)
+        proximidade = plano.matriz[semente, atendidos] + plano.matriz[atendidos, semente]
+        return atendidos[np.argsort(proximidade, kind='stable')[:q]]
+    if operador == 'rota':
+        nao_vazias = [r for r, nos in enumerate(plano.rotas) if len(nos)]
+        rota = plano.rotas[rng.choice(nao_vazias)]
+        if len(rota) >= q:
+            return rota
+        # Completa com os vizinhos da rota removida
+        resto = atendidos[~np.isin(atendidos, rota)]
+        proximidade = plano.matriz[np.ix_(rota, resto)].min(axis=0)
+        return np.r_[rota, resto[np.argsort(proximidade, kind='stable')[:q - len(rota)]]]
+    # pior_custo: economia de remoção de cada nó, sorteio enviesado para os piores
+    r = plano.rota_do_no[atendidos]
+    pos = plano.posicao_do_no[atendidos]
+    anteriores = np.array([plano.anterior(rr, p) for rr, p in zip(r, pos)])
+    seguintes = np.array([plano.seguinte(rr, p) for rr, p in zip(r, pos)])
+    m = plano.matriz
+    economia = m[anteriores, atendidos] + m[atendidos, seguintes] - m[anteriores, seguintes]
+    ordem = np.argsort(-economia, kind='stable')
+    escolhidos = np.unique(np.floor(rng.random(q * 2) ** 3 * len(atendidos)).astype(int))[:q]
+    return atendidos[ordem[escolhidos]]
+
+
+def inserir_com_arrependimento(plano, nos, rng=None, ruido=0.0):
+    """
+    Reinsere os nós por inserção regret-2: a cada passo insere o nó com maior diferença entre a melhor e a
+    segunda melhor rota viável. Retorna True se todos couberam (respeitando a capacidade).
+    """
+    nos = np.asarray(nos, dtype=np.int64)
+    n_rotas = len(plano.rotas)
+    custo = np.empty((len(nos), n_rotas))
+    posicao = np.zeros((len(nos), n_rotas), dtype=np.int64)
+    for r in range(n_rotas):
+        custo[:, r], posicao[:, r] = plano.custos_insercao(r, nos)
+    if ruido and rng is not None:
+        custo *= 1 + ruido * rng.random(custo.shape)
+    pendentes = np.ones(len(nos), dtype=bool)
+    while pendentes.any():
+        folga = plano.capacidades - plano.cargas
+        viavel = plano.demandas[nos][:, None] <= folga[None, :] + 1e-9
+        c = np.where(viavel & pendentes[:, None], custo, np.inf)
+        if n_rotas > 1:
+            duas = np.partition(c, 1, axis=1)[:, :2]
+        else:
+            duas = np.c_[c[:, 0], np.full(len(nos), np.inf)]
+        melhores = duas[:, 0]
+        if not np.isfinite(melhores[pendentes]).any():
+            return False
+        # Nó com uma única rota viável tem arrependimento máximo
+        arrependimento = np.full(len(nos), 1e18)
+        duas_viaveis = np.isfinite(duas[:, 1])
+        arrependimento[duas_viaveis] = duas[duas_viaveis, 1] - duas[duas_viaveis, 0]
+        arrependimento = np.where(np.isfinite(melhores) & pendentes, arrependimento, -np.inf)
+        # Desempate pelo menor custo de inserção
+        i = int(np.lexsort((melhores, -arrependimento))[0])
+        r = int(np.argmin(c[i]))
+        plano.atualizar_rota(r, np.insert(plano.rotas[r], posicao[i, r], nos[i]))
+        pendentes[i] = False
+        restantes = np.flatnonzero(pendentes)
+        if len(restantes):
+            custo[restantes, r], posicao[restantes, r] = plano.custos_insercao(r, nos[restantes])
+            if ruido and rng is not None:
+                custo[restantes, r] *= 1 + ruido * rng.random(len(restantes))
+    return True
+
+
+def lns(plano, tempo_limite_s=10, max_iter=None, semente=None, operadores=OPERADORES_REMOCAO,
+        fracao_remocao=(0.05, 0.25), max_remocao=60, temperatura_inicial_pct=0.05, resfriamento_final=0.01):
+    """
+    Ruin-and-recreate com aceitação por simulated annealing. A temperatura começa aceitando uma piora de
+    temperatura_inicial_pct do custo com probabilidade 50% e cai geometricamente (pelo tempo decorrido)
+    até resfriamento_final vezes o valor inicial.
+    Retorna (melhor_plano, estatisticas). O plano recebido não é alterado.
+    """
+    rng = np.random.default_rng(semente)
+    atual = plano.copiar()
+    melhor = atual.copiar()
+    custo_atual = custo_melhor = custo_inicial = atual.custo_total()
+    n_atendidos = len(atual.nos_atendidos())
+    stats = {'custo_inicial': custo_inicial, 'iteracoes': 0, 'aceitas': 0, 'melhorias': 0}
+    if n_atendidos < 2 or custo_inicial <= 0:
+        stats['custo_final'] = custo_inicial
+        return melhor, stats
+    t0 = -temperatura_inicial_pct * custo_inicial / np.log(0.5)
+    inicio = time.perf_counter()
+    while True:
+        decorrido = time.perf_counter() - inicio
+        if decorrido >= tempo_limite_s or (max_iter is not None and stats['iteracoes'] >= max_iter):
+            break
+        progresso = decorrido / tempo_limite_s if max_iter is None else stats['iteracoes'] / max_iter
+        temperatura = t0 * resfriamento_final ** progresso
+        q = int(rng.integers(
+            max(1, int(fracao_remocao[0] * n_atendidos)), max(2, min(max_remocao, int(fracao_remocao[1] * n_atendidos))) + 1
+        ))
+        operador = operadores[rng.integers(len(operadores))]
+        candidato = atual.copiar()
+        removidos = _escolher_remocao(candidato, operador, q, rng)
+        _remover(candidato, removidos)
+        stats['iteracoes'] += 1
+        if not inserir_com_arrependimento(candidato, removidos, rng, ruido=0.05):
+            continue
+        custo_candidato = candidato.custo_total()
+        if custo_candidato < custo_atual or rng.random() < np.exp((custo_atual - custo_candidato) / temperatura):
+            atual, custo_atual = candidato, custo_candidato
+            stats['aceitas'] += 1
+            if custo_atual < custo_melhor - 1e-9:
+                melhor, custo_melhor = atual.copiar(), custo_atual
+                stats['melhorias'] += 1
+    stats['custo_final'] = custo_melhor
+    return melhor, stats
+
+
+def _lns_worker(veiculos, rotas, demandas, matriz, capacidades, depot_index, tempo_limite_s, semente, kwargs):
+    plano = PlanoRotas(veiculos, rotas, demandas, matriz, capacidades, depot_index)
+    melhor, stats = lns(plano, tempo_limite_s=tempo_limite_s, semente=semente, **kwargs)
+    return melhor.rotas, stats
+
+
+def lns_paralelo(plano, tempo_limite_s=30, n_processos=None, n_epocas=5, semente=0, **kwargs):
+    """
+    Executa LNS em n_processos processos com sementes diferentes. O tempo é dividido em n_epocas; ao fim de
+    cada época a melhor solução entre os processos vira o ponto de partida de todos na época seguinte.
+    Retorna (melhor_plano, estatisticas).
+    """
+    n_processos = n_processos or os.cpu_count() or 1
+    melhor = plano.copiar()
+    custo_inicial = melhor.custo_total()
+    tempo_epoca = tempo_limite_s / max(1, n_epocas)
+    iteracoes = 0
+    with ProcessPoolExecutor(max_workers=n_processos) as executor:
+        for epoca in range(max(1, n_epocas)):
+            futuros = [
+                executor.submit(
+                    _lns_worker, melhor.veiculos, melhor.rotas, melhor.demandas, melhor.matriz, melhor.capacidades,
+                    melhor.depot_index, tempo_epoca, semente + epoca * n_processos + w, kwargs
+                )
+                for w in range(n_processos)
+            ]
+            for futuro in futuros:
+                rotas, stats = futuro.result()
+                iteracoes += stats['iteracoes']
+                if stats['custo_final'] < melhor.custo_total() - 1e-9:
+                    melhor = PlanoRotas(melhor.veiculos, rotas, melhor.demandas, melhor.matriz, melhor.capacidades, melhor.depot_index)
+            logging.info(f"LNS paralelo: época {epoca + 1}/{n_epocas}, melhor custo {melhor.custo_total():.0f}.")
+    return melhor, {'custo_inicial': custo_inicial, 'custo_final': melhor.custo_total(), 'iteracoes': iteracoes}
+
+
+def melhorar_com_lns(rotas_df, matriz_distancias, frota=None, depot_index=0, limite_pct=100, tempo_limite_s=30,
+                     n_processos=1, **kwargs):
+    """
+    Aplica LNS a um rotas_df (com n_processos > 1 usa lns_paralelo) e devolve o rotas_df re-sequenciado.
+    """
+    if rotas_df is None or rotas_df.empty or 'Node_Index_OR' not in rotas_df.columns:
+        return rotas_df
+    plano = PlanoRotas.de_rotas_df(rotas_df, matriz_distancias, frota, depot_index, limite_pct)
+    if n_processos and n_processos > 1:
+        melhor, stats = lns_paralelo(plano, tempo_limite_s=tempo_limite_s, n_processos=n_processos, **kwargs)
+    else:
+        melhor, stats = lns(plano, tempo_limite_s=tempo_limite_s, **kwargs)
+    logging.info(f"LNS: distância {stats['custo_inicial']:.0f} -> {stats['custo_final']:.0f} em {stats['iteracoes']} iterações.")
+    return melhor.para_rotas_df(rotas_df)
@@ -0,0 +1,317 @@
+"""
+Funções auxiliares compartilhadas pelos solvers OR-Tools (cvrp.py e cvrp_flex.py).
+"""
+import logging
+import numpy as np
+import pandas as pd
+
+# Colunas da frota que definem se dois veículos são intercambiáveis para o solver e para o pós-processamento
+COLUNAS_CLASSE_VEICULO = ['Janela Início', 'Janela Fim', 'Rodizio_SP', 'Regiões Preferidas']
+
+
+def _normalizar_regioes_preferidas(valor):
+    """Normaliza 'Regiões Preferidas' para uma chave independente de ordem, caixa e espaços."""
+    if valor is None or (isinstance(valor, float) and np.isnan(valor)):
+        return ''
+    regioes = [r.strip().lower() for r in str(valor).split(',') if r.strip()]
+    return ','.join(sorted(regioes))
+
+
+def agrupar_veiculos_em_classes(frota, capacidades):
+    """
+    Agrupa veículos idênticos em classes: mesma capacidade, janelas, status de rodízio e regiões preferidas.
+
+    Args:
+        frota (pd.DataFrame): DataFrame da frota (índice posicional 0..n-1).
+        capacidades (list): Capacidade efetiva de cada veículo, na mesma ordem da frota.
+
+    Returns:
+        np.ndarray: Id da classe de cada veículo (int), numeradas na ordem de primeira aparição.
+    """
+    chaves = pd.DataFrame({'capacidade': np.asarray(capacidades, dtype=np.int64)})
+    for col in COLUNAS_CLASSE_VEICULO:
+        if col not in frota.columns:
+            continue
+        valores = frota[col].reset_index(drop=True)
+        if col == 'Regiões Preferidas':
+            chaves[col] = valores.map(_normalizar_regioes_preferidas)
+        else:
+            chaves[col] = valores.astype(str)
+    classes, _ = pd.factorize(pd.MultiIndex.from_frame(chaves))
+    return classes.astype(np.int64)
+
+
+def ordenar_e_limitar_frota_por_classe(classes, n_pedidos):
+    """
+    Retorna a ordem dos veículos agrupada por classe (estável, preserva a ordem original dentro da classe),
+    limitando cada classe a no máximo `n_pedidos` veículos — veículos além disso nunca seriam usados.
+
+    Returns:
+        np.ndarray: Posições (na frota original) dos veículos a manter, contíguos por classe.
+    """
+    classes = np.asarray(classes)
+    ordem = np.argsort(classes, kind='stable')
+    classes_ordenadas = classes[ordem]
+    # Posição de cada veículo dentro da sua classe (0, 1, 2, ...)
+    inicio_classe = np.r_[0, np.flatnonzero(np.diff(classes_ordenadas)) + 1]
+    tamanho_classe = np.diff(np.r_[inicio_classe, len(classes_ordenadas)])
+    posicao_na_classe = np.arange(len(classes_ordenadas)) - np.repeat(inicio_classe, tamanho_classe)
+    limite = max(int(n_pedidos), 1)
+    return ordem[posicao_na_classe < limite]
+
+
+def mapear_rotas_para_placas(classes, cargas_por_veiculo, identificadores):
+    """
+    Converte as rotas anônimas de cada classe em placas concretas.
+    Veículos da mesma classe são intercambiáveis no modelo (o OR-Tools já os trata como uma única classe
+    de veículo nos operadores de busca), então a placa só é decidida aqui, na saída.
+    Dentro de uma classe, a rota mais carregada recebe a primeira placa da classe (ordem original da frota),
+    a segunda mais carregada a segunda placa, e assim por diante. Veículos sem rota ficam com as placas restantes.
+
+    Args:
+        classes (array-like): Classe de cada veículo do modelo.
+        cargas_por_veiculo (array-like): Carga total roteirizada em cada veículo do modelo (0 se não usado).
+        identificadores (list): Identificador (ID Veículo/Placa) de cada veículo do modelo, na ordem do modelo.
+
+    Returns:
+        list: Identificador atribuído a cada veículo do modelo.
+    """
+    classes = np.asarray(classes)
+    cargas = np.asarray(cargas_por_veiculo, dtype=float)
+    resultado = list(identificadores)
+    for classe in np.unique(classes):
+        membros = np.flatnonzero(classes == classe)
+        # Ordena por carga decrescente; empates mantêm a ordem do modelo
+        membros_por_carga = membros[np.argsort(-cargas[membros], kind='stable')]
+        for veiculo_modelo, posicao_placa in zip(membros_por_carga, membros):
+            resultado[veiculo_modelo] = identificadores[posicao_placa]
+    return resultado
+
+
+def preparar_classes_de_veiculos(frota, capacidades, n_pedidos, logger=None):
+    """
+    Agrupa a frota em classes e reordena/limita os veículos para o modelo OR-Tools.
+    logger: logger do solver que chama (padrão: o logger deste módulo).
+
+    Returns:
+        tuple: (frota reordenada, capacidades reordenadas, classes reordenadas)
+    """
+    logger = logger or logging.getLogger(__name__)
+    classes = agrupar_veiculos_em_classes(frota, capacidades)
+    ordem = ordenar_e_limitar_frota_por_classe(classes, n_pedidos)
+    n_classes = len(np.unique(classes))
+    if len(ordem) < len(frota):
+        logger.info(f"Frota compactada: {len(frota)} veículos em {n_classes} classes; {len(frota) - len(ordem)} veículos redundantes descartados do modelo.")
+    else:
+        logger.info(f"Frota agrupada em {n_classes} classes de veículos idênticos ({len(frota)} veículos).")
+    frota_ordenada = frota.iloc[ordem].reset_index(drop=True)
+    capacidades_ordenadas = [capacidades[i] for i in ordem]
+    return frota_ordenada, capacidades_ordenadas, classes[ordem]
+
+
+def extrair_rotas_solucao(routing, manager, solution, n_veiculos, n_pedidos):
+    """
+    Percorre a solução do OR-Tools preenchendo arrays pré-alocados (sem DataFrame nem dict por parada).
+
+    Returns:
+        tuple: (veiculo, sequencia, no) — arrays int32 com uma posição por parada visitada,
+               contíguos por veículo e na ordem de visita. `no` é o índice do nó na matriz (depósito=0).
+    """
+    veiculo = np.empty(n_pedidos, dtype=np.int32)
+    no = np.empty(n_pedidos, dtype=np.int32)
+    valor = solution.Value
+    proximo = routing.NextVar
+    fim_rota = routing.IsEnd
+    para_no = manager.IndexToNode
+    pos = 0
+    for vehicle_id in range(n_veiculos):
+        index = valor(proximo(routing.Start(vehicle_id)))
+        while not fim_rota(index) and pos < n_pedidos:
+            no[pos] = para_no(index)
+            veiculo[pos] = vehicle_id
+            pos += 1
+            index = valor(proximo(index))
+    veiculo = veiculo[:pos]
+    no = no[:pos]
+    # Sequência 1..k dentro de cada veículo
+    inicio = np.r_[0, np.flatnonzero(np.diff(veiculo)) + 1] if pos else np.array([], dtype=np.int64)
+    tamanho = np.diff(np.r_[inicio, pos]) if pos else np.array([], dtype=np.int64)
+    sequencia = (np.arange(pos) - np.repeat(inicio, tamanho) + 1).astype(np.int32)
+    return veiculo, sequencia, no
+
+
+def calcular_cargas_e_custos(veiculo, sequencia, no, demandas, matriz_distancias, n_veiculos, depot_index=0):
+    """
+    Calcula, de forma vetorizada, a carga acumulada na chegada a cada parada, o custo de cada arco
+    (parada anterior -> parada) e os totais de distância/carga por veículo, incluindo o retorno ao depósito.
+
+    Returns:
+        dict: 'demanda', 'carga_acumulada', 'custo_arco' (por parada) e 'distancia_por_veiculo',
+              'carga_por_veiculo' (arrays de tamanho n_veiculos).
+    """
+    demandas = np.asarray(demandas)
+    matriz = np.asarray(matriz_distancias)
+    demanda = demandas[no]
+    primeira = sequencia == 1
+    ultima = np.r_[primeira[1:], True] if len(no) else primeira
+    # Carga acumulada exclusiva (carga já coletada ao chegar na parada), reiniciada a cada veículo
+    acumulado = np.cumsum(demanda)
+    base = np.maximum.accumulate(np.where(primeira, np.arange(len(no)), 0)) if len(no) else np.array([], dtype=np.int64)
+    carga_acumulada = acumulado - demanda - (acumulado[base] - demanda[base])
+    anterior = np.where(primeira, depot_index, np.r_[depot_index, no[:-1]])
+    custo_arco = matriz[anterior, no]
+    custo_retorno = matriz[no[ultima], depot_index]
+    distancia_por_veiculo = (
+        np.bincount(veiculo, weights=custo_arco, minlength=n_veiculos)
+        + np.bincount(veiculo[ultima], weights=custo_retorno, minlength=n_veiculos)
+    )
+    carga_por_veiculo = np.bincount(veiculo, weights=demanda, minlength=n_veiculos)
+    return {
+        'demanda': demanda,
+        'carga_acumulada': carga_acumulada,
+        'custo_arco': custo_arco,
+        'distancia_por_veiculo': distancia_por_veiculo,
+        'carga_por_veiculo': carga_por_veiculo,
+    }
+
+
+def montar_rotas_df(pedidos, veiculo, sequencia, no, demanda, carga_acumulada):
+    """
+    Monta o DataFrame de rotas com uma única seleção vetorizada (take) dos atributos dos pedidos.
+    Mantém as colunas e o formato historicamente retornados pelos solvers (depósito no índice 0 da matriz).
+    """
+    pedido_idx = no.astype(np.int64) - 1 # Nó i da matriz corresponde ao pedido i-1
+
+    def _coluna(nome, padrao):
+        if nome in pedidos.columns:
+            return pedidos[nome].to_numpy()[pedido_idx]
+        return padrao
+
+    id_padrao = ('Pedido_' + pd.Index(pedido_idx).astype(str)).to_numpy()
+    return pd.DataFrame({
+        'Veículo': veiculo,
+        'Sequencia': sequencia.astype(np.int64),
+        'Node_Index_OR': no.astype(np.int64), # Índice do nó no OR-Tools (inclui depósito)
+        'Pedido_Index_DF': pedido_idx, # Índice no DataFrame 'pedidos' original
+        'ID Pedido': _coluna('ID Pedido', id_padrao),
+        'Cliente': _coluna('Cliente', 'N/A'),
+        'Endereço': _coluna('Endereço', 'N/A'),
+        'Demanda': demanda.astype(np.int64),
+        'Carga_Acumulada': carga_acumulada.astype(np.int64),
+    })
+
+
+class MonitorProgressoSolver:
+    """
+    Callback de solução para `routing.AddAtSolutionCallback`.
+    A cada solução com objetivo melhor que o anterior, repassa um dicionário de progresso ao `progress_callback`
+    e consulta `cancelar` para permitir a interrupção cooperativa da busca (a melhor solução até o momento é mantida).
+    Use `registrar()` para instalar o callback de solução e o limite de busca que efetiva o cancelamento.
+
+    Dicionário de progresso:
+        'objetivo' (int): custo da melhor solução (mesma unidade da matriz de distâncias).
+        'n_solucoes' (int): número de soluções visitadas até agora.
+        'n_melhorias' (int): número de melhorias do objetivo.
+        'tempo_decorrido_s' (float): segundos desde o início da busca.
+        'tempo_sem_melhoria_s' (float): segundos desde a última melhoria.
+        'rotas' (list, opcional): lista de nós por veículo (sem depósito), se `incluir_rotas=True`.
+    """
+
+    def __init__(self, routing, manager, n_veiculos, progress_callback=None, cancelar=None, incluir_rotas=False, logger=None):
+        import time
+        self._time = time.monotonic
+        self.logger = logger or logging.getLogger(__name__)
+        self.routing = routing
+        self.manager = manager
+        self.n_veiculos = n_veiculos
+        self.progress_callback = progress_callback
+        self.cancelar = cancelar
+        self.incluir_rotas = incluir_rotas
+        self.inicio = self._time()
+        self.ultima_melhoria = self.inicio
+        self.melhor_objetivo = None
+        self.n_solucoes = 0
+        self.n_melhorias = 0
+        self.cancelado = False
+        self.melhores_rotas = None
+
+    def _rotas_atuais(self):
+        """Rotas da solução corrente como índices de variável do solver (o que ReadAssignmentFromRoutes espera)."""
+        rotas = []
+        for vehicle_id in range(self.n_veiculos):
+            index = self.routing.NextVar(self.routing.Start(vehicle_id)).Value()
+            rota = []
+            while not self.routing.IsEnd(index):
+                rota.append(index)
+                index = self.routing.NextVar(index).Value()
+            rotas.append(rota)
+        return rotas
+
+    def registrar(self):
+        """Instala o callback de solução e um limite de busca que encerra a busca quando `cancelado` for True."""
+        self.routing.AddAtSolutionCallback(self)
+        # Mantém referência ao limite: o wrapper SWIG não assume a posse e o objeto seria coletado
+        self._limite = self.routing.solver().CustomLimit(self._limite_atingido)
+        self.routing.AddSearchMonitor(self._limite)
+        return self
+
+    def _limite_atingido(self):
+        # Chamado com frequência pelo OR-Tools: verifica apenas o flag (e Events, que não dependem de nova solução)
+        if not self.cancelado and hasattr(self.cancelar, 'is_set') and self.cancelar.is_set():
+            self.cancelado = True
+        return self.cancelado
+
+    def solucao_final(self, solution):
+        """Retorna `solution` ou, se a busca foi interrompida sem solução devolvida, a melhor solução registrada."""
+        if solution is None and self.melhores_rotas is not None:
+            return self.routing.ReadAssignmentFromRoutes(self.melhores_rotas, True)
+        return solution
+
+    def _deve_cancelar(self, info):
+        if self.cancelar is None:
+            return False
+        if hasattr(self.cancelar, 'is_set'): # threading.Event / multiprocessing.Event
+            return self.cancelar.is_set()
+        return bool(self.cancelar(info))
+
+    def __call__(self):
+        self.n_solucoes += 1
+        agora = self._time()
+        objetivo = self.routing.CostVar().Value()
+        melhorou = self.melhor_objetivo is None or objetivo < self.melhor_objetivo
+        if melhorou:
+            self.melhor_objetivo = objetivo
+            self.n_melhorias += 1
+            self.ultima_melhoria = agora
+        info = {
+            'objetivo': self.melhor_objetivo,
+            'n_solucoes': self.n_solucoes,
+            'n_melhorias': self.n_melhorias,
+            'tempo_decorrido_s': agora - self.inicio,
+            'tempo_sem_melhoria_s': agora - self.ultima_melhoria,
+        }
+        try:
+            if melhorou and (self.incluir_rotas or self.cancelar is not None):
+                # Com cancelamento habilitado, guarda as rotas da melhor solução: ao interromper a busca
+                # pelo limite, o OR-Tools não devolve a solução corrente
+                self.melhores_rotas = self._rotas_atuais()
+                if self.incluir_rotas:
+                    info['rotas'] = [[self.manager.IndexToNode(i) for i in r] for r in self.melhores_rotas]
+            if melhorou and self.progress_callback:
+                self.progress_callback(info)
+            if not self.cancelado and self._deve_cancelar(info):
+                self.logger.info(f"Busca interrompida a pedido do usuário (objetivo={self.melhor_objetivo}, {self.n_solucoes} soluções).")
+                self.cancelado = True
+        except Exception as e:
+            # Exceções não podem atravessar o callback C++ do OR-Tools
+            self.logger.error(f"Erro no callback de progresso do solver: {e}")
+
+
+def parar_sem_melhoria(segundos):
+    """
+    Critério de cancelamento pronto para uso: interrompe a busca após `segundos` sem melhoria do objetivo.
+    Retorna None se `segundos` não for positivo (sem critério).
+    """
+    if not segundos or segundos <= 0:
+        return None
+    return lambda info: info['tempo_sem_melhoria_s'] >= segundos
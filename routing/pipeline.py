@@ -0,0 +1,252 @@
+"""
+Pipeline declarativo do pós-processamento das rotas (antes uma cadeia fixa de chamadas em roteirizacao_page).
+
+Cada etapa declara as entradas que lê do contexto (dict com rotas_df, frota, pedidos, matriz_distancias, ...)
+e as saídas que grava nele. O pipeline:
+- pula etapas desativadas, com entrada ausente ou cuja condição indica que não há nada a fazer;
+- pula etapas que já rodaram sem alterar nada com exatamente as mesmas entradas (impressão digital). Essa
+  memória pode ser passada ao construtor (ex.: guardada em st.session_state) para valer entre execuções;
+- mede o tempo e a distância total antes/depois de cada etapa e devolve um relatório.
+Dentro de uma execução cada objeto do contexto (a matriz, a frota, cada versão de rotas_df) tem a impressão
+digital calculada uma vez só, e o PlanoRotas (usado para a distância, pelas condições e pelas etapas que o
+recebem) só é remontado quando rotas_df, frota, matriz ou limite_pct mudam. Pode ser usado sem Streamlit:
+
+    pipeline = PipelinePosProcessamento(etapas_padrao(balanceamento_auto=True))
+    contexto, relatorio = pipeline.executar({'rotas_df': rotas_df, 'frota': frota, 'pedidos': pedidos,
+                                             'matriz_distancias': matriz})
+"""
+import time
+import logging
+
+import numpy as np
+import pandas as pd
+
+from routing import pos_processamento
+from routing.plano_rotas import PlanoRotas
+from routing.cache_resultados import impressao_digital_df, impressao_digital_matriz
+
+
+class Etapa:
+    """
+    Etapa do pipeline. funcao recebe as entradas como argumentos nomeados e retorna um valor por saída
+    (tupla quando há mais de uma). condicao(contexto) -> motivo para pular (str) ou None.
+    usa_plano=True passa também plano=PlanoRotas do rotas_df atual (compartilhado: a funcao não deve alterá-lo).
+    """
+    __slots__ = ('nome', 'funcao', 'entradas', 'saidas', 'ativa', 'condicao', 'opcionais', 'usa_plano')
+
+    def __init__(self, nome, funcao, entradas=('rotas_df',), saidas=('rotas_df',), ativa=True, condicao=None, opcionais=(),
+                 usa_plano=False):
+        self.nome = nome
+        self.funcao = funcao
+        self.entradas = tuple(entradas)
+        self.saidas = tuple(saidas)
+        self.ativa = ativa
+        self.condicao = condicao
+        self.opcionais = tuple(opcionais)
+        self.usa_plano = usa_plano
+
+    def executar(self, contexto):
+        argumentos = {k: contexto.get(k) for k in self.entradas}
+        if self.usa_plano:
+            argumentos['plano'] = _plano(contexto)
+        resultado = self.funcao(**argumentos)
+        if len(self.saidas) == 1:
+            resultado = (resultado,)
+        return dict(zip(self.saidas, resultado))
+
+
+def _impressao_digital(valor):
+    if isinstance(valor, pd.DataFrame):
+        return impressao_digital_df(valor)
+    if isinstance(valor, np.ndarray):
+        return impressao_digital_matriz(valor)
+    return repr(valor)
+
+
+def _plano(contexto):
+    """
+    PlanoRotas do rotas_df atual (com frota e limite_pct, e com a matriz quando há 'Node_Index_OR').
+    Fica guardado no contexto em '_plano' e só é remontado quando algum desses objetos muda.
+    """
+    rotas_df, frota = contexto['rotas_df'], contexto.get('frota')
+    matriz = contexto.get('matriz_distancias') if 'Node_Index_OR' in rotas_df.columns else None
+    limite_pct = 120 if contexto.get('limite_pct') is None else contexto['limite_pct']
+    depot_index = contexto.get('depot_index', 0)
+    guardado = contexto.get('_plano')
+    if guardado is not None:
+        (df, f, m, lim, dep), plano = guardado
+        if df is rotas_df and f is frota and m is matriz and lim == limite_pct and dep == depot_index:
+            return plano
+    plano = PlanoRotas.de_rotas_df(rotas_df, matriz, frota=frota, depot_index=depot_index, limite_pct=limite_pct)
+    contexto['_plano'] = ((rotas_df, frota, matriz, limite_pct, depot_index), plano)
+    return plano
+
+
+def _distancia_total(contexto):
+    rotas_df, matriz = contexto.get('rotas_df'), contexto.get('matriz_distancias')
+    if matriz is None or rotas_df is None or rotas_df.empty or 'Node_Index_OR' not in rotas_df.columns:
+        return None
+    return _plano(contexto).custo_total()
+
+
+class PipelinePosProcessamento:
+    def __init__(self, etapas, memoria=None):
+        """
+        memoria: dict nome da etapa -> impressão digital das entradas com que ela rodou sem alterar nada.
+        Passe o mesmo dict a cada execução (ex.: st.session_state) para pular etapas entre execuções.
+        """
+        self.etapas = list(etapas)
+        self._sem_alteracao = {} if memoria is None else memoria
+
+    def executar(self, contexto):
+        """
+        Executa as etapas em ordem sobre uma cópia do contexto. Retorna (contexto, relatorio), em que relatorio
+        é um DataFrame com Etapa, Status, Tempo (s), Distância antes/depois, Δ Distância e Motivo.
+        """
+        contexto = dict(contexto)
+        contexto.pop('_plano', None)
+        # chave do contexto -> (objeto, impressão digital): cada objeto é hasheado uma vez por execução
+        impressoes = {}
+
+        def impressao(chave, valor):
+            guardada = impressoes.get(chave)
+            if guardada is None or guardada[0] is not valor:
+                guardada = impressoes[chave] = (valor, _impressao_digital(valor))
+            return guardada[1]
+
+        distancia_atual = _distancia_total(contexto)
+        registros = []
+        for etapa in self.etapas:
+            registro = {'Etapa': etapa.nome, 'Status': 'pulada', 'Tempo (s)': 0.0, 'Distância antes': None,
+                        'Distância depois': None, 'Δ Distância': None, 'Motivo': ''}
+            registros.append(registro)
+            if not etapa.ativa:
+                registro['Motivo'] = 'desativada'
+                continue
+            ausentes = [k for k in etapa.entradas if k not in etapa.opcionais and contexto.get(k) is None]
+            if ausentes:
+                registro['Motivo'] = f"entrada ausente: {', '.join(ausentes)}"
+                continue
+            rotas_df = contexto.get('rotas_df')
+            if 'rotas_df' in etapa.entradas and (rotas_df is None or rotas_df.empty):
+                registro['Motivo'] = 'sem rotas'
+                continue
+            motivo = etapa.condicao(contexto) if etapa.condicao else None
+            if motivo:
+                registro['Motivo'] = motivo
+                continue
+            entradas = {k: impressao(k, contexto.get(k)) for k in etapa.entradas}
+            if self._sem_alteracao.get(etapa.nome) == entradas:
+                registro['Motivo'] = 'mesmas entradas de uma execução sem alteração'
+                continue
+            distancia_antes = distancia_atual
+            inicio = time.perf_counter()
+            saidas = etapa.executar(contexto)
+            registro['Tempo (s)'] = round(time.perf_counter() - inicio, 4)
+            contexto.update(saidas)
+            # Saídas e entradas DataFrame são re-hasheadas: a etapa pode ter alterado em place um objeto que só
+            # leu (ex.: a frota). A matriz de distâncias é tratada como somente leitura e não é re-hasheada.
+            for k in etapa.entradas:
+                if k not in saidas and isinstance(contexto.get(k), pd.DataFrame):
+                    impressoes[k] = (contexto[k], _impressao_digital(contexto[k]))
+            for k, valor in saidas.items():
+                impressoes[k] = (valor, _impressao_digital(valor))
+            alterados = {k for k in entradas if impressoes[k][1] != entradas[k]}
+            alterou = bool(alterados)
+            alterados.update(k for k in saidas if k not in entradas)
+            # PlanoRotas e distância só mudam quando rotas_df/matriz/frota/limite_pct mudam (inclusive em place)
+            if alterados & {'rotas_df', 'matriz_distancias', 'frota', 'limite_pct'}:
+                contexto.pop('_plano', None)
+                distancia_atual = _distancia_total(contexto)
+            if alterou:
+                self._sem_alteracao.pop(etapa.nome, None)
+            else:
+                self._sem_alteracao[etapa.nome] = entradas
+            registro['Status'] = 'executada' if alterou else 'sem alteração'
+            registro['Distância antes'] = distancia_antes
+            registro['Distância depois'] = distancia_depois = distancia_atual
+            if distancia_antes is not None and distancia_depois is not None:
+                registro['Δ Distância'] = distancia_depois - distancia_antes
+            logging.info(f"Pipeline: {etapa.nome} {registro['Status']} em {registro['Tempo (s)']:.3f}s.")
+        contexto.pop('_plano', None)
+        return contexto, pd.DataFrame(registros)
+
+
+def adicionar_regiao_e_coordenadas(rotas_df, pedidos):
+    """
+    Propaga 'Região', 'Latitude' e 'Longitude' dos pedidos para rotas_df via 'Pedido_Index_DF'. Valores já
+    presentes em rotas_df são mantidos e só os ausentes são preenchidos: aplicar de novo não altera nada.
+    """
+    novas = {} if 'Região' in rotas_df.columns else {'Região': None}
+    if 'Pedido_Index_DF' not in rotas_df.columns or pedidos is None or pedidos.empty:
+        logging.warning("Não foi possível adicionar coordenadas ao DataFrame de rotas ('Pedido_Index_DF' ou pedidos ausentes).")
+        return rotas_df.assign(**novas) if novas else rotas_df
+    fonte = pedidos.reset_index(drop=True)
+    for coluna in ('Região', 'Latitude', 'Longitude'):
+        if coluna not in fonte.columns:
+            continue
+        valores = rotas_df['Pedido_Index_DF'].map(fonte[coluna])
+        if coluna not in rotas_df.columns:
+            novas[coluna] = valores
+        elif rotas_df[coluna].isna().any():
+            novas[coluna] = rotas_df[coluna].where(rotas_df[coluna].notna(), valores)
+    return rotas_df.assign(**novas) if novas else rotas_df
+
+
+def _com_regiao(contexto):
+    if 'Região' not in contexto['rotas_df'].columns:
+        return "rotas_df sem a coluna 'Região'"
+    return None
+
+
+def _com_excesso(contexto):
+    """Pula a checagem quando nenhum veículo passa do limite e não há pedidos sem veículo."""
+    rotas_df = contexto['rotas_df']
+    if 'Demanda' not in rotas_df.columns:
+        return "rotas_df sem a coluna 'Demanda'"
+    if _plano(contexto).excesso_de_carga().sum() <= 0 and not rotas_df['Veículo'].isna().any():
+        return 'nenhum veículo acima do limite'
+    return None
+
+
+def etapas_padrao(usar_ml=False, usar_reserva_regioes=False, balanceamento_auto=True, usar_vizinhanca=True):
+    """
+    Etapas do pós-processamento na ordem da tela de roteirização. Entradas do contexto: rotas_df, frota,
+    pedidos, matriz_distancias, raio_km (20), limite_pct (120), n_reservas. Saídas extras: n_realocados,
+    n_realocados_restritos, excesso_final.
+    Região e coordenadas são propagadas primeiro, pois a restrição, a realocação e a reserva dependem delas.
+    """
+    return [
+        Etapa('Adicionar região e coordenadas', adicionar_regiao_e_coordenadas, entradas=('rotas_df', 'pedidos')),
+        Etapa('Priorizar regiões preferidas',
+              lambda rotas_df, frota, pedidos, plano: pos_processamento.priorizar_regioes_preferidas(rotas_df, frota, pedidos, plano=plano),
+              entradas=('rotas_df', 'frota', 'pedidos'), saidas=('rotas_df', 'n_realocados'), usa_plano=True),
+        Etapa('Restringir regiões por veículo',
+              lambda rotas_df, pedidos, raio_km, plano: pos_processamento.restringir_1_regiao_por_veiculo(
+                  rotas_df, raio_km=raio_km or 20, pedidos=pedidos, plano=plano),
+              entradas=('rotas_df', 'pedidos', 'raio_km'), opcionais=('raio_km',), condicao=_com_regiao, usa_plano=True),
+        Etapa('Realocar pedidos restritos',
+              lambda rotas_df, frota, pedidos, raio_km, plano: pos_processamento.realocar_pedidos_restritos(
+                  rotas_df, frota, pedidos, raio_km=raio_km or 20, plano=plano),
+              entradas=('rotas_df', 'frota', 'pedidos', 'raio_km'), saidas=('rotas_df', 'n_realocados_restritos'),
+              opcionais=('raio_km',), condicao=_com_regiao, usa_plano=True),
+        Etapa('Agrupamento por ML', lambda pedidos: pos_processamento.sugerir_agrupamento_ml(pedidos),
+              entradas=('pedidos',), saidas=('pedidos',), ativa=usar_ml),
+        Etapa('Reservar veículos para regiões',
+              lambda rotas_df, frota, pedidos, n_reservas: pos_processamento.reservar_veiculos_para_regioes(
+                  rotas_df, frota, pedidos, n_reservas=n_reservas or min(2, len(frota))),
+              entradas=('rotas_df', 'frota', 'pedidos', 'n_reservas'), opcionais=('n_reservas',),
+              ativa=usar_reserva_regioes, condicao=_com_regiao),
+        Etapa('Balanceamento iterativo',
+              lambda rotas_df, frota, pedidos, matriz_distancias: pos_processamento.balanceamento_iterativo(rotas_df, frota, pedidos, matriz_distancias),
+              entradas=('rotas_df', 'frota', 'pedidos', 'matriz_distancias'), ativa=balanceamento_auto),
+        Etapa('Vizinhança (relocate)',
+              lambda rotas_df, matriz_distancias, frota: pos_processamento.mover_para_vizinho_proximo(rotas_df, matriz_distancias, frota=frota),
+              entradas=('rotas_df', 'matriz_distancias', 'frota'), ativa=usar_vizinhanca,
+              condicao=lambda c: None if 'Node_Index_OR' in c['rotas_df'].columns else "rotas_df sem 'Node_Index_OR'"),
+        Etapa('Checar excesso de carga',
+              lambda rotas_df, frota, limite_pct, matriz_distancias, plano: pos_processamento.checar_e_corrigir_excesso_carga(
+                  rotas_df, frota, limite_pct=120 if limite_pct is None else limite_pct, matriz_distancias=matriz_distancias, plano=plano),
+              entradas=('rotas_df', 'frota', 'limite_pct', 'matriz_distancias'), saidas=('rotas_df', 'excesso_final'),
+              opcionais=('limite_pct', 'matriz_distancias'), condicao=_com_excesso, usa_plano=True),
+    ]
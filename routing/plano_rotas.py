@@ -0,0 +1,205 @@
+"""
+Representação de uma solução baseada em arrays, compartilhada pelas etapas de pós-processamento e pelos
+operadores de melhoria, sem reconsultar o rotas_df.
+
+Cada rota é um array int32 com os nós visitados (sem o depósito). Os nós são os índices da matriz de
+distâncias ('Node_Index_OR'); sem essa coluna, a posição da linha no rotas_df + 1. O plano mantém a carga,
+a carga acumulada e o custo de cada rota, e para cada nó a rota, a posição e a linha do rotas_df, de modo
+que consultas de carga são O(1) e só as rotas alteradas são recalculadas. A matriz é opcional: sem ela os
+custos ficam zerados e as inserções vão para o fim da rota.
+"""
+import numpy as np
+import pandas as pd
+
+
+class PlanoRotas:
+    __slots__ = (
+        'veiculos', 'indice_veiculo', 'rotas', 'cargas', 'custos', 'capacidades', 'prefixo_carga',
+        'demandas', 'matriz', '_d', 'depot_index', 'rota_do_no', 'posicao_do_no', 'linha_do_no'
+    )
+
+    def __init__(self, veiculos, rotas, demandas, matriz_distancias=None, capacidades=None, depot_index=0):
+        self.matriz = None if matriz_distancias is None else np.asarray(matriz_distancias, dtype=float)
+        self._d = None
+        self.depot_index = int(depot_index)
+        self.veiculos = np.asarray(veiculos, dtype=object)
+        self.indice_veiculo = {v: r for r, v in enumerate(self.veiculos)}
+        self.demandas = np.asarray(demandas, dtype=float)
+        n_rotas = len(self.veiculos)
+        self.capacidades = np.full(n_rotas, np.inf) if capacidades is None else np.asarray(capacidades, dtype=float)
+        n_nos = len(self.demandas) if self.matriz is None else self.matriz.shape[0]
+        self.rota_do_no = np.full(n_nos, -1, dtype=np.int32)
+        self.posicao_do_no = np.full(n_nos, -1, dtype=np.int32)
+        self.linha_do_no = np.full(n_nos, -1, dtype=np.int64)
+        self.rotas = [np.zeros(0, dtype=np.int32)] * n_rotas
+        self.cargas = np.zeros(n_rotas)
+        self.custos = np.zeros(n_rotas)
+        self.prefixo_carga = [np.zeros(1)] * n_rotas
+        for r, nos in enumerate(rotas):
+            self.atualizar_rota(r, nos)
+
+    @property
+    def d(self):
+        """Matriz como lista de listas (acesso escalar mais rápido nos operadores); criada no primeiro uso."""
+        if self._d is None and self.matriz is not None:
+            self._d = self.matriz.tolist()
+        return self._d
+
+    @staticmethod
+    def nos_do_rotas_df(rotas_df):
+        """Nó de cada linha: 'Node_Index_OR' se existir e estiver completo, senão a posição da linha + 1."""
+        if 'Node_Index_OR' in rotas_df.columns and rotas_df['Node_Index_OR'].notna().all():
+            return rotas_df['Node_Index_OR'].to_numpy(dtype=np.int64)
+        return np.arange(1, len(rotas_df) + 1, dtype=np.int64)
+
+    @classmethod
+    def de_rotas_df(cls, rotas_df, matriz_distancias=None, frota=None, depot_index=0, limite_pct=100):
+        """
+        Monta o plano a partir de um rotas_df ('Veículo', 'Sequencia', 'Node_Index_OR', 'Demanda').
+        Com frota, inclui também os veículos sem rota e usa 'Capacidade (Kg)' * limite_pct/100 como limite.
+        Linhas sem veículo ficam como nós não atendidos.
+        """
+        nos = cls.nos_do_rotas_df(rotas_df)
+        n_nos = np.asarray(matriz_distancias).shape[0] if matriz_distancias is not None else int(nos.max(initial=0)) + 1
+        demandas = np.zeros(n_nos)
+        if 'Demanda' in rotas_df.columns:
+            demandas[nos] = pd.to_numeric(rotas_df['Demanda'], errors='coerce').fillna(0).to_numpy()
+        veiculo_linha = rotas_df['Veículo'].to_numpy(dtype=object)
+        atribuidos = pd.notna(veiculo_linha)
+        sequencia = rotas_df['Sequencia'].to_numpy() if 'Sequencia' in rotas_df.columns else np.arange(len(rotas_df))
+        ordem = np.flatnonzero(atribuidos)
+        ordem = ordem[np.lexsort((sequencia[ordem], pd.factorize(veiculo_linha[ordem], sort=True)[0]))]
+        veiculos = list(pd.unique(veiculo_linha[ordem]))
+        capacidades = None
+        if frota is not None and not frota.empty:
+            id_col = 'ID Veículo' if 'ID Veículo' in frota.columns else 'Placa'
+            presentes = set(veiculos)
+            veiculos += [v for v in frota[id_col].dropna().unique() if v not in presentes]
+            if 'Capacidade (Kg)' in frota.columns:
+                cap = pd.to_numeric(frota.drop_duplicates(id_col).set_index(id_col)['Capacidade (Kg)'], errors='coerce')
+                capacidades = cap.reindex(veiculos).fillna(np.inf).to_numpy(dtype=float) * limite_pct / 100.0
+        inicios = np.flatnonzero(np.r_[True, veiculo_linha[ordem][1:] != veiculo_linha[ordem][:-1]]) if len(ordem) else np.zeros(0, dtype=int)
+        grupos = dict(zip(veiculo_linha[ordem][inicios], np.split(nos[ordem], inicios[1:])))
+        rotas = [grupos.get(v, np.zeros(0, dtype=np.int64)) for v in veiculos]
+        plano = cls(veiculos, rotas, demandas, matriz_distancias, capacidades, depot_index)
+        plano.linha_do_no[nos] = np.arange(len(rotas_df))
+        return plano
+
+    def copiar(self):
+        """Cópia independente do estado das rotas (matriz, demandas e veículos são compartilhados)."""
+        novo = object.__new__(PlanoRotas)
+        for atributo in ('veiculos', 'indice_veiculo', 'demandas', 'matriz', '_d', 'depot_index', 'capacidades', 'linha_do_no'):
+            setattr(novo, atributo, getattr(self, atributo))
+        # As rotas são substituídas (nunca alteradas no lugar) por atualizar_rota: basta copiar as listas
+        novo.rotas = list(self.rotas)
+        novo.prefixo_carga = list(self.prefixo_carga)
+        novo.cargas = self.cargas.copy()
+        novo.custos = self.custos.copy()
+        novo.rota_do_no = self.rota_do_no.copy()
+        novo.posicao_do_no = self.posicao_do_no.copy()
+        return novo
+
+    def custo_rota(self, nos):
+        """Custo da rota com saída e retorno ao depósito."""
+        if len(nos) == 0 or self.matriz is None:
+            return 0.0
+        caminho = np.r_[self.depot_index, nos, self.depot_index]
+        return float(self.matriz[caminho[:-1], caminho[1:]].sum())
+
+    def atualizar_rota(self, r, nos):
+        """Substitui a rota r e recalcula custo, carga, carga acumulada e índices dos nós."""
+        nos = np.asarray(nos, dtype=np.int32)
+        self.rotas[r] = nos
+        self.custos[r] = self.custo_rota(nos)
+        self.prefixo_carga[r] = np.r_[0.0, np.cumsum(self.demandas[nos])]
+        self.cargas[r] = self.prefixo_carga[r][-1]
+        self.rota_do_no[nos] = r
+        self.posicao_do_no[nos] = np.arange(len(nos), dtype=np.int32)
+
+    def retirar(self, u):
+        """Retira o nó u da rota em que está (fica não atendido)."""
+        r = int(self.rota_do_no[u])
+        if r >= 0:
+            self.atualizar_rota(r, np.delete(self.rotas[r], self.posicao_do_no[u]))
+            self.rota_do_no[u] = -1
+            self.posicao_do_no[u] = -1
+
+    def mover(self, u, r):
+        """
+        Move o nó u para a rota r: na posição de menor custo de inserção se houver matriz, senão no fim.
+        """
+        self.retirar(u)
+        rota = self.rotas[r]
+        pos = len(rota)
+        if self.matriz is not None and len(rota):
+            anteriores = np.r_[self.depot_index, rota]
+            seguintes = np.r_[rota, self.depot_index]
+            m = self.matriz
+            pos = int(np.argmin(m[anteriores, u] + m[u, seguintes] - m[anteriores, seguintes]))
+        self.atualizar_rota(r, np.insert(rota, pos, u))
+
+    def custos_insercao(self, r, nos):
+        """Menor custo de inserção de cada nó na rota r e a posição correspondente (requer matriz)."""
+        m, dep = self.matriz, self.depot_index
+        rota = self.rotas[r]
+        anteriores = np.r_[dep, rota]
+        seguintes = np.r_[rota, dep]
+        custos = m[np.ix_(anteriores, nos)] + m[np.ix_(nos, seguintes)].T - m[anteriores, seguintes][:, None]
+        pos = np.argmin(custos, axis=0)
+        return custos[pos, np.arange(len(nos))], pos
+
+    def economias_remocao(self, r):
+        """Redução de custo ao retirar cada nó da rota r (requer matriz)."""
+        m, dep = self.matriz, self.depot_index
+        rota = self.rotas[r]
+        anteriores = np.r_[dep, rota[:-1]]
+        seguintes = np.r_[rota[1:], dep]
+        return m[anteriores, rota] + m[rota, seguintes] - m[anteriores, seguintes]
+
+    def carga_de(self, veiculo):
+        r = self.indice_veiculo.get(veiculo)
+        return 0.0 if r is None else float(self.cargas[r])
+
+    def veiculo_do_no(self, u):
+        r = self.rota_do_no[u]
+        return self.veiculos[r] if r >= 0 else None
+
+    def anterior(self, r, i):
+        return int(self.rotas[r][i - 1]) if i > 0 else self.depot_index
+
+    def seguinte(self, r, i):
+        return int(self.rotas[r][i + 1]) if i + 1 < len(self.rotas[r]) else self.depot_index
+
+    def nos_atendidos(self):
+        return np.flatnonzero(self.rota_do_no >= 0)
+
+    def custo_total(self):
+        return float(self.custos.sum())
+
+    def excesso_de_carga(self):
+        """Carga acima da capacidade por rota (0 quando dentro do limite)."""
+        return np.maximum(self.cargas - self.capacidades, 0)
+
+    def para_rotas_df(self, rotas_df, ordenar=True):
+        """
+        Devolve o rotas_df original com 'Veículo' e 'Sequencia' refletindo o plano (e 'Carga_Acumulada'
+        recalculada, se existir). Nós não atendidos ficam com 'Veículo' None.
+        ordenar=True ordena por veículo e sequência; False preserva a ordem e o índice das linhas.
+        """
+        if rotas_df is None or rotas_df.empty:
+            return rotas_df
+        df = rotas_df.copy()
+        nos = self.nos_do_rotas_df(df)
+        rotas_dos_nos = self.rota_do_no[nos]
+        atendidos = rotas_dos_nos >= 0
+        df['Veículo'] = np.where(atendidos, self.veiculos[np.maximum(rotas_dos_nos, 0)], None)
+        if 'Sequencia' in df.columns:
+            df.loc[atendidos, 'Sequencia'] = self.posicao_do_no[nos[atendidos]] + 1
+        if 'Carga_Acumulada' in df.columns and 'Demanda' in df.columns:
+            carga_acumulada = np.zeros(len(self.rota_do_no))
+            for r, rota in enumerate(self.rotas):
+                carga_acumulada[rota] = self.prefixo_carga[r][:-1]
+            df.loc[atendidos, 'Carga_Acumulada'] = carga_acumulada[nos[atendidos]].astype(rotas_df['Carga_Acumulada'].dtype)
+        if ordenar:
+            df = df.sort_values([c for c in ('Veículo', 'Sequencia') if c in df.columns], kind='stable').reset_index(drop=True)
+        return df
@@ -1,4 +1,20 @@
-def realocar_pedidos_restritos(rotas_df, frota, pedidos, raio_km=20):
+def centroides_por_regiao(pedidos, minusculas=False):
+    """
+    Centroide (lat, lon) dos pedidos de cada região, calculado com um único groupby.
+    minusculas=True usa os nomes de região em minúsculas como chave.
+    """
+    if pedidos is None or not {'Região', 'Latitude', 'Longitude'}.issubset(pedidos.columns):
+        return {}
+    regioes = pedidos['Região'].str.lower() if minusculas else pedidos['Região']
+    medias = pedidos[['Latitude', 'Longitude']].groupby(regioes).mean()
+    return dict(zip(medias.index, zip(medias['Latitude'], medias['Longitude'])))
+
+def realocar_pedidos_restritos(rotas_df, frota, pedidos, raio_km=20, plano=None):
+    # Trabalha em cópias: rotas_df, frota e pedidos recebidos não são alterados, e o rotas_df original é
+    # devolvido quando nenhum pedido é marcado nem realocado
+    rotas_original = rotas_df
+    rotas_df = rotas_df.copy()
+    frota = frota.copy()
     # Garante que a frota tenha as colunas de janela de tempo e preenche valores padrão se necessário
     if 'Janela Início' not in frota.columns:
         frota['Janela Início'] = '05:00'
@@ -22,49 +38,47 @@ def realocar_pedidos_restritos(rotas_df, frota, pedidos, raio_km=20):
     # Define id_col antes de qualquer uso
     id_col = 'ID Veículo' if 'ID Veículo' in frota.columns else 'Placa'
 
-    # Cria dicionário de janelas da frota
-    janela_inicio_frota = frota.set_index(id_col)['Janela Início'].to_dict()
-    janela_fim_frota = frota.set_index(id_col)['Janela Fim'].to_dict()
-
+    # Janelas convertidas uma vez para minutos desde a meia-noite (em cópias, sem colunas extras nos DataFrames)
+    import numpy as np
+    from routing.utils import adicionar_janelas_em_minutos
+    janelas_rotas = adicionar_janelas_em_minutos(rotas_df)
+    janelas_frota = adicionar_janelas_em_minutos(frota).drop_duplicates(id_col, keep='last').set_index(id_col)
+    veiculos = rotas_df['Veículo']
+    no_cadastro = veiculos.isin(janelas_frota.index).to_numpy()
+    # Veículo fora do cadastro da frota usa a janela padrão 05:00-18:00
+    ini_veic = np.where(no_cadastro, veiculos.map(janelas_frota['Janela_Inicio_Min']), 5 * 60).astype(float)
+    fim_veic = np.where(no_cadastro, veiculos.map(janelas_frota['Janela_Fim_Min']), 18 * 60).astype(float)
+    ini_ped = janelas_rotas['Janela_Inicio_Min'].to_numpy(dtype=float)
+    fim_ped = janelas_rotas['Janela_Fim_Min'].to_numpy(dtype=float)
+    atribuidos = veiculos.notna().to_numpy()
+    invalidos = atribuidos & np.isnan(np.c_[ini_ped, fim_ped, ini_veic, fim_veic]).any(axis=1)
+    for idx in rotas_df.index[invalidos]:
+        logging.warning(f"Erro ao comparar janelas de tempo para pedido {idx}: horário fora do formato HH:MM.")
     # Marca como restrito todo pedido cuja janela não está contida na janela do veículo
-    for idx, row in rotas_df.iterrows():
-        veic = row['Veículo']
-        if pd.isnull(veic):
-            continue
-        janela_ini_ped = row['Janela Início'] if 'Janela Início' in row else '05:00'
-        janela_fim_ped = row['Janela Fim'] if 'Janela Fim' in row else '18:00'
-        janela_ini_veic = janela_inicio_frota.get(veic, '05:00')
-        janela_fim_veic = janela_fim_frota.get(veic, '18:00')
-        # Compara horários (formato HH:MM)
-        try:
-            from datetime import datetime
-            fmt = '%H:%M'
-            ini_ped = datetime.strptime(str(janela_ini_ped), fmt)
-            fim_ped = datetime.strptime(str(janela_fim_ped), fmt)
-            ini_veic = datetime.strptime(str(janela_ini_veic), fmt)
-            fim_veic = datetime.strptime(str(janela_fim_veic), fmt)
-            # Se pedido começa antes do veículo ou termina depois do veículo, marca como restrito
-            if ini_ped < ini_veic or fim_ped > fim_veic:
-                rotas_df.at[idx, 'Alocacao_Restrita'] = True
-                logging.warning(f"Pedido {idx} com janela [{janela_ini_ped}-{janela_fim_ped}] não cabe na janela do veículo {veic} [{janela_ini_veic}-{janela_fim_veic}]. Marcado como restrito.")
-        except Exception as e:
-            logging.warning(f"Erro ao comparar janelas de tempo para pedido {idx}: {e}")
+    # (pedido começa antes do veículo ou termina depois do veículo)
+    restritos = atribuidos & ~invalidos & ((ini_ped < ini_veic) | (fim_ped > fim_veic))
+    marcou = bool(restritos.any())
+    if marcou:
+        rotas_df.loc[restritos, 'Alocacao_Restrita'] = True
+        for idx, veic, ini, fim in zip(rotas_df.index[restritos], veiculos[restritos], rotas_df['Janela Início'][restritos], rotas_df['Janela Fim'][restritos]):
+            logging.warning(f"Pedido {idx} com janela [{ini}-{fim}] não cabe na janela do veículo {veic} [{janelas_frota['Janela Início'].get(veic, '05:00')}-{janelas_frota['Janela Fim'].get(veic, '18:00')}]. Marcado como restrito.")
     """
     Tenta realocar pedidos marcados como Alocacao_Restrita para outros veículos que atendam até 2 regiões próximas (por nome e raio) e tenham capacidade disponível.
     Remove a marcação se conseguir realocar. Retorna o DataFrame atualizado e o número de realocações.
+    plano: PlanoRotas já montado para este rotas_df (ex.: o do pipeline); é copiado, não alterado.
     """
-    from geopy.distance import geodesic
     import numpy as np
-    import logging
+    from routing.utils import haversine_km
     # Validação e padronização das colunas essenciais
     col_essenciais = ['Região', 'Latitude', 'Longitude', 'Veículo', 'Demanda']
     for col in col_essenciais:
         if col not in rotas_df.columns:
             logging.error(f"Coluna obrigatória '{col}' ausente em rotas_df. Abortando realocação.")
-            return rotas_df, 0
+            return (rotas_df if marcou else rotas_original), 0
     if pedidos is None or 'Região' not in pedidos.columns or 'Latitude' not in pedidos.columns or 'Longitude' not in pedidos.columns:
         logging.error("Pedidos DataFrame ausente ou sem colunas essenciais. Abortando realocação.")
-        return rotas_df, 0
+        return (rotas_df if marcou else rotas_original), 0
+    pedidos = pedidos.copy()
     # Padroniza nomes de regiões (strip, title)
     rotas_df['Região'] = rotas_df['Região'].astype(str).str.strip().str.title()
     pedidos['Região'] = pedidos['Região'].astype(str).str.strip().str.title()
@@ -74,191 +88,231 @@ def realocar_pedidos_restritos(rotas_df, frota, pedidos, raio_km=20):
     pedidos['Latitude'] = pd.to_numeric(pedidos['Latitude'], errors='coerce')
     pedidos['Longitude'] = pd.to_numeric(pedidos['Longitude'], errors='coerce')
     # Remove pedidos restritos sem coordenadas válidas
-    pedidos_restritos = rotas_df[(rotas_df['Alocacao_Restrita'] == True) & rotas_df['Latitude'].notnull() & rotas_df['Longitude'].notnull()]
-    if pedidos_restritos.empty:
+    mascara_restritos = ((rotas_df['Alocacao_Restrita'] == True) & rotas_df['Latitude'].notnull() & rotas_df['Longitude'].notnull()).to_numpy()
+    if not mascara_restritos.any():
         logging.info("Nenhum pedido restrito com coordenadas válidas para realocação.")
-        return rotas_df, 0
+        return (rotas_df if marcou else rotas_original), 0
+    from routing.plano_rotas import PlanoRotas
     id_col = 'ID Veículo' if 'ID Veículo' in frota.columns else 'Placa'
     capacidades = frota.set_index(id_col)['Capacidade (Kg)'].to_dict() if 'Capacidade (Kg)' in frota.columns else {}
+    # Cargas e rotas consultadas no plano (O(1)) em vez de filtrar o rotas_df a cada candidato
+    plano = plano.copiar() if plano is not None else PlanoRotas.de_rotas_df(rotas_df, frota=frota)
+    nos = PlanoRotas.nos_do_rotas_df(rotas_df)
+    regiao_linha = rotas_df['Região'].to_numpy(dtype=object)
+    lat_linha = rotas_df['Latitude'].to_numpy(dtype=float)
+    lon_linha = rotas_df['Longitude'].to_numpy(dtype=float)
+    # Candidatos na ordem de primeira aparição no rotas_df (linha mais alta de cada veículo), atualizada a
+    # cada realocação como se o rotas_df fosse relido
+    primeira_linha = pd.Series(np.arange(len(rotas_df))).groupby(rotas_df['Veículo'].to_numpy()).min().to_dict()
+    veiculos_candidatos = sorted(primeira_linha, key=primeira_linha.get)
+    # Centroides calculados uma vez; as 2 regiões predominantes de cada rota ficam em cache e só são
+    # recalculadas para as rotas alteradas por uma realocação
+    centroides = centroides_por_regiao(pedidos)
+    regioes_pred_cache = {}
+    def regioes_predominantes(r):
+        if r not in regioes_pred_cache:
+            linhas_veic = np.sort(plano.linha_do_no[plano.rotas[r]])
+            regioes_pred_cache[r] = set(pd.Series(regiao_linha[linhas_veic]).value_counts().index[:2])
+        return regioes_pred_cache[r]
+    # Só a região do próprio pedido pode liberar um veículo: uma distância por pedido, todas em um broadcast
+    linhas_restritas = np.flatnonzero(mascara_restritos)
+    centroide_linha = np.array([centroides.get(reg, (np.nan, np.nan)) for reg in regiao_linha[linhas_restritas]], dtype=float).reshape(-1, 2)
+    dentro_do_raio = dict(zip(linhas_restritas, haversine_km(
+        lat_linha[linhas_restritas], lon_linha[linhas_restritas], centroide_linha[:, 0], centroide_linha[:, 1]
+    ) <= raio_km))
     realocados = 0
-    for idx, row in pedidos_restritos.iterrows():
-        lat = row['Latitude']
-        lon = row['Longitude']
-        reg_pedido = row['Região']
-        demanda = row['Demanda'] if 'Demanda' in row else 0
-        veic_atual = row['Veículo']
+    desmarcados = []
+    for i in linhas_restritas:
+        u = nos[i]
+        lat = lat_linha[i]
+        lon = lon_linha[i]
+        reg_pedido = regiao_linha[i]
+        demanda = plano.demandas[u]
+        veic_atual = plano.veiculo_do_no(u)
         if pd.isnull(lat) or pd.isnull(lon) or not reg_pedido or pd.isnull(veic_atual):
-            logging.warning(f"Pedido restrito ignorado por dados faltantes: idx={idx}, regiao={reg_pedido}, lat={lat}, lon={lon}, veic_atual={veic_atual}")
+            logging.warning(f"Pedido restrito ignorado por dados faltantes: idx={rotas_df.index[i]}, regiao={reg_pedido}, lat={lat}, lon={lon}, veic_atual={veic_atual}")
+            continue
+        if not dentro_do_raio[i]:
             continue
         melhor_veic = None
-        for veic in rotas_df['Veículo'].unique():
+        for veic in veiculos_candidatos:
             if veic == veic_atual:
                 continue
-            pedidos_veic = rotas_df[rotas_df['Veículo'] == veic]
-            if pedidos_veic.empty:
-                continue
-            regioes_pred = pedidos_veic['Região'].value_counts().index[:2].tolist()
-            centroides = []
-            for reg in regioes_pred:
-                pedidos_regiao = pedidos[pedidos['Região'] == reg]
-                if not pedidos_regiao.empty and 'Latitude' in pedidos_regiao.columns and 'Longitude' in pedidos_regiao.columns:
-                    lat_centroide = pedidos_regiao['Latitude'].mean()
-                    lon_centroide = pedidos_regiao['Longitude'].mean()
-                    centroides.append((reg, (lat_centroide, lon_centroide)))
-            permitido = False
-            for reg, (lat_c, lon_c) in centroides:
-                if reg_pedido == reg:
-                    dist = geodesic((lat, lon), (lat_c, lon_c)).km
-                    if dist <= raio_km:
-                        permitido = True
-                        break
-            if not permitido:
+            r = plano.indice_veiculo[veic]
+            if len(plano.rotas[r]) == 0 or reg_pedido not in regioes_predominantes(r):
                 continue
             cap = capacidades.get(veic, None)
-            carga_atual = rotas_df[rotas_df['Veículo'] == veic]['Demanda'].sum() if 'Demanda' in rotas_df.columns else 0
-            if cap is not None and carga_atual + demanda <= cap:
+            if cap is not None and plano.cargas[r] + demanda <= cap:
                 melhor_veic = veic
                 break
-        if melhor_veic:
-            rotas_df.at[idx, 'Veículo'] = melhor_veic
-            rotas_df.at[idx, 'Alocacao_Restrita'] = False
+        if melhor_veic is not None:
+            rota_antiga = plano.rota_do_no[u]
+            regioes_pred_cache.pop(rota_antiga, None)
+            plano.mover(u, plano.indice_veiculo[melhor_veic])
+            regioes_pred_cache.pop(plano.indice_veiculo[melhor_veic], None)
+            if len(plano.rotas[rota_antiga]):
+                primeira_linha[veic_atual] = int(plano.linha_do_no[plano.rotas[rota_antiga]].min())
+            else:
+                primeira_linha.pop(veic_atual, None)
+            primeira_linha[melhor_veic] = min(primeira_linha[melhor_veic], int(i))
+            veiculos_candidatos = sorted(primeira_linha, key=primeira_linha.get)
+            desmarcados.append(i)
             realocados += 1
+    if not realocados and not marcou:
+        return rotas_original, 0
+    rotas_df = plano.para_rotas_df(rotas_df, ordenar=False)
+    if desmarcados:
+        rotas_df.loc[rotas_df.index[desmarcados], 'Alocacao_Restrita'] = False
     return rotas_df, realocados
-def restringir_1_regiao_por_veiculo(rotas_df, raio_km=20, pedidos=None):
+def restringir_1_regiao_por_veiculo(rotas_df, raio_km=20, pedidos=None, plano=None):
     """
     Para cada veículo, identifica a região predominante e só permite pedidos dentro de um raio máximo (em km)
     do centroide da região predominante. Pedidos fora desse raio são marcados como restritos.
+    plano: PlanoRotas já montado para este rotas_df (ex.: o do pipeline); só é consultado.
     """
-    from geopy.distance import geodesic
     import numpy as np
+    from routing.plano_rotas import PlanoRotas
+    from routing.utils import haversine_km
     if rotas_df is None or rotas_df.empty or 'Veículo' not in rotas_df.columns or 'Região' not in rotas_df.columns:
         return rotas_df
+    # As rotas vêm do plano (linhas de cada veículo em O(tamanho da rota)), sem filtrar o rotas_df por veículo
+    if plano is None:
+        plano = PlanoRotas.de_rotas_df(rotas_df)
+    regiao_linha = rotas_df['Região'].to_numpy(dtype=object)
+    pedido_linha = rotas_df['Pedido_Index_DF'].to_numpy(dtype=object) if 'Pedido_Index_DF' in rotas_df.columns else rotas_df.index.to_numpy()
+    restritos = []
     if pedidos is None or 'Latitude' not in rotas_df.columns or 'Longitude' not in rotas_df.columns:
         # fallback: só restringe por nome de região
-        for veic in rotas_df['Veículo'].unique():
-            pedidos_veic = rotas_df[rotas_df['Veículo'] == veic]
-            if pedidos_veic.empty:
+        for r, rota in enumerate(plano.rotas):
+            if len(rota) == 0:
                 continue
-            regiao_pred = pedidos_veic['Região'].mode().iloc[0]
-            fora_regiao = pedidos_veic[pedidos_veic['Região'] != regiao_pred]
-            for idx in fora_regiao.index:
-                rotas_df.at[idx, 'Alocacao_Restrita'] = True
-                logging.warning(f"Pedido {rotas_df.at[idx, 'Pedido_Index_DF']} está fora da região predominante '{regiao_pred}' do veículo {veic}.")
+            veic = plano.veiculos[r]
+            linhas_veic = np.sort(plano.linha_do_no[rota])
+            regioes_veic = pd.Series(regiao_linha[linhas_veic])
+            regiao_pred = regioes_veic.mode().iloc[0]
+            for i in linhas_veic[(regioes_veic != regiao_pred).to_numpy()]:
+                restritos.append(i)
+                logging.warning(f"Pedido {pedido_linha[i]} está fora da região predominante '{regiao_pred}' do veículo {veic}.")
+        if restritos:
+            rotas_df = rotas_df.copy()
+            rotas_df.loc[rotas_df.index[restritos], 'Alocacao_Restrita'] = True
         return rotas_df
     # Com coordenadas e DataFrame de pedidos
-    for veic in rotas_df['Veículo'].unique():
-        pedidos_veic = rotas_df[rotas_df['Veículo'] == veic]
-        if pedidos_veic.empty:
+    lat_linha = pd.to_numeric(rotas_df['Latitude'], errors='coerce').to_numpy(dtype=float)
+    lon_linha = pd.to_numeric(rotas_df['Longitude'], errors='coerce').to_numpy(dtype=float)
+    centroides_regiao = centroides_por_regiao(pedidos)
+    for r, rota in enumerate(plano.rotas):
+        if len(rota) == 0:
             continue
+        veic = plano.veiculos[r]
+        linhas_veic = np.sort(plano.linha_do_no[rota])
         # Identifica até 2 regiões predominantes
-        regioes_pred = pedidos_veic['Região'].value_counts().index[:2].tolist()
-        # Calcula centroides das 2 regiões
-        centroides = []
-        for reg in regioes_pred:
-            pedidos_regiao = pedidos[pedidos['Região'] == reg]
-            if not pedidos_regiao.empty and 'Latitude' in pedidos_regiao.columns and 'Longitude' in pedidos_regiao.columns:
-                lat_centroide = pedidos_regiao['Latitude'].mean()
-                lon_centroide = pedidos_regiao['Longitude'].mean()
-                centroides.append((reg, (lat_centroide, lon_centroide)))
-        for idx, row in pedidos_veic.iterrows():
-            lat = row['Latitude']
-            lon = row['Longitude']
-            reg_pedido = row['Região']
-            if np.isnan(lat) or np.isnan(lon):
-                rotas_df.at[idx, 'Alocacao_Restrita'] = True
-                continue
-            # Permite se o pedido está em uma das 2 regiões predominantes E dentro do raio
-            permitido = False
-            for reg, (lat_c, lon_c) in centroides:
-                if reg_pedido == reg:
-                    dist = geodesic((lat, lon), (lat_c, lon_c)).km
-                    if dist <= raio_km:
-                        permitido = True
-                        break
-            if not permitido:
-                rotas_df.at[idx, 'Alocacao_Restrita'] = True
-                logging.warning(f"Pedido {row['Pedido_Index_DF']} está fora das 2 regiões predominantes do veículo {veic} ou além do raio permitido.")
+        regioes_pred = pd.Series(regiao_linha[linhas_veic]).value_counts().index[:2].tolist()
+        # Centroides das 2 regiões (tabela calculada uma vez)
+        regioes_c = [reg for reg in regioes_pred if reg in centroides_regiao]
+        coords_c = np.array([centroides_regiao[reg] for reg in regioes_c], dtype=float).reshape(-1, 2)
+        lat_v, lon_v = lat_linha[linhas_veic], lon_linha[linhas_veic]
+        # Permite se o pedido está em uma das 2 regiões predominantes E dentro do raio (pedidos x centroides)
+        dist = haversine_km(lat_v[:, None], lon_v[:, None], coords_c[None, :, 0], coords_c[None, :, 1])
+        mesma_regiao = regiao_linha[linhas_veic][:, None] == np.array(regioes_c, dtype=object)[None, :]
+        permitido = (mesma_regiao & (dist <= raio_km)).any(axis=1)
+        sem_coordenada = np.isnan(lat_v) | np.isnan(lon_v)
+        restritos.extend(linhas_veic[sem_coordenada])
+        for i in linhas_veic[~permitido & ~sem_coordenada]:
+            restritos.append(i)
+            logging.warning(f"Pedido {pedido_linha[i]} está fora das 2 regiões predominantes do veículo {veic} ou além do raio permitido.")
+    if restritos:
+        rotas_df = rotas_df.copy()
+        rotas_df.loc[rotas_df.index[restritos], 'Alocacao_Restrita'] = True
     return rotas_df
-def priorizar_regioes_preferidas(rotas_df, frota, pedidos):
+def priorizar_regioes_preferidas(rotas_df, frota, pedidos, plano=None):
     """
     Move pedidos para veículos que tenham a região do pedido em suas 'Regiões Preferidas' (restrição dura).
     Se não houver capacidade, aloca para o veículo cuja região preferida seja mais próxima.
     Se ainda assim não couber, aloca para qualquer veículo disponível.
+    plano: PlanoRotas já montado para este rotas_df (ex.: o do pipeline); é copiado, não alterado.
     """
     import pandas as pd
     import numpy as np
-    from geopy.distance import geodesic
+    from routing.plano_rotas import PlanoRotas
+    from routing.utils import haversine_km
     if rotas_df is None or rotas_df.empty or 'Veículo' not in rotas_df.columns or 'Pedido_Index_DF' not in rotas_df.columns:
         return rotas_df, 0
     if 'Região' not in pedidos.columns:
         return rotas_df, 0
     id_col = 'ID Veículo' if 'ID Veículo' in frota.columns else 'Placa'
     regioes_pref_dict = {}
-    regioes_centroides = {}
-    for _, row in frota.iterrows():
-        veic = row.get(id_col)
-        regioes_pref = row.get('Regiões Preferidas', '')
-        regioes_pref_list = [r.strip().lower() for r in str(regioes_pref).split(',') if r.strip()]
-        regioes_pref_dict[veic] = regioes_pref_list
-        # Calcula centroide das regiões preferidas do veículo
-        for reg in regioes_pref_list:
-            if reg and reg not in regioes_centroides and reg in pedidos['Região'].str.lower().values:
-                pedidos_reg = pedidos[pedidos['Região'].str.lower() == reg]
-                if not pedidos_reg.empty:
-                    lat = pedidos_reg['Latitude'].mean()
-                    lon = pedidos_reg['Longitude'].mean()
-                    regioes_centroides[reg] = (lat, lon)
+    regioes_pref_col = frota['Regiões Preferidas'].tolist() if 'Regiões Preferidas' in frota.columns else [''] * len(frota)
+    for veic, regioes_pref in zip(frota[id_col].tolist(), regioes_pref_col):
+        regioes_pref_dict[veic] = [r.strip().lower() for r in str(regioes_pref).split(',') if r.strip()]
+    # Índice invertido região -> veículos que a preferem (na ordem da frota)
+    veiculos_por_regiao = {}
+    for veic, regs in regioes_pref_dict.items():
+        for reg in dict.fromkeys(regs):
+            veiculos_por_regiao.setdefault(reg, []).append(veic)
+    # Centroide de cada região calculado uma vez (um único groupby)
+    regioes_centroides = centroides_por_regiao(pedidos, minusculas=True)
     pedido_regiao = pedidos['Região'].fillna('').astype(str).str.lower().tolist()
-    pedido_lat = pedidos['Latitude'].tolist() if 'Latitude' in pedidos.columns else None
-    pedido_lon = pedidos['Longitude'].tolist() if 'Longitude' in pedidos.columns else None
+    # Distâncias de todos os pedidos a todos os centroides em um único broadcast (pedidos x regiões)
+    coluna_regiao = {reg: j for j, reg in enumerate(regioes_centroides)}
+    if regioes_centroides:
+        coords_c = np.array(list(regioes_centroides.values()), dtype=float)
+        lat_p = pd.to_numeric(pedidos['Latitude'], errors='coerce').to_numpy(dtype=float)
+        lon_p = pd.to_numeric(pedidos['Longitude'], errors='coerce').to_numpy(dtype=float)
+        dist_pedido_regiao = haversine_km(lat_p[:, None], lon_p[:, None], coords_c[None, :, 0], coords_c[None, :, 1])
+    else:
+        dist_pedido_regiao = np.zeros((len(pedidos), 0))
     capacidades = frota.set_index(id_col)['Capacidade (Kg)'].to_dict() if 'Capacidade (Kg)' in frota.columns else {}
+    # Cargas consultadas no plano (O(1)) e atualizadas a cada movimento
+    plano = plano.copiar() if plano is not None else PlanoRotas.de_rotas_df(rotas_df, frota=frota)
+    nos = PlanoRotas.nos_do_rotas_df(rotas_df)
+    restritos = []
     realocados = 0
-    for idx, row in rotas_df.iterrows():
-        veic_atual = row['Veículo']
-        pedido_idx = row['Pedido_Index_DF']
+    for i, pedido_idx in enumerate(rotas_df['Pedido_Index_DF'].tolist()):
+        u = nos[i]
+        veic_atual = plano.veiculo_do_no(u)
         if pd.isnull(pedido_idx):
             continue
         pedido_idx = int(pedido_idx)
         regiao_pedido = pedido_regiao[pedido_idx] if pedido_idx < len(pedido_regiao) else ''
-        lat_pedido = pedido_lat[pedido_idx] if pedido_lat and pedido_idx < len(pedido_lat) else None
-        lon_pedido = pedido_lon[pedido_idx] if pedido_lon and pedido_idx < len(pedido_lon) else None
+        dist_pedido = dist_pedido_regiao[pedido_idx] if pedido_idx < len(dist_pedido_regiao) else None
         if not regiao_pedido:
             continue
         # 1. Tenta alocar para veículos preferenciais (restrição dura)
-        veics_pref = [v for v, regs in regioes_pref_dict.items() if regiao_pedido in regs]
-        demanda = row['Demanda'] if 'Demanda' in row else 0
+        veics_pref = veiculos_por_regiao.get(regiao_pedido, [])
+        demanda = plano.demandas[u]
         melhor_veic = None
         menor_carga = None
         for v in veics_pref:
             cap = capacidades.get(v, None)
             if cap is None:
                 continue
-            carga_atual = rotas_df[rotas_df['Veículo'] == v]['Demanda'].sum() if 'Demanda' in rotas_df.columns else 0
+            carga_atual = plano.carga_de(v)
             if carga_atual + demanda > cap:
                 continue
             if menor_carga is None or carga_atual < menor_carga:
                 melhor_veic = v
                 menor_carga = carga_atual
         if melhor_veic and melhor_veic != veic_atual:
-            rotas_df.at[idx, 'Veículo'] = melhor_veic
+            plano.mover(u, plano.indice_veiculo[melhor_veic])
             realocados += 1
             continue
         # 2. Se não couber, busca veículo cuja região preferida seja mais próxima (restrição dura)
+        veic_mais_proximo = None
         if veics_pref and not melhor_veic:
             min_dist = None
-            veic_mais_proximo = None
             for v, regs in regioes_pref_dict.items():
+                cap = capacidades.get(v, None)
+                if cap is None or plano.carga_de(v) + demanda > cap:
+                    continue
                 for reg in regs:
-                    if reg in regioes_centroides and lat_pedido is not None and lon_pedido is not None:
-                        dist = geodesic((lat_pedido, lon_pedido), regioes_centroides[reg]).km
-                        cap = capacidades.get(v, None)
-                        carga_atual = rotas_df[rotas_df['Veículo'] == v]['Demanda'].sum() if 'Demanda' in rotas_df.columns else 0
-                        if cap is not None and carga_atual + demanda <= cap:
-                            if min_dist is None or dist < min_dist:
-                                min_dist = dist
-                                veic_mais_proximo = v
+                    if reg in coluna_regiao and dist_pedido is not None and not np.isnan(dist_pedido[coluna_regiao[reg]]):
+                        dist = dist_pedido[coluna_regiao[reg]]
+                        if min_dist is None or dist < min_dist:
+                            min_dist = dist
+                            veic_mais_proximo = v
             if veic_mais_proximo and veic_mais_proximo != veic_atual:
-                rotas_df.at[idx, 'Veículo'] = veic_mais_proximo
+                plano.mover(u, plano.indice_veiculo[veic_mais_proximo])
                 realocados += 1
                 continue
         # 3. Fallback: NÃO permite alocação para veículos fora das regiões preferidas
@@ -268,8 +322,11 @@ def priorizar_regioes_preferidas(rotas_df, frota, pedidos):
         if not veics_pref or (veics_pref and not melhor_veic and not veic_mais_proximo):
             logging.warning(f"Pedido {pedido_idx} (região '{regiao_pedido}') NÃO será alocado: nenhum veículo com região preferida disponível/capaz. Veículo atual: {veic_atual}.")
             # Opcional: marcar para análise
-            rotas_df.at[idx, 'Alocacao_Restrita'] = True
+            restritos.append(i)
             continue
+    rotas_df = plano.para_rotas_df(rotas_df, ordenar=False)
+    if restritos:
+        rotas_df.loc[rotas_df.index[restritos], 'Alocacao_Restrita'] = True
     return rotas_df, realocados
 import numpy as np
 import itertools
@@ -288,51 +345,44 @@ def calcular_distancia_rota(rota, matriz_distancias):
     Returns:
         float: Distância total da rota ou np.inf se inválida.
     """
-    distancia = 0
-    for i in range(len(rota) - 1):
-        idx_from = rota[i]
-        idx_to = rota[i+1]
-        if 0 <= idx_from < matriz_distancias.shape[0] and 0 <= idx_to < matriz_distancias.shape[1]:
-            distancia += matriz_distancias[idx_from, idx_to]
-        else:
-            logging.warning(f"Índices ({idx_from}, {idx_to}) fora dos limites da matriz {matriz_distancias.shape} na rota {rota}.")
-            return np.inf
-    return distancia
+    matriz_distancias = np.asarray(matriz_distancias)
+    nos = np.asarray(rota, dtype=np.int64)
+    if len(nos) < 2:
+        return 0
+    if nos.min() < 0 or nos.max() >= min(matriz_distancias.shape):
+        logging.warning(f"Índices fora dos limites da matriz {matriz_distancias.shape} na rota {rota}.")
+        return np.inf
+    return matriz_distancias[nos[:-1], nos[1:]].sum()
 
-def heuristica_2opt(rota, matriz_distancias):
+def heuristica_2opt(rota, matriz_distancias, k_vizinhos=10):
     """
     Melhora a rota usando a heurística 2-opt.
     Assume que a rota começa e termina no depósito (índice 0).
+    Usa routing.busca_local.dois_opt (delta em O(1), k vizinhos mais próximos e don't-look bits).
     """
+    from routing.busca_local import dois_opt
     if len(rota) <= 3:
         return rota
-    melhor_rota = rota[:]
-    melhor_distancia = calcular_distancia_rota(melhor_rota, matriz_distancias)
-    if melhor_distancia == np.inf:
+    if calcular_distancia_rota(rota, matriz_distancias) == np.inf:
         logging.warning("Rota inicial inválida para 2-opt.")
         return rota
-    melhorou = True
-    while melhorou:
-        melhorou = False
-        for i in range(1, len(melhor_rota) - 2):
-            for j in range(i + 1, len(melhor_rota) - 1):
-                nova_rota = melhor_rota[:i] + melhor_rota[i:j+1][::-1] + melhor_rota[j+1:]
-                nova_distancia = calcular_distancia_rota(nova_rota, matriz_distancias)
-                if nova_distancia < melhor_distancia:
-                    melhor_rota = nova_rota
-                    melhor_distancia = nova_distancia
-                    melhorou = True
-                    break
-            if melhorou:
-                break
+    melhor_rota, _ = dois_opt(rota, matriz_distancias, k_vizinhos=k_vizinhos)
     return melhor_rota
 
-def heuristica_3opt(rota, matriz_distancias):
+def heuristica_3opt(rota, matriz_distancias, modo='first', tempo_limite_s=None):
     """
-    Melhora a rota usando a heurística 3-opt (placeholder: usa 2-opt).
+    Melhora a rota com 2-opt, Or-opt (trechos de 1 a 3 paradas) e 3-opt em descida de vizinhança variável.
+    Ver routing.busca_local.otimizar_rota.
+    modo: 'first' (primeira melhoria) ou 'best' (melhor melhoria); tempo_limite_s: orçamento de tempo opcional.
     """
-    logging.info("heuristica_3opt está usando 2-opt como fallback.")
-    return heuristica_2opt(rota, matriz_distancias)
+    from routing.busca_local import otimizar_rota
+    if len(rota) <= 3:
+        return rota
+    if calcular_distancia_rota(rota, matriz_distancias) == np.inf:
+        logging.warning("Rota inicial inválida para 3-opt.")
+        return rota
+    melhor_rota, _ = otimizar_rota(rota, matriz_distancias, modo=modo, tempo_limite_s=tempo_limite_s)
+    return melhor_rota
 
 def swap(rota, i, j):
     """
@@ -351,12 +401,79 @@ def swap(rota, i, j):
     logging.warning(f"Índices de swap inválidos ({i}, {j}) para rota de tamanho {len(rota)}.")
     return rota
 
-def split(rota, max_paradas_por_subrota):
+def split_otimo(rota, matriz_distancias, demandas=None, capacidade_maxima=None, max_paradas_por_subrota=None):
+    """
+    Split de Prins: particiona o tour gigante (rota começando e terminando no depósito 0) em viagens de custo
+    total mínimo, respeitando capacidade e número máximo de paradas, mantendo a ordem do tour.
+    Programação dinâmica de caminho mínimo sobre o tour com somas prefixadas de carga e distância; para cada
+    início i as viagens i+1..j (j dentro da janela viável) são relaxadas de uma vez com NumPy (O(n·L)).
+    Um pedido sozinho é sempre aceito, mesmo acima da capacidade.
+    Returns:
+        list: Lista de sub-rotas [0, ..., 0].
+    """
+    matriz_distancias = np.asarray(matriz_distancias, dtype=float)
+    tour = np.asarray(rota[1:-1], dtype=np.int64)
+    n = len(tour)
+    if n == 0:
+        return []
+    cargas = np.zeros(n) if demandas is None else np.asarray(demandas, dtype=float)[tour]
+    Q = np.r_[0.0, np.cumsum(cargas)]
+    # P[k]: distância percorrida do 1º ao (k+1)-ésimo pedido do tour (P[0] = 0)
+    P = np.r_[0.0, np.cumsum(matriz_distancias[tour[:-1], tour[1:]])]
+    ida = matriz_distancias[0, tour]
+    volta = matriz_distancias[tour, 0]
+    V = np.full(n + 1, np.inf)
+    V[0] = 0
+    anterior = np.zeros(n + 1, dtype=np.int64)
+    for i in range(n):
+        fim = n
+        if capacidade_maxima is not None:
+            fim = min(fim, max(i + 1, int(np.searchsorted(Q, Q[i] + capacidade_maxima + 1e-9, side='right')) - 1))
+        if max_paradas_por_subrota:
+            fim = min(fim, i + max_paradas_por_subrota)
+        j = np.arange(i + 1, fim + 1)
+        custo = V[i] + ida[i] + (P[j - 1] - P[i]) + volta[j - 1]
+        melhora = custo < V[j]
+        V[j[melhora]] = custo[melhora]
+        anterior[j[melhora]] = i
+    sub_rotas = []
+    j = n
+    while j > 0:
+        i = anterior[j]
+        sub_rotas.append([0] + tour[i:j].tolist() + [0])
+        j = i
+    return sub_rotas[::-1]
+
+def construir_rotas_por_split(matriz_distancias, demandas=None, capacidade_maxima=None, max_paradas_por_subrota=None, nos=None):
+    """
+    Construtor rota-primeiro/agrupa-depois: monta um tour gigante por vizinho mais próximo a partir do depósito,
+    melhora com 2-opt (routing.busca_local.dois_opt) e divide com split_otimo.
+    nos: índices da matriz a atender (default: todos exceto o depósito 0).
+    """
+    from routing.busca_local import dois_opt
+    matriz_distancias = np.asarray(matriz_distancias, dtype=float)
+    pendentes = np.arange(1, matriz_distancias.shape[0]) if nos is None else np.asarray(nos, dtype=np.int64)
+    tour = [0]
+    pendentes = pendentes.copy()
+    while len(pendentes):
+        k = int(np.argmin(matriz_distancias[tour[-1], pendentes]))
+        tour.append(int(pendentes[k]))
+        pendentes = np.delete(pendentes, k)
+    tour.append(0)
+    tour, _ = dois_opt(tour, matriz_distancias)
+    return split_otimo(tour, matriz_distancias, demandas, capacidade_maxima, max_paradas_por_subrota)
+
+def split(rota, max_paradas_por_subrota=None, matriz_distancias=None, demandas=None, capacidade_maxima=None):
     """
     Divide a rota em sub-rotas baseadas em um número máximo de paradas.
+    Com matriz_distancias, usa o split ótimo (split_otimo), que escolhe os cortes de menor distância total
+    respeitando max_paradas_por_subrota e capacidade_maxima (com demandas por nó).
     Args:
         rota (list): Rota original.
         max_paradas_por_subrota (int): Máximo de paradas por sub-rota.
+        matriz_distancias (np.ndarray, opcional): Matriz de distâncias.
+        demandas (list, opcional): Demanda por nó (índice da matriz).
+        capacidade_maxima (float, opcional): Capacidade máxima de cada sub-rota.
     Returns:
         list: Lista de sub-rotas.
     """
@@ -368,7 +485,9 @@ def split(rota, max_paradas_por_subrota):
         return [rota]
     if len(rota) <= 2:
         return [rota] if len(rota) > 0 else []
-    if max_paradas_por_subrota <= 0:
+    if matriz_distancias is not None:
+        return split_otimo(rota, matriz_distancias, demandas, capacidade_maxima, max_paradas_por_subrota)
+    if max_paradas_por_subrota is None or max_paradas_por_subrota <= 0:
         logging.warning("max_paradas_por_subrota deve ser positivo.")
         return [rota]
     sub_rotas = []
@@ -403,65 +522,61 @@ def merge(rotas, matriz_distancias, capacidade_maxima=None, demandas=None):
     rotas_otimizadas = [r[:] for r in rotas if isinstance(r, list) and len(r) >= 2 and r[0] == 0 and r[-1] == 0]
     if len(rotas_otimizadas) <= 1:
         return rotas_otimizadas
-    melhorou = True
-    while melhorou:
-        melhorou = False
-        melhor_combinacao = None
-        maior_economia = 0
-        for i in range(len(rotas_otimizadas)):
-            for j in range(i + 1, len(rotas_otimizadas)):
-                rota_a = rotas_otimizadas[i]
-                rota_b = rotas_otimizadas[j]
-                nova_rota_ab = rota_a[:-1] + rota_b[1:]
-                demanda_total_ab = 0
-                valida_ab = True
-                if demandas is not None:
-                    try:
-                        demanda_total_ab = sum(demandas[node] for node in nova_rota_ab if node != 0)
-                    except (IndexError, TypeError):
-                        valida_ab = False
-                if valida_ab and (capacidade_maxima is None or demanda_total_ab <= capacidade_maxima):
-                    dist_orig_a = calcular_distancia_rota(rota_a, matriz_distancias)
-                    dist_orig_b = calcular_distancia_rota(rota_b, matriz_distancias)
-                    if dist_orig_a != np.inf and dist_orig_b != np.inf:
-                        nova_dist_ab = calcular_distancia_rota(nova_rota_ab, matriz_distancias)
-                        if nova_dist_ab != np.inf:
-                            economia_ab = (dist_orig_a + dist_orig_b) - nova_dist_ab
-                            if economia_ab > maior_economia:
-                                maior_economia = economia_ab
-                                melhor_combinacao = (i, j, nova_rota_ab, economia_ab)
-                nova_rota_ba = rota_b[:-1] + rota_a[1:]
-                demanda_total_ba = 0
-                valida_ba = True
-                if demandas is not None:
-                    try:
-                        demanda_total_ba = sum(demandas[node] for node in nova_rota_ba if node != 0)
-                    except (IndexError, TypeError):
-                        valida_ba = False
-                if valida_ba and (capacidade_maxima is None or demanda_total_ba <= capacidade_maxima):
-                    dist_orig_a = calcular_distancia_rota(rota_a, matriz_distancias)
-                    dist_orig_b = calcular_distancia_rota(rota_b, matriz_distancias)
-                    if dist_orig_a != np.inf and dist_orig_b != np.inf:
-                        nova_dist_ba = calcular_distancia_rota(nova_rota_ba, matriz_distancias)
-                        if nova_dist_ba != np.inf:
-                            economia_ba = (dist_orig_a + dist_orig_b) - nova_dist_ba
-                            if economia_ba > maior_economia:
-                                maior_economia = economia_ba
-                                melhor_combinacao = (i, j, nova_rota_ba, economia_ba)
-        if melhor_combinacao is not None:
-            idx_a, idx_b, rota_combinada, economia = melhor_combinacao
-            indices_para_remover = sorted([idx_a, idx_b], reverse=True)
+    import heapq
+    matriz_distancias = np.asarray(matriz_distancias)
+    # Savings de Clarke-Wright: unir A e B (A seguida de B) economiza d(fim_A, 0) + d(0, inicio_B) - d(fim_A, inicio_B).
+    # Cada par é avaliado uma vez; entradas que envolvem rotas já unidas são descartadas ao sair do heap.
+    n = len(rotas_otimizadas)
+    primeiro = np.array([r[1] if len(r) > 2 else 0 for r in rotas_otimizadas])
+    ultimo = np.array([r[-2] if len(r) > 2 else 0 for r in rotas_otimizadas])
+    cargas = np.zeros(n)
+    pode_unir = np.array([calcular_distancia_rota(r, matriz_distancias) != np.inf for r in rotas_otimizadas])
+    if demandas is not None:
+        for k, r in enumerate(rotas_otimizadas):
             try:
-                rotas_otimizadas.pop(indices_para_remover[0])
-                rotas_otimizadas.pop(indices_para_remover[1])
-                rotas_otimizadas.append(rota_combinada)
-                melhorou = True
-            except IndexError:
-                logging.error("Erro ao remover rotas durante o merge. Parando.")
-                melhorou = False
-        else:
-            melhorou = False
-    return rotas_otimizadas
+                cargas[k] = sum(demandas[node] for node in r if node != 0)
+            except (IndexError, TypeError):
+                pode_unir[k] = False
+    rotas_vivas = dict(enumerate(rotas_otimizadas))
+    ordem = list(range(n))  # chave de ordenação da saída: rotas unidas vão para o fim, como na versão sequencial
+
+    def savings(a, b):
+        return matriz_distancias[ultimo[a], 0] + matriz_distancias[0, primeiro[b]] - matriz_distancias[ultimo[a], primeiro[b]]
+
+    def viaveis(a, b):
+        ok = pode_unir[a] & pode_unir[b]
+        if capacidade_maxima is not None:
+            ok &= cargas[a] + cargas[b] <= capacidade_maxima
+        return ok
+
+    idx = np.arange(n)
+    A, B = np.meshgrid(idx, idx, indexing='ij')
+    A, B = A[A != B], B[A != B]
+    s = savings(A, B)
+    ok = viaveis(A, B) & (s > 0)
+    heap = list(zip(-s[ok], A[ok].tolist(), B[ok].tolist()))
+    heapq.heapify(heap)
+    while heap:
+        economia, a, b = heapq.heappop(heap)
+        if a not in rotas_vivas or b not in rotas_vivas:
+            continue
+        nova = rotas_vivas.pop(a)[:-1] + rotas_vivas.pop(b)[1:]
+        k = len(primeiro)
+        primeiro = np.append(primeiro, primeiro[a])
+        ultimo = np.append(ultimo, ultimo[b])
+        cargas = np.append(cargas, cargas[a] + cargas[b])
+        pode_unir = np.append(pode_unir, True)
+        ordem.append(k)
+        vivas = np.fromiter(rotas_vivas.keys(), dtype=np.int64, count=len(rotas_vivas))
+        rotas_vivas[k] = nova
+        if len(vivas) == 0:
+            break
+        for origem, destino in ((np.full(len(vivas), k), vivas), (vivas, np.full(len(vivas), k))):
+            s = savings(origem, destino)
+            ok = viaveis(origem, destino) & (s > 0)
+            for item in zip(-s[ok], origem[ok].tolist(), destino[ok].tolist()):
+                heapq.heappush(heap, item)
+    return [rotas_vivas[k] for k in ordem if k in rotas_vivas]
 
 def exportar_rotas_para_csv(rotas, filepath):
     """
@@ -498,85 +613,165 @@ def exportar_rotas_para_geojson(rotas, coordenadas, filepath):
         json.dump(geojson, f, ensure_ascii=False, indent=2)
     logging.info(f"Rotas exportadas para {filepath} (GeoJSON)")
 
+def _balancear_plano(plano, veiculos_ativos, max_iter=None, criterio_balanceamento='peso', regiao_do_no=None,
+                     peso_carga=0.5, tolerancia=None):
+    """
+    Balanceamento sobre um PlanoRotas (modificado no lugar), com heaps de mínimo e máximo da métrica de cada
+    rota: 'peso' (Demanda), 'paradas' (número de pedidos) ou 'combinado' (peso_carga * carga/carga média +
+    (1 - peso_carga) * paradas/média de paradas).
+    A cada passo o pedido sai da rota mais carregada para a menos carregada que o aceite: só são aceitos
+    movimentos que respeitam a capacidade e reduzem a diferença entre as duas rotas; com matriz, escolhe o
+    pedido de menor custo incremental (inserção na melhor posição - economia de remoção). Com regiao_do_no,
+    prefere pedidos de regiões que a rota de destino já atende (senão, da região predominante da origem).
+    Uma rota que não consegue ceder pedidos sai do heap de máximo, de modo que o processo converge em uma
+    única passada. max_iter limita o número de movimentos (None: sem limite).
+    """
+    import heapq
+    import numpy as np
+    import pandas as pd
+    # Garante que todos os veículos ativos recebam pelo menos um pedido
+    for v in veiculos_ativos:
+        r_v = plano.indice_veiculo.get(v)
+        if r_v is None or len(plano.rotas[r_v]):
+            continue
+        nao_vazias = np.array([r for r, rota in enumerate(plano.rotas) if len(rota)], dtype=int)
+        if len(nao_vazias) == 0:
+            break
+        rota = plano.rotas[nao_vazias[np.argmax(plano.cargas[nao_vazias])]]
+        # Pedido de maior demanda (empate: o que aparece primeiro no rotas_df)
+        u = rota[np.lexsort((plano.linha_do_no[rota], -plano.demandas[rota]))[0]]
+        plano.mover(u, r_v)
+    # --- Balanceamento ---
+    ativos = {plano.indice_veiculo[v] for v in veiculos_ativos if v in plano.indice_veiculo}
+    participantes = [r for r, rota in enumerate(plano.rotas) if len(rota) or r in ativos]
+    if len(participantes) < 2:
+        return plano
+    # Contribuição de cada pedido para a métrica da rota (a métrica da rota é a soma)
+    if criterio_balanceamento == 'paradas':
+        peso_no = np.ones(len(plano.demandas))
+    elif criterio_balanceamento == 'combinado':
+        carga_media = max(plano.cargas[participantes].mean(), 1e-9)
+        paradas_media = max(np.mean([len(plano.rotas[r]) for r in participantes]), 1e-9)
+        peso_no = peso_carga * plano.demandas / carga_media + (1 - peso_carga) / paradas_media
+    else:  # padrão: peso
+        peso_no = plano.demandas.copy()
+    if tolerancia is None:
+        tolerancia = 0.02 if criterio_balanceamento == 'combinado' else 1
+    metrica = np.zeros(len(plano.rotas))
+    versao = np.zeros(len(plano.rotas), dtype=np.int64)
+    heap_min, heap_max = [], []
+
+    def registrar(r):
+        metrica[r] = peso_no[plano.rotas[r]].sum()
+        versao[r] += 1
+        heapq.heappush(heap_min, (metrica[r], int(versao[r]), r))
+        heapq.heappush(heap_max, (-metrica[r], int(versao[r]), r))
+
+    def melhor_movimento(r_max, r_min, diferenca):
+        rota = plano.rotas[r_max]
+        w = peso_no[rota]
+        ok = (w > 0) & (w < diferenca - 1e-9)
+        ok &= plano.cargas[r_min] + plano.demandas[rota] <= plano.capacidades[r_min] + 1e-9
+        if regiao_do_no is not None and ok.any():
+            regioes = regiao_do_no[rota]
+            atendidas = set(regiao_do_no[plano.rotas[r_min]])
+            preferidos = ok & np.array([reg in atendidas for reg in regioes], dtype=bool)
+            if not preferidos.any():
+                moda = pd.Series(regioes).mode()
+                preferidos = ok & (regioes == moda.iloc[0]) if not moda.empty else preferidos
+            if preferidos.any():
+                ok = preferidos
+        if not ok.any():
+            return None, None
+        candidatos = np.flatnonzero(ok)
+        if plano.matriz is None:
+            # Sem matriz: o pedido que aparece primeiro no rotas_df, inserido no fim da rota
+            i = candidatos[np.argmin(plano.linha_do_no[rota[candidatos]])]
+            return rota[i], len(plano.rotas[r_min])
+        custo, pos = plano.custos_insercao(r_min, rota[candidatos])
+        delta = custo - plano.economias_remocao(r_max)[candidatos]
+        j = np.lexsort((plano.linha_do_no[rota[candidatos]], delta))[0]
+        return rota[candidatos[j]], pos[j]
+
+    for r in participantes:
+        registrar(r)
+    movimentos = 0
+    while heap_max and (max_iter is None or movimentos < max_iter):
+        neg, ver, r_max = heapq.heappop(heap_max)
+        if ver != versao[r_max]:
+            continue
+        # Percorre os destinos em ordem crescente de métrica até achar um movimento viável
+        retirados = []
+        movido = False
+        while heap_min:
+            item = heapq.heappop(heap_min)
+            m, ver_min, r_min = item
+            if ver_min != versao[r_min]:
+                continue
+            retirados.append(item)
+            if r_min == r_max:
+                continue
+            if -neg - m < tolerancia:
+                break
+            u, pos = melhor_movimento(r_max, r_min, -neg - m)
+            if u is not None:
+                rota_max = plano.rotas[r_max]
+                plano.atualizar_rota(r_max, np.delete(rota_max, plano.posicao_do_no[u]))
+                plano.atualizar_rota(r_min, np.insert(plano.rotas[r_min], pos, u))
+                movido = True
+                break
+        for item in retirados:
+            heapq.heappush(heap_min, item)
+        if movido:
+            registrar(r_max)
+            registrar(r_min)
+            movimentos += 1
+        # Sem movimento viável a rota deixa o heap de máximo (volta se receber/ceder pedidos depois)
+    return plano
+
+def _regiao_do_no(plano, rotas_df):
+    import numpy as np
+    from routing.plano_rotas import PlanoRotas
+    if 'Região' not in rotas_df.columns:
+        return None
+    regiao_do_no = np.empty(len(plano.rota_do_no), dtype=object)
+    regiao_do_no[PlanoRotas.nos_do_rotas_df(rotas_df)] = rotas_df['Região'].to_numpy(dtype=object)
+    return regiao_do_no
+
 def balancear_carga_e_usar_todos_veiculos(
-    rotas_df, frota, pedidos, max_iter=20, criterio_balanceamento='peso', priorizar_regiao=False
+    rotas_df, frota, pedidos, max_iter=None, criterio_balanceamento='peso', priorizar_regiao=False,
+    matriz_distancias=None, peso_carga=0.5
 ):
     """
     Balanceia a carga entre veículos e tenta garantir que todos os veículos ativos sejam usados.
-    Permite balancear por 'peso' (Demanda) ou 'paradas' (número de pedidos).
+    Permite balancear por 'peso' (Demanda), 'paradas' (número de pedidos) ou 'combinado' (peso_carga define
+    a importância relativa da carga). Respeita 'Capacidade (Kg)' da frota.
     Se priorizar_regiao=True, tenta manter pedidos da mesma região juntos.
+    Com matriz_distancias (e 'Node_Index_OR'), move o pedido de menor custo incremental para a melhor posição.
+    max_iter limita o número de movimentos (None: até convergir). Ver _balancear_plano.
     """
-    import numpy as np
+    from routing.plano_rotas import PlanoRotas
     if rotas_df is None or rotas_df.empty or 'Veículo' not in rotas_df.columns:
         return rotas_df
     veiculos_ativos = frota['ID Veículo'] if 'ID Veículo' in frota.columns else frota['Placa']
     veiculos_ativos = veiculos_ativos.dropna().unique().tolist()
-    # Garante que todos os veículos ativos recebam pelo menos um pedido
-    for v in veiculos_ativos:
-        if v not in rotas_df['Veículo'].unique():
-            cargas = rotas_df.groupby('Veículo')['Demanda'].sum()
-            v_max = cargas.idxmax()
-            pedidos_vmax = rotas_df[rotas_df['Veículo'] == v_max].sort_values('Demanda', ascending=False)
-            if not pedidos_vmax.empty:
-                pedido_para_mover = pedidos_vmax.iloc[0]
-                rotas_df.loc[rotas_df.index == pedido_para_mover.name, 'Veículo'] = v
-    # --- Balanceamento ---
-    for _ in range(max_iter):
-        if criterio_balanceamento == 'paradas':
-            cargas = rotas_df.groupby('Veículo').size()
-        else:  # padrão: peso
-            cargas = rotas_df.groupby('Veículo')['Demanda'].sum()
-        v_max = cargas.idxmax()
-        v_min = cargas.idxmin()
-        if cargas[v_max] - cargas[v_min] < 1:
-            break
-        # Se priorizar região, tenta mover pedido da região predominante do v_max
-        if priorizar_regiao and 'Região' in rotas_df.columns:
-            regiao_predominante = rotas_df[rotas_df['Veículo'] == v_max]['Região'].mode().iloc[0]
-            pedidos_vmax = rotas_df[(rotas_df['Veículo'] == v_max) & (rotas_df['Região'] == regiao_predominante)]
-            if pedidos_vmax.empty:
-                pedidos_vmax = rotas_df[rotas_df['Veículo'] == v_max]
-        else:
-            pedidos_vmax = rotas_df[rotas_df['Veículo'] == v_max]
-        pedido_para_mover = pedidos_vmax.iloc[0]
-        rotas_df.loc[rotas_df.index == pedido_para_mover.name, 'Veículo'] = v_min
-    return rotas_df
+    com_matriz = 'Node_Index_OR' in rotas_df.columns and matriz_distancias is not None
+    plano = PlanoRotas.de_rotas_df(rotas_df, matriz_distancias if com_matriz else None, frota)
+    regiao_do_no = _regiao_do_no(plano, rotas_df) if priorizar_regiao else None
+    _balancear_plano(plano, veiculos_ativos, max_iter, criterio_balanceamento, regiao_do_no, peso_carga)
+    return plano.para_rotas_df(rotas_df, ordenar=False)
 
-def mover_para_vizinho_proximo(rotas_df, matriz_distancias, depot_index=0, max_iter=10):
+def mover_para_vizinho_proximo(rotas_df, matriz_distancias, depot_index=0, max_iter=10, frota=None):
     """
     Heurística de vizinhança: move pedidos para veículos que já atendem clientes próximos (minimizando distância incremental).
+    Usa o operador relocate de routing.busca_inter_rotas (delta em O(1), vizinhança granular) e devolve as
+    rotas re-sequenciadas. max_iter é mantido por compatibilidade (a busca para quando uma passada não melhora).
+    Com frota, só move pedidos para veículos com capacidade ('Capacidade (Kg)') disponível.
     """
-    import numpy as np
+    from routing.busca_inter_rotas import melhorar_rotas_df
     if rotas_df is None or rotas_df.empty or 'Veículo' not in rotas_df.columns or 'Node_Index_OR' not in rotas_df.columns:
         return rotas_df
-    for _ in range(max_iter):
-        melhorou = False
-        for idx, pedido in rotas_df.iterrows():
-            veic_atual = pedido['Veículo']
-            node_idx = pedido['Node_Index_OR']
-            min_delta = None
-            melhor_veic = veic_atual
-            for veic in rotas_df['Veículo'].unique():
-                if veic == veic_atual:
-                    continue
-                # Calcula distância incremental para inserir o pedido na rota do outro veículo
-                rota_veic = rotas_df[rotas_df['Veículo'] == veic]['Node_Index_OR'].tolist()
-                if not rota_veic:
-                    continue
-                # Tenta inserir entre todos pares consecutivos
-                for i in range(len(rota_veic)):
-                    antes = rota_veic[i-1] if i > 0 else depot_index
-                    depois = rota_veic[i]
-                    delta = matriz_distancias[antes][node_idx] + matriz_distancias[node_idx][depois] - matriz_distancias[antes][depois]
-                    if min_delta is None or delta < min_delta:
-                        min_delta = delta
-                        melhor_veic = veic
-            if melhor_veic != veic_atual and min_delta is not None and min_delta < 0:
-                rotas_df.at[idx, 'Veículo'] = melhor_veic
-                melhorou = True
-        if not melhorou:
-            break
-    return rotas_df
+    return melhorar_rotas_df(rotas_df, matriz_distancias, frota=frota, depot_index=depot_index, operadores=('relocate',), reotimizar_intra=False)
 
 def reservar_veiculos_para_regioes(rotas_df, frota, pedidos, n_reservas=1):
     """
@@ -589,6 +784,7 @@ def reservar_veiculos_para_regioes(rotas_df, frota, pedidos, n_reservas=1):
     regioes_criticas = pedidos['Região'].value_counts().head(n_reservas).index.tolist()
     veiculos_ativos = frota['ID Veículo'] if 'ID Veículo' in frota.columns else frota['Placa']
     veiculos_ativos = veiculos_ativos.dropna().unique().tolist()
+    rotas_df = rotas_df.copy()
     for i, reg in enumerate(regioes_criticas):
         if i < len(veiculos_ativos):
             veic = veiculos_ativos[i]
@@ -598,67 +794,111 @@ def reservar_veiculos_para_regioes(rotas_df, frota, pedidos, n_reservas=1):
 
 def balanceamento_iterativo(rotas_df, frota, pedidos, matriz_distancias, max_iter=10):
     """
-    Executa balanceamento iterativo por peso, paradas, região e vizinhança até convergência.
+    Executa balanceamento iterativo (peso e paradas combinados, região) e vizinhança até convergência.
+    Todas as etapas trabalham sobre o mesmo PlanoRotas; o rotas_df só é reconstruído no final.
     """
+    from routing.plano_rotas import PlanoRotas
+    from routing.busca_inter_rotas import busca_inter_rotas
+    if rotas_df is None or rotas_df.empty or 'Veículo' not in rotas_df.columns:
+        return rotas_df
+    veiculos_ativos = frota['ID Veículo'] if 'ID Veículo' in frota.columns else frota['Placa']
+    veiculos_ativos = veiculos_ativos.dropna().unique().tolist()
+    # Sem 'Node_Index_OR' os nós não correspondem à matriz: balanceia sem a etapa de vizinhança
+    com_matriz = 'Node_Index_OR' in rotas_df.columns and matriz_distancias is not None
+    plano = PlanoRotas.de_rotas_df(rotas_df, matriz_distancias if com_matriz else None, frota)
+    regiao_do_no = _regiao_do_no(plano, rotas_df)
     for _ in range(max_iter):
-        antes = rotas_df['Veículo'].copy()
-        rotas_df = balancear_carga_e_usar_todos_veiculos(rotas_df, frota, pedidos, criterio_balanceamento='peso')
-        rotas_df = balancear_carga_e_usar_todos_veiculos(rotas_df, frota, pedidos, criterio_balanceamento='paradas')
-        rotas_df = balancear_carga_e_usar_todos_veiculos(rotas_df, frota, pedidos, priorizar_regiao=True)
-        rotas_df = mover_para_vizinho_proximo(rotas_df, matriz_distancias)
-        if rotas_df['Veículo'].equals(antes):
+        antes = plano.rota_do_no.copy()
+        _balancear_plano(plano, veiculos_ativos, criterio_balanceamento='combinado', regiao_do_no=regiao_do_no)
+        if com_matriz:
+            busca_inter_rotas(plano, operadores=('relocate',))
+        if np.array_equal(plano.rota_do_no, antes):
             break
-    return rotas_df
+    return plano.para_rotas_df(rotas_df)
 
-def checar_e_corrigir_excesso_carga(rotas_df, frota, limite_pct=120):
+def checar_e_corrigir_excesso_carga(rotas_df, frota, limite_pct=120, matriz_distancias=None, plano=None):
     """
     Garante que nenhum veículo ultrapasse o limite de capacidade (ex: 120%).
     Remove pedidos excedentes e tenta realocar para veículos com espaço.
+    A realocação é first-fit decreasing (maiores pedidos primeiro): com matriz_distancias (e 'Node_Index_OR')
+    cada pedido vai para o veículo com espaço de menor custo de inserção, na melhor posição da rota; sem matriz,
+    para o veículo com espaço em que sobra a menor folga (best-fit).
     Retorna rotas_df corrigido e lista de veículos com excesso não resolvido.
+    plano: PlanoRotas já montado para este rotas_df com a mesma frota, limite_pct e matriz (ex.: o do
+    pipeline); é copiado, não alterado.
     """
+    from routing.plano_rotas import PlanoRotas
     if rotas_df is None or rotas_df.empty or 'Veículo' not in rotas_df.columns or 'Demanda' not in rotas_df.columns:
         return rotas_df, []
-    # Mapeia capacidade dos veículos
+    # Capacidades (já com limite_pct) e cargas ficam nos arrays do plano
     id_col = 'ID Veículo' if 'ID Veículo' in frota.columns else 'Placa'
-    capacidades = frota.set_index(id_col)['Capacidade (Kg)'].to_dict()
-    limite_cap = {k: v * limite_pct / 100.0 for k, v in capacidades.items()}
-    excesso = []
-    for veic, grupo in rotas_df.groupby('Veículo'):
-        cap = limite_cap.get(veic, None)
-        if cap is None:
-            continue
-        demanda_total = grupo['Demanda'].sum()
-        if demanda_total > cap:
-            excesso.append((veic, demanda_total, cap))
-            # Remove pedidos até ficar dentro do limite
-            grupo_sorted = grupo.sort_values('Demanda', ascending=False)
-            demanda_acum = 0
-            indices_para_remover = []
-            for idx, row in grupo_sorted.iterrows():
-                if demanda_acum + row['Demanda'] > cap:
-                    indices_para_remover.append(idx)
-                else:
-                    demanda_acum += row['Demanda']
-            # Remove do DataFrame
-            rotas_df.loc[indices_para_remover, 'Veículo'] = None # Marca para realocação
-    # Tenta realocar pedidos sem veículo
-    pedidos_sem_veic = rotas_df[rotas_df['Veículo'].isnull()]
-    for idx, row in pedidos_sem_veic.iterrows():
-        for veic, cap in limite_cap.items():
-            demanda_atual = rotas_df[rotas_df['Veículo'] == veic]['Demanda'].sum()
-            if demanda_atual + row['Demanda'] <= cap:
-                rotas_df.at[idx, 'Veículo'] = veic
-                break
+    com_matriz = 'Node_Index_OR' in rotas_df.columns and matriz_distancias is not None
+    if plano is not None:
+        plano = plano.copiar()
+    else:
+        plano = PlanoRotas.de_rotas_df(rotas_df, matriz_distancias if com_matriz else None, frota, limite_pct=limite_pct)
+    for r in np.flatnonzero(plano.cargas > plano.capacidades):
+        rota = plano.rotas[r]
+        # Remove pedidos (maiores primeiro) até ficar dentro do limite
+        demanda_acum = 0
+        nos_para_remover = []
+        for u in rota[np.lexsort((plano.linha_do_no[rota], -plano.demandas[rota]))]:
+            if demanda_acum + plano.demandas[u] > plano.capacidades[r]:
+                nos_para_remover.append(u)
+            else:
+                demanda_acum += plano.demandas[u]
+        plano.atualizar_rota(r, rota[~np.isin(rota, nos_para_remover)])
+        plano.rota_do_no[nos_para_remover] = -1  # Marca para realocação
+        plano.posicao_do_no[nos_para_remover] = -1
+    # Realoca os pedidos sem veículo (maiores primeiro) nos veículos da frota com espaço
+    rotas_frota = np.array([
+        plano.indice_veiculo[v] for v in frota[id_col].dropna().unique()
+        if np.isfinite(plano.capacidades[plano.indice_veiculo[v]])
+    ], dtype=int)
+    nos = PlanoRotas.nos_do_rotas_df(rotas_df)
+    pendentes = nos[plano.rota_do_no[nos] < 0]
+    pendentes = pendentes[np.lexsort((plano.linha_do_no[pendentes], -plano.demandas[pendentes]))]
+    if len(pendentes) and len(rotas_frota):
+        if com_matriz:
+            # Custo de inserção de cada pendente em cada veículo; só a coluna do veículo alterado é recalculada
+            custo = np.empty((len(pendentes), len(rotas_frota)))
+            posicao = np.zeros((len(pendentes), len(rotas_frota)), dtype=np.int64)
+            for j, r in enumerate(rotas_frota):
+                custo[:, j], posicao[:, j] = plano.custos_insercao(r, pendentes)
+        for i, u in enumerate(pendentes):
+            folga = plano.capacidades[rotas_frota] - plano.cargas[rotas_frota]
+            cabe = plano.demandas[u] <= folga + 1e-9
+            if not cabe.any():
+                continue
+            if com_matriz:
+                j = int(np.argmin(np.where(cabe, custo[i], np.inf)))
+                r, p = rotas_frota[j], posicao[i, j]
+                rota = plano.rotas[r]
+                a = rota[p - 1] if p > 0 else plano.depot_index
+                b = rota[p] if p < len(rota) else plano.depot_index
+                plano.atualizar_rota(r, np.insert(rota, p, u))
+                if i + 1 < len(pendentes):
+                    # O arco (a, b) virou (a, u) + (u, b): só quem tinha a melhor posição em (a, b) é recalculado
+                    m, xs = plano.matriz, pendentes[i + 1:]
+                    custo_j, pos_j = custo[i + 1:, j], posicao[i + 1:, j]
+                    afetados = pos_j == p
+                    pos_j[pos_j > p] += 1
+                    antes_de_u = m[a, xs] + m[xs, u] - m[a, u]
+                    depois_de_u = m[u, xs] + m[xs, b] - m[u, b]
+                    for candidato, pos_candidato in ((antes_de_u, p), (depois_de_u, p + 1)):
+                        melhor = ~afetados & (candidato < custo_j)
+                        custo_j[melhor] = candidato[melhor]
+                        pos_j[melhor] = pos_candidato
+                    if afetados.any():
+                        custo_j[afetados], pos_j[afetados] = plano.custos_insercao(r, xs[afetados])
+            else:
+                plano.mover(u, rotas_frota[int(np.argmin(np.where(cabe, folga, np.inf)))])
     # Recalcula excesso
-    excesso_final = []
-    for veic, grupo in rotas_df.groupby('Veículo'):
-        cap = limite_cap.get(veic, None)
-        if cap is None:
-            continue
-        demanda_total = grupo['Demanda'].sum()
-        if demanda_total > cap:
-            excesso_final.append((veic, demanda_total, cap))
-    return rotas_df, excesso_final
+    excesso_final = [
+        (plano.veiculos[r], plano.cargas[r], plano.capacidades[r])
+        for r in np.flatnonzero(plano.cargas > plano.capacidades)
+    ]
+    return plano.para_rotas_df(rotas_df, ordenar=False), excesso_final
 
 # Placeholder para balanceamento visual/interativo
 # (Sugestão: usar Streamlit AgGrid, Dash, ou JS para drag-and-drop)
@@ -675,7 +915,7 @@ def sugerir_agrupamento_ml(pedidos, historico=None):
     """
     # Exemplo: usar clustering, classificação, ou regras aprendidas do histórico
     # Integrar com routing/aprendizado.py futuramente
-    pedidos['Cluster_ML'] = 0 # TODO: implementar
+    pedidos = pedidos.assign(Cluster_ML=0) # TODO: implementar
     return pedidos
 
 # --- IDEIAS EXTRAS PARA BALANCEAMENTO E AGRUPAMENTO INTELIGENTE ---
@@ -716,7 +956,7 @@ def exemplo_uso():
         demanda_rm = sum(demandas_exemplo[node] for node in rm if node != 0 and node < len(demandas_exemplo))
         logging.info(f"Rota Merge: {rm}, Distância: {calcular_distancia_rota(rm, dist_matrix)}, Demanda: {demanda_rm}")
     rota_otimizada_3opt = heuristica_3opt(rota_inicial, dist_matrix)
-    logging.info(f"Rota Otimizada (3-opt via 2-opt): {rota_otimizada_3opt}, Distância: {calcular_distancia_rota(rota_otimizada_3opt, dist_matrix)}")
+    logging.info(f"Rota Otimizada (3-opt): {rota_otimizada_3opt}, Distância: {calcular_distancia_rota(rota_otimizada_3opt, dist_matrix)}")
 
 if __name__ == '__main__':
     exemplo_uso()
\ No newline at end of file
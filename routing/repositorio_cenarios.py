@@ -0,0 +1,345 @@
+"""
+Repositório persistente de cenários de roteirização (rotas, métricas, parâmetros e impressão digital da matriz).
+
+Os cenários ficam em SQLite particionado por data: um arquivo database/cenarios/AAAA-MM-DD.db por dia. O id do
+cenário começa pela data (AAAAMMDD-HHMMSS-xxxxxxxx), então carregar um cenário abre só a partição dele e as
+consultas por período só abrem os arquivos do intervalo. Cada partição tem:
+- cenarios: uma linha por cenário (data, tipo, status, impressão digital da matriz, parâmetros em JSON);
+- metricas: KPIs numéricos em formato longo (cenario_id, kpi, valor), lidos de todas as partições de uma vez e
+  pivotados para comparar centenas de execuções lado a lado;
+- colunas: as tabelas do cenário (rotas, pedidos não alocados, ...) guardadas coluna a coluna e comprimidas
+  (colunas numéricas/datas como bytes do array, as demais como JSON), com os níveis do índice nas posições
+  negativas e os rótulos em JSON, para preservar o tipo original;
+- tabelas: metadados de cada tabela (número de linhas, nome do eixo das colunas, índice RangeIndex ou nomes
+  dos níveis), para que carregar_cenario devolva o mesmo DataFrame que foi gravado.
+Nada é desserializado com pickle: abrir um arquivo de cenário não executa código.
+"""
+import os
+import json
+import uuid
+import zlib
+import sqlite3
+import logging
+
+import numpy as np
+import pandas as pd
+
+from routing.cache_resultados import impressao_digital_matriz
+
+REPOSITORIO_PATH = os.path.join(os.path.dirname(__file__), '..', 'database', 'cenarios')
+
+
+def _conexao(caminho):
+    conn = sqlite3.connect(caminho)
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS cenarios (
+            id TEXT PRIMARY KEY,
+            data TEXT,
+            tipo TEXT,
+            status TEXT,
+            impressao_matriz TEXT,
+            parametros TEXT
+        );
+        CREATE TABLE IF NOT EXISTS metricas (
+            cenario_id TEXT,
+            kpi TEXT,
+            valor REAL,
+            PRIMARY KEY (cenario_id, kpi)
+        );
+        CREATE TABLE IF NOT EXISTS colunas (
+            cenario_id TEXT,
+            tabela TEXT,
+            ordem INTEGER,
+            coluna TEXT,
+            tipo TEXT,
+            dados BLOB,
+            PRIMARY KEY (cenario_id, tabela, ordem)
+        );
+        CREATE TABLE IF NOT EXISTS tabelas (
+            cenario_id TEXT,
+            tabela TEXT,
+            n_linhas INTEGER,
+            metadados TEXT,
+            PRIMARY KEY (cenario_id, tabela)
+        );
+    ''')
+    return conn
+
+
+def _particao(data, diretorio=None):
+    return os.path.join(diretorio or REPOSITORIO_PATH, f"{pd.Timestamp(data):%Y-%m-%d}.db")
+
+
+def _particao_do_id(cenario_id, diretorio=None):
+    return _particao(pd.Timestamp(cenario_id[:8]), diretorio)
+
+
+def _particoes(inicio=None, fim=None, diretorio=None):
+    """Arquivos de partição existentes no intervalo [inicio, fim] (datas inclusivas), em ordem cronológica."""
+    diretorio = diretorio or REPOSITORIO_PATH
+    if not os.path.isdir(diretorio):
+        return []
+    inicio = pd.Timestamp(inicio).normalize() if inicio is not None else None
+    fim = pd.Timestamp(fim).normalize() if fim is not None else None
+    arquivos = []
+    for nome in sorted(os.listdir(diretorio)):
+        if not nome.endswith('.db'):
+            continue
+        try:
+            data = pd.Timestamp(nome[:-3])
+        except ValueError:
+            continue
+        if (inicio is None or data >= inicio) and (fim is None or data <= fim):
+            arquivos.append(os.path.join(diretorio, nome))
+    return arquivos
+
+
+def _para_json(valor):
+    """Converte um valor de célula ou rótulo em algo serializável em JSON, marcando tuplas e datas."""
+    if valor is None or valor is pd.NA or valor is pd.NaT:
+        return None
+    if isinstance(valor, np.generic):
+        valor = valor.item()
+    if isinstance(valor, (bool, int, float, str)):
+        return valor
+    if isinstance(valor, pd.Timestamp):
+        return {'$timestamp': valor.isoformat()}
+    if isinstance(valor, pd.Timedelta):
+        return {'$timedelta': int(valor.value)}
+    if isinstance(valor, tuple):
+        return {'$tupla': [_para_json(v) for v in valor]}
+    if isinstance(valor, (list, np.ndarray)):
+        return [_para_json(v) for v in valor]
+    if isinstance(valor, dict):
+        return {str(k): _para_json(v) for k, v in valor.items()}
+    return str(valor)
+
+
+def _de_json(objeto):
+    if len(objeto) == 1:
+        if '$timestamp' in objeto:
+            return pd.Timestamp(objeto['$timestamp'])
+        if '$timedelta' in objeto:
+            return pd.Timedelta(objeto['$timedelta'])
+        if '$tupla' in objeto:
+            return tuple(objeto['$tupla'])
+    return objeto
+
+
+def _codificar(valor):
+    return json.dumps(_para_json(valor))
+
+
+def _decodificar(texto):
+    return json.loads(texto, object_hook=_de_json)
+
+
+def _serializar_coluna(serie):
+    """(tipo, bytes comprimidos): 'dtype numpy' para números/datas, 'json:<dtype>' para o resto."""
+    if serie.dtype.kind in 'biufmM' and isinstance(serie.dtype, np.dtype):
+        valores = serie.to_numpy()
+        return valores.dtype.str, zlib.compress(np.ascontiguousarray(valores).tobytes())
+    valores = [_para_json(v) for v in serie.to_numpy(dtype=object)]
+    return f"json:{serie.dtype}", zlib.compress(json.dumps(valores).encode('utf-8'))
+
+
+def _desserializar_coluna(tipo, dados):
+    dados = zlib.decompress(dados)
+    if not tipo.startswith('json:'):
+        return pd.Series(np.frombuffer(dados, dtype=np.dtype(tipo)).copy())
+    serie = pd.Series(json.loads(dados.decode('utf-8'), object_hook=_de_json), dtype=object)
+    dtype = tipo[len('json:'):]
+    if dtype != 'object':
+        try:
+            serie = serie.astype(dtype)
+        except (TypeError, ValueError):
+            logging.warning(f"Repositório de cenários: não foi possível restaurar o tipo '{dtype}'; coluna mantida como object.")
+    return serie
+
+
+def _serializar_tabela(cenario_id, nome, tabela):
+    """Linhas de 'colunas' (colunas em ordem >= 0, níveis do índice em ordem < 0) e a linha de 'tabelas'."""
+    linhas = []
+    for ordem, (rotulo, serie) in enumerate(tabela.items()):
+        linhas.append((cenario_id, nome, ordem, _codificar(rotulo), *_serializar_coluna(serie)))
+    indice = tabela.index
+    metadados = {'nome_colunas': _para_json(tabela.columns.name), 'nomes_indice': _para_json(list(indice.names))}
+    if isinstance(tabela.columns, pd.RangeIndex):
+        metadados['range_colunas'] = [tabela.columns.start, tabela.columns.stop, tabela.columns.step]
+    if isinstance(indice, pd.RangeIndex):
+        metadados['range'] = [indice.start, indice.stop, indice.step]
+    else:
+        for nivel in range(indice.nlevels):
+            serie = pd.Series(indice.get_level_values(nivel))
+            linhas.append((cenario_id, nome, -1 - nivel, _codificar(indice.names[nivel]), *_serializar_coluna(serie)))
+    return linhas, (cenario_id, nome, len(tabela), json.dumps(metadados))
+
+
+def _montar_tabela(n_linhas, metadados, colunas):
+    """Reconstrói o DataFrame a partir das linhas de 'colunas' (ordem, rótulo, tipo, dados) de uma tabela."""
+    metadados = json.loads(metadados, object_hook=_de_json) if metadados else {}
+    niveis = sorted((c for c in colunas if c[0] < 0), key=lambda c: -c[0])
+    if 'range' in metadados:
+        indice = pd.RangeIndex(*metadados['range'])
+    elif niveis:
+        arrays = [_desserializar_coluna(tipo, dados) for _, _, tipo, dados in niveis]
+        indice = pd.MultiIndex.from_arrays(arrays) if len(arrays) > 1 else pd.Index(arrays[0])
+    else:
+        indice = pd.RangeIndex(n_linhas or 0)
+    if metadados.get('nomes_indice') is not None:
+        indice = indice.set_names(metadados['nomes_indice'] if indice.nlevels > 1 else metadados['nomes_indice'][0])
+    colunas = sorted(c for c in colunas if c[0] >= 0)
+    dados = {i: _desserializar_coluna(tipo, blob).set_axis(indice) for i, (_, _, tipo, blob) in enumerate(colunas)}
+    tabela = pd.DataFrame(dados, index=indice)
+    if 'range_colunas' in metadados:
+        tabela.columns = pd.RangeIndex(*metadados['range_colunas'], name=metadados.get('nome_colunas'))
+    else:
+        tabela.columns = pd.Index([_decodificar(rotulo) for _, rotulo, _, _ in colunas], name=metadados.get('nome_colunas'))
+    return tabela
+
+
+def salvar_cenario(rotas_df, metricas=None, parametros=None, matriz_distancias=None, tipo='', status='',
+                   tabelas_extras=None, data=None, diretorio=None):
+    """
+    Grava um cenário na partição da sua data e retorna o id.
+    - metricas: dict de KPIs; só valores numéricos são guardados (os demais são ignorados);
+    - parametros: dict serializável em JSON (valores não serializáveis viram texto);
+    - tabelas_extras: dict nome -> DataFrame guardado junto (ex.: pedidos não alocados).
+    """
+    data = pd.Timestamp.now() if data is None else pd.Timestamp(data)
+    cenario_id = f"{data:%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+    diretorio = diretorio or REPOSITORIO_PATH
+    os.makedirs(diretorio, exist_ok=True)
+    kpis = [
+        (cenario_id, str(k), float(v)) for k, v in (metricas or {}).items()
+        if isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, bool) and np.isfinite(v)
+    ]
+    linhas_colunas, linhas_tabelas = [], []
+    tabelas = {'rotas': rotas_df, **(tabelas_extras or {})}
+    for nome, tabela in tabelas.items():
+        if not isinstance(tabela, pd.DataFrame):
+            continue
+        linhas, linha_tabela = _serializar_tabela(cenario_id, nome, tabela)
+        linhas_colunas.extend(linhas)
+        linhas_tabelas.append(linha_tabela)
+    conn = _conexao(_particao(data, diretorio))
+    try:
+        with conn:
+            conn.execute(
+                'INSERT INTO cenarios (id, data, tipo, status, impressao_matriz, parametros) VALUES (?, ?, ?, ?, ?, ?)',
+                (cenario_id, data.isoformat(sep=' ', timespec='seconds'), str(tipo), str(status),
+                 impressao_digital_matriz(matriz_distancias) if matriz_distancias is not None else None,
+                 json.dumps(parametros or {}, default=str))
+            )
+            conn.executemany('INSERT INTO metricas (cenario_id, kpi, valor) VALUES (?, ?, ?)', kpis)
+            conn.executemany('INSERT INTO colunas (cenario_id, tabela, ordem, coluna, tipo, dados) VALUES (?, ?, ?, ?, ?, ?)', linhas_colunas)
+            conn.executemany('INSERT INTO tabelas (cenario_id, tabela, n_linhas, metadados) VALUES (?, ?, ?, ?)', linhas_tabelas)
+    finally:
+        conn.close()
+    logging.info(f"Repositório de cenários: cenário {cenario_id} gravado ({len(kpis)} KPIs, {len(linhas_colunas)} colunas).")
+    return cenario_id
+
+
+def carregar_cenario(cenario_id, diretorio=None):
+    """
+    Lê um cenário pelo id (abre só a partição da data dele). Retorna dict com 'id', 'data', 'tipo', 'status',
+    'impressao_matriz', 'parametros', 'metricas' e uma entrada por tabela ('rotas', extras), ou None.
+    """
+    caminho = _particao_do_id(cenario_id, diretorio)
+    if not os.path.exists(caminho):
+        return None
+    conn = _conexao(caminho)
+    try:
+        linha = conn.execute(
+            'SELECT id, data, tipo, status, impressao_matriz, parametros FROM cenarios WHERE id = ?', (cenario_id,)
+        ).fetchone()
+        if linha is None:
+            return None
+        metricas = dict(conn.execute('SELECT kpi, valor FROM metricas WHERE cenario_id = ?', (cenario_id,)).fetchall())
+        colunas = conn.execute(
+            'SELECT tabela, ordem, coluna, tipo, dados FROM colunas WHERE cenario_id = ?', (cenario_id,)
+        ).fetchall()
+        meta_tabelas = conn.execute(
+            'SELECT tabela, n_linhas, metadados FROM tabelas WHERE cenario_id = ?', (cenario_id,)
+        ).fetchall()
+    finally:
+        conn.close()
+    cenario = dict(zip(('id', 'data', 'tipo', 'status', 'impressao_matriz'), linha[:5]))
+    cenario['parametros'] = json.loads(linha[5] or '{}')
+    cenario['metricas'] = metricas
+    colunas_por_tabela = {}
+    for tabela, *coluna in colunas:
+        colunas_por_tabela.setdefault(tabela, []).append(tuple(coluna))
+    for tabela, n_linhas, metadados in meta_tabelas:
+        cenario[tabela] = _montar_tabela(n_linhas, metadados, colunas_por_tabela.get(tabela, []))
+    cenario.setdefault('rotas', pd.DataFrame())
+    return cenario
+
+
+def listar_cenarios(inicio=None, fim=None, diretorio=None):
+    """Cenários gravados no período (sem as tabelas), do mais recente para o mais antigo."""
+    partes = []
+    for caminho in _particoes(inicio, fim, diretorio):
+        conn = _conexao(caminho)
+        try:
+            partes.append(pd.read_sql_query('SELECT id, data, tipo, status, impressao_matriz FROM cenarios', conn))
+        finally:
+            conn.close()
+    if not partes:
+        return pd.DataFrame(columns=['id', 'data', 'tipo', 'status', 'impressao_matriz'])
+    return pd.concat(partes, ignore_index=True).sort_values('data', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def comparar_cenarios(ids=None, inicio=None, fim=None, kpis=None, referencia=None, diretorio=None):
+    """
+    KPIs dos cenários lado a lado: uma linha por cenário (índice = id) e uma coluna por KPI, lidos em formato
+    longo de todas as partições do período e pivotados de uma vez. ids restringe os cenários (e as partições
+    lidas); kpis restringe as colunas. Com referencia (id), acrescenta 'Δ% <kpi>' = variação percentual de cada
+    cenário em relação a ela.
+    """
+    if ids is not None:
+        ids = list(ids)
+        datas = sorted({pd.Timestamp(i[:8]) for i in ids})
+        caminhos = [c for c in (_particao(d, diretorio) for d in datas) if os.path.exists(c)]
+    else:
+        caminhos = _particoes(inicio, fim, diretorio)
+    partes = []
+    for caminho in caminhos:
+        conn = _conexao(caminho)
+        try:
+            partes.append(pd.read_sql_query('SELECT cenario_id, kpi, valor FROM metricas', conn))
+        finally:
+            conn.close()
+    if not partes:
+        return pd.DataFrame()
+    longo = pd.concat(partes, ignore_index=True)
+    if ids is not None:
+        longo = longo[longo['cenario_id'].isin(ids)]
+    if kpis is not None:
+        longo = longo[longo['kpi'].isin(list(kpis))]
+    tabela = longo.pivot(index='cenario_id', columns='kpi', values='valor')
+    tabela = tabela.reindex(ids) if ids is not None else tabela.sort_index(ascending=False)
+    tabela.index.name = 'id'
+    tabela.columns.name = None
+    if referencia is not None and referencia in tabela.index:
+        base = tabela.loc[referencia].replace(0, np.nan)
+        variacao = (tabela - base) / base.abs() * 100
+        tabela = tabela.join(variacao.add_prefix('Δ% '))
+    return tabela
+
+
+def remover_cenario(cenario_id, diretorio=None):
+    """Apaga um cenário da sua partição. Retorna True se existia."""
+    caminho = _particao_do_id(cenario_id, diretorio)
+    if not os.path.exists(caminho):
+        return False
+    conn = _conexao(caminho)
+    try:
+        with conn:
+            removidos = conn.execute('DELETE FROM cenarios WHERE id = ?', (cenario_id,)).rowcount
+            conn.execute('DELETE FROM metricas WHERE cenario_id = ?', (cenario_id,))
+            conn.execute('DELETE FROM colunas WHERE cenario_id = ?', (cenario_id,))
+            conn.execute('DELETE FROM tabelas WHERE cenario_id = ?', (cenario_id,))
+    finally:
+        conn.close()
+    return removidos > 0
@@ -53,10 +53,106 @@ def calcular_distancia_tempo_rota(rota_indices, matriz_distancias, matriz_tempos
     return distancia, tempo
 
 
+def _arcos_das_rotas(nos, paradas_por_rota, forma_matriz):
+    """
+    Arcos de todas as rotas concatenadas na sequência [0, rota 1..., 0, rota 2..., 0]: a rota r tem
+    paradas_por_rota[r] + 1 arcos a partir de inicio_arcos[r], e o arco que chega à parada p (posição
+    global) é p + r. Retorna (origens, destinos, inicio_arcos, arco_valido); arcos fora da matriz apontam
+    para (0, 0) e ficam com arco_valido=False.
+    """
+    nos = np.asarray(nos, dtype=np.int64)
+    paradas_por_rota = np.asarray(paradas_por_rota, dtype=np.int64)
+    inicio_paradas = np.cumsum(paradas_por_rota) - paradas_por_rota
+    sequencia = np.r_[np.insert(nos, inicio_paradas, 0), 0]
+    origens, destinos = sequencia[:-1], sequencia[1:]
+    inicio_arcos = inicio_paradas + np.arange(len(paradas_por_rota))
+    n_linhas, n_colunas = forma_matriz
+    arco_valido = (origens >= 0) & (origens < n_linhas) & (destinos >= 0) & (destinos < n_colunas)
+    return np.where(arco_valido, origens, 0), np.where(arco_valido, destinos, 0), inicio_arcos, arco_valido
+
+
+def _tempo_dos_arcos(distancia_arcos, origens, destinos, matriz_tempos=None):
+    """Tempo de cada arco pela matriz de tempos ou, sem ela, pela distância e a velocidade média."""
+    if matriz_tempos is not None:
+        return matriz_tempos[origens, destinos]
+    velocidade_media_mps = (DEFAULT_COSTS['velocidade_media_kmh'] * 1000) / 3600 if DEFAULT_COSTS['velocidade_media_kmh'] > 0 else 0
+    return distancia_arcos / velocidade_media_mps if velocidade_media_mps > 0 else np.zeros(len(distancia_arcos))
+
+
+def _paradas_ordenadas(pedidos_roteirizados):
+    """
+    Paradas com veículo ordenadas por veículo e, dentro de cada rota, por 'tempo_chegada'.
+    Retorna (paradas, codigos, veiculos, paradas_por_rota, inicio_rota, nos, nos_validos) ou None se não
+    houver paradas; nos vem de 'node_index' (ou índice + 1), com -1 onde inválido.
+    """
+    # Verifica se a coluna 'node_index' existe, senão tenta usar o índice do DataFrame + 1
+    has_node_index_col = 'node_index' in pedidos_roteirizados.columns
+    if not has_node_index_col:
+        logging.warning("Coluna 'node_index' não encontrada em 'pedidos_roteirizados'. "
+                        "Assumindo que o índice do DataFrame + 1 corresponde ao nó na matriz. "
+                        "Isso pode ser impreciso se o índice foi resetado.")
+
+    paradas = pedidos_roteirizados.dropna(subset=['Veículo'])
+    if paradas.empty:
+        return None
+    if 'tempo_chegada' in paradas.columns:
+        paradas = paradas.sort_values(['Veículo', 'tempo_chegada'], kind='stable')
+    else:
+        logging.warning("Sem 'tempo_chegada' para ordenar as rotas. A ordem pode estar incorreta.")
+        paradas = paradas.sort_values('Veículo', kind='stable')
+    codigos, veiculos = pd.factorize(paradas['Veículo'], sort=True)
+    paradas_por_rota = np.bincount(codigos, minlength=len(veiculos))
+    inicio_rota = np.cumsum(paradas_por_rota) - paradas_por_rota
+
+    # Reconstrói a sequência de nós de todas as rotas
+    try:
+        if has_node_index_col:
+            nos = pd.to_numeric(paradas['node_index'], errors='coerce').to_numpy(dtype=float)
+        else:
+            # Usa a suposição do índice + 1
+            nos = np.asarray(paradas.index + 1, dtype=float)
+    except (TypeError, ValueError) as e:
+        logging.error(f"Erro ao obter índices de nós das rotas: {e}.")
+        nos = np.full(len(paradas), np.nan)
+    nos_validos = np.logical_and.reduceat(~np.isnan(nos), inicio_rota)
+    nos = np.where(np.isnan(nos), -1, nos).astype(np.int64)
+    return paradas, codigos, veiculos, paradas_por_rota, inicio_rota, nos, nos_validos
+
+
+def somar_arcos_por_rota(nos, paradas_por_rota, matriz_distancias, matriz_tempos=None):
+    """
+    Distância e tempo de viagem de várias rotas de uma vez (depósito 0 -> paradas -> depósito 0).
+
+    Args:
+        nos (np.ndarray): Paradas de todas as rotas concatenadas, na ordem de visita (sem o depósito).
+        paradas_por_rota (np.ndarray): Número de paradas de cada rota (>= 1).
+        matriz_distancias (np.ndarray): Matriz de distâncias.
+        matriz_tempos (np.ndarray, optional): Matriz de tempos. Se None, estima pela velocidade média.
+
+    Returns:
+        tuple: (distancias, tempos, validas) por rota. Rotas com algum índice fora da matriz ficam com
+               validas=False (e distância/tempo sem significado).
+    """
+    origens, destinos, inicio_arcos, arco_valido = _arcos_das_rotas(nos, paradas_por_rota, matriz_distancias.shape)
+    distancia_arcos = matriz_distancias[origens, destinos]
+    tempo_arcos = _tempo_dos_arcos(distancia_arcos, origens, destinos, matriz_tempos)
+    if len(inicio_arcos) == 0:
+        vazio = np.zeros(0)
+        return vazio, vazio, np.zeros(0, dtype=bool)
+    return (
+        np.add.reduceat(distancia_arcos, inicio_arcos),
+        np.add.reduceat(tempo_arcos, inicio_arcos),
+        np.logical_and.reduceat(arco_valido, inicio_arcos),
+    )
+
+
 def simular_cenario(pedidos_roteirizados, frota, matriz_distancias, matriz_tempos=None, custos=None):
     """
     Calcula métricas de desempenho para um cenário de roteirização.
 
+    Todas as rotas são avaliadas juntas: as paradas são ordenadas por veículo (e 'tempo_chegada'), os arcos de
+    todas as rotas viram arrays de origem/destino e distâncias/tempos são somados por rota (somar_arcos_por_rota).
+
     Args:
         pedidos_roteirizados (pd.DataFrame): DataFrame de pedidos com a coluna 'Veículo' preenchida.
                                              Idealmente, deve conter 'tempo_chegada', 'tempo_saida' (em segundos desde 00:00)
@@ -103,72 +199,48 @@ def simular_cenario(pedidos_roteirizados, frota, matriz_distancias, matriz_tempo
     metricas['veiculos_usados'] = len(veiculos_ativos)
     metricas['custo_total'] += metricas['veiculos_usados'] * custo_fixo_veiculo
 
-    # Verifica se a coluna 'node_index' existe, senão tenta usar o índice do DataFrame + 1
-    has_node_index_col = 'node_index' in pedidos_roteirizados.columns
-    if not has_node_index_col:
-        logging.warning("Coluna 'node_index' não encontrada em 'pedidos_roteirizados'. "
-                        "Assumindo que o índice do DataFrame + 1 corresponde ao nó na matriz. "
-                        "Isso pode ser impreciso se o índice foi resetado.")
-
-    grouped = pedidos_roteirizados.dropna(subset=['Veículo']).groupby('Veículo')
-
-    for veiculo_id, rota_df in grouped:
-        # Ordena a rota se possível
-        if 'tempo_chegada' in rota_df.columns:
-            rota_ordenada_df = rota_df.sort_values('tempo_chegada').copy()
-        else:
-             logging.warning(f"Sem 'tempo_chegada' para ordenar rota do veículo {veiculo_id}. A ordem pode estar incorreta.")
-             rota_ordenada_df = rota_df.copy()
-
-        # Reconstrói a sequência de nós
-        try:
-            if has_node_index_col:
-                # Garante que node_index seja inteiro
-                indices_paradas = rota_ordenada_df['node_index'].astype(int).tolist()
-            else:
-                # Usa a suposição do índice + 1
-                indices_paradas = (rota_ordenada_df.index + 1).tolist()
-
-            if not indices_paradas: # Rota vazia após filtros?
-                 logging.warning(f"Rota para veículo {veiculo_id} está vazia após ordenação/agrupamento.")
-                 continue
-
-            indices_rota_completa = [0] + indices_paradas + [0] # Adiciona depósito
-        except (TypeError, ValueError, KeyError) as e:
-             logging.error(f"Erro ao obter índices de nós para veículo {veiculo_id}: {e}. Pulando rota.")
-             continue
-
-        # Calcula distância e tempo de viagem da rota
-        distancia_rota_m, tempo_viagem_seg = calcular_distancia_tempo_rota(
-            indices_rota_completa, matriz_distancias, matriz_tempos
-        )
-
-        if distancia_rota_m == np.inf or tempo_viagem_seg == np.inf:
-             logging.warning(f"Cálculo de distância/tempo falhou para rota do veículo {veiculo_id}. Pulando.")
-             continue
-
-        # Calcula tempo de serviço total para a rota
-        tempo_servico_total_seg = 0
-        if 'tempo_saida' in rota_ordenada_df.columns and 'tempo_chegada' in rota_ordenada_df.columns:
-            # Calcula tempo de serviço a partir dos dados VRPTW (tempo_saida - tempo_chegada)
-            # Garante que sejam numéricos e não negativos
-            tempos_servico = rota_ordenada_df['tempo_saida'] - rota_ordenada_df['tempo_chegada']
-            tempos_servico = tempos_servico.apply(lambda x: max(x, 0) if pd.notna(x) else 0)
-            tempo_servico_total_seg = tempos_servico.sum()
-            if tempo_servico_total_seg <= 0 and len(indices_paradas) > 0:
+    # Paradas ordenadas por veículo e, dentro de cada rota, por horário de chegada
+    ordenadas = _paradas_ordenadas(pedidos_roteirizados)
+    if ordenadas is None:
+        return metricas
+    paradas, codigos, veiculos, paradas_por_rota, inicio_rota, nos, nos_validos = ordenadas
+
+    # Calcula distância e tempo de viagem de todas as rotas
+    distancias, tempos_viagem, arcos_validos = somar_arcos_por_rota(nos, paradas_por_rota, matriz_distancias, matriz_tempos)
+
+    # Tempo de serviço por rota a partir dos dados VRPTW (tempo_saida - tempo_chegada), não negativo
+    servico_vrptw = None
+    if 'tempo_saida' in paradas.columns and 'tempo_chegada' in paradas.columns:
+        tempos_servico = (paradas['tempo_saida'] - paradas['tempo_chegada']).clip(lower=0).fillna(0)
+        servico_vrptw = tempos_servico.groupby(codigos).sum().to_numpy()
+
+    for r, veiculo_id in enumerate(veiculos):
+        if not nos_validos[r]:
+            logging.error(f"Erro ao obter índices de nós para veículo {veiculo_id}: 'node_index' inválido. Pulando rota.")
+            continue
+        if not arcos_validos[r]:
+            logging.warning(f"Cálculo de distância/tempo falhou para rota do veículo {veiculo_id} (índices fora da matriz). Pulando.")
+            continue
+        num_paradas = int(paradas_por_rota[r])
+        distancia_rota_m = distancias[r]
+        tempo_viagem_seg = tempos_viagem[r]
+
+        if servico_vrptw is not None:
+            tempo_servico_total_seg = servico_vrptw[r]
+            if tempo_servico_total_seg <= 0:
                  # Se a soma for zero, pode ser que chegada=saida, usa o default
                  logging.debug(f"Tempo de serviço calculado do VRPTW foi zero para {veiculo_id}. Usando default.")
-                 tempo_servico_total_seg = len(indices_paradas) * tempo_servico_padrao_seg
+                 tempo_servico_total_seg = num_paradas * tempo_servico_padrao_seg
         else:
             # Estima tempo de serviço usando o padrão
-            tempo_servico_total_seg = len(indices_paradas) * tempo_servico_padrao_seg
+            tempo_servico_total_seg = num_paradas * tempo_servico_padrao_seg
 
         tempo_operacao_seg = tempo_viagem_seg + tempo_servico_total_seg
 
         # Calcula custo da rota
         custo_distancia = (distancia_rota_m / 1000) * custo_por_km
         custo_tempo = (tempo_operacao_seg / 3600) * custo_por_hora
-        # custo_paradas = len(indices_paradas) * custos_usados.get('cost_per_stop', 0) # Exemplo
+        # custo_paradas = num_paradas * custos_usados.get('cost_per_stop', 0) # Exemplo
         custo_rota = custo_distancia + custo_tempo # + custo_paradas
 
         # Adiciona às métricas totais
@@ -181,13 +253,13 @@ def simular_cenario(pedidos_roteirizados, frota, matriz_distancias, matriz_tempo
         # Guarda informações da rota individual
         metricas['rotas_info'].append({
             'veiculo_id': veiculo_id,
-            'num_paradas': len(indices_paradas),
+            'num_paradas': num_paradas,
             'distancia_km': distancia_rota_m / 1000,
             'tempo_viagem_h': tempo_viagem_seg / 3600,
             'tempo_servico_h': tempo_servico_total_seg / 3600,
             'tempo_operacao_h': tempo_operacao_seg / 3600,
             'custo_estimado': custo_rota,
-            'sequencia_indices': indices_rota_completa
+            'sequencia_indices': [0] + nos[inicio_rota[r]:inicio_rota[r] + num_paradas].tolist() + [0]
         })
 
     return metricas
@@ -204,107 +276,635 @@ def calcular_custos(pedidos_roteirizados, frota, matriz_distancias, matriz_tempo
     return 0.0
 
 
-def balancear_carga(rotas_info, frota, matriz_distancias, matriz_tempos=None, demandas=None, capacidade_veiculo=None):
+PARAMETROS_CUSTO = ('cost_per_km', 'cost_per_hour', 'fixed_cost_per_vehicle', 'default_service_time_min')
+
+
+def agregados_por_rota(pedidos_roteirizados, matriz_distancias, matriz_tempos=None):
+    """
+    Agregados de cada rota que não dependem dos parâmetros de custo: distância, tempo de viagem, tempo de
+    serviço vindo do VRPTW e número de paradas que usam o tempo de serviço padrão (mesmas regras de
+    simular_cenario). Rotas com índices inválidos ficam de fora.
+
+    Returns:
+        tuple: (DataFrame com 'veiculo_id', 'num_paradas', 'distancia_km', 'tempo_viagem_h',
+               'tempo_servico_vrptw_h', 'paradas_servico_padrao'; número de veículos usados).
+    """
+    colunas = ['veiculo_id', 'num_paradas', 'distancia_km', 'tempo_viagem_h', 'tempo_servico_vrptw_h', 'paradas_servico_padrao']
+    veiculos_usados = pedidos_roteirizados['Veículo'].dropna().nunique()
+    ordenadas = _paradas_ordenadas(pedidos_roteirizados)
+    if ordenadas is None:
+        return pd.DataFrame(columns=colunas), veiculos_usados
+    paradas, codigos, veiculos, paradas_por_rota, inicio_rota, nos, nos_validos = ordenadas
+    distancias, tempos_viagem, arcos_validos = somar_arcos_por_rota(nos, paradas_por_rota, matriz_distancias, matriz_tempos)
+    servico_vrptw = np.zeros(len(veiculos))
+    if 'tempo_saida' in paradas.columns and 'tempo_chegada' in paradas.columns:
+        tempos_servico = (paradas['tempo_saida'] - paradas['tempo_chegada']).clip(lower=0).fillna(0)
+        servico_vrptw = tempos_servico.groupby(codigos).sum().to_numpy(dtype=float)
+    usa_padrao = servico_vrptw <= 0
+    rotas = pd.DataFrame({
+        'veiculo_id': np.asarray(veiculos, dtype=object),
+        'num_paradas': paradas_por_rota,
+        'distancia_km': distancias / 1000,
+        'tempo_viagem_h': tempos_viagem / 3600,
+        'tempo_servico_vrptw_h': np.where(usa_padrao, 0.0, servico_vrptw / 3600),
+        'paradas_servico_padrao': np.where(usa_padrao, paradas_por_rota, 0),
+    })
+    return rotas[nos_validos & arcos_validos].reset_index(drop=True), veiculos_usados
+
+
+def grade_custos(**valores):
+    """
+    Todas as combinações dos valores informados por parâmetro de custo, um cenário por linha. Parâmetros não
+    informados usam DEFAULT_COSTS. Ex.: grade_custos(cost_per_km=[1.5, 1.8, 2.1], cost_per_hour=[30, 35]).
+    """
+    desconhecidos = set(valores) - set(PARAMETROS_CUSTO)
+    if desconhecidos:
+        raise ValueError(f"Parâmetros de custo desconhecidos: {sorted(desconhecidos)}")
+    eixos = {p: list(np.atleast_1d(valores.get(p, DEFAULT_COSTS[p]))) for p in PARAMETROS_CUSTO}
+    grade = pd.MultiIndex.from_product(list(eixos.values()), names=list(eixos)).to_frame(index=False)
+    grade.index.name = 'cenario'
+    return grade
+
+
+def varrer_custos(pedidos_roteirizados, matriz_distancias, cenarios, matriz_tempos=None):
+    """
+    Avalia vários conjuntos de parâmetros de custo sobre o mesmo plano. Os agregados das rotas são calculados
+    uma vez (agregados_por_rota) e todos os cenários são avaliados com um único produto de matrizes:
+    cada KPI é linear nos termos [custo/km, custo/h, custo/h x serviço padrão, custo fixo].
+
+    Args:
+        pedidos_roteirizados (pd.DataFrame): Como em simular_cenario.
+        matriz_distancias (np.ndarray): Matriz de distâncias (em metros).
+        cenarios (pd.DataFrame or list of dict): Um cenário por linha/dict com as chaves de PARAMETROS_CUSTO
+                                                 (ausentes valem 0, e 15 min para 'default_service_time_min',
+                                                 como em simular_cenario). O índice do DataFrame nomeia os cenários.
+        matriz_tempos (np.ndarray, optional): Matriz de tempos de viagem (em segundos).
+
+    Returns:
+        pd.DataFrame: Formato longo com 'cenario', os parâmetros do cenário, 'kpi' e 'valor'. custo_total
+                      coincide com simular_cenario(..., custos=cenario)['custo_total'].
+    """
+    cenarios = pd.DataFrame(cenarios).copy()
+    for parametro in PARAMETROS_CUSTO:
+        padrao = 15 if parametro == 'default_service_time_min' else 0
+        cenarios[parametro] = pd.to_numeric(cenarios[parametro], errors='coerce').fillna(padrao) if parametro in cenarios.columns else padrao
+    rotas, veiculos_usados = agregados_por_rota(pedidos_roteirizados, matriz_distancias, matriz_tempos)
+
+    km = rotas['distancia_km'].sum()
+    horas_fixas = (rotas['tempo_viagem_h'] + rotas['tempo_servico_vrptw_h']).sum()
+    paradas_padrao = rotas['paradas_servico_padrao'].sum()
+    # Coeficientes de cada KPI (linhas) sobre os termos de custo de cada cenário (colunas)
+    termos = np.column_stack([
+        cenarios['cost_per_km'], cenarios['cost_per_hour'],
+        cenarios['cost_per_hour'] * cenarios['default_service_time_min'] / 60, cenarios['fixed_cost_per_vehicle'],
+        cenarios['default_service_time_min'] / 60, np.ones(len(cenarios)),
+    ]).T
+    kpis = {
+        'custo_total':            [km, horas_fixas, paradas_padrao, veiculos_usados, 0, 0],
+        'custo_distancia':        [km, 0, 0, 0, 0, 0],
+        'custo_tempo':            [0, horas_fixas, paradas_padrao, 0, 0, 0],
+        'custo_fixo':             [0, 0, 0, veiculos_usados, 0, 0],
+        'tempo_operacao_total_h': [0, 0, 0, 0, paradas_padrao, horas_fixas],
+        'distancia_total_km':     [0, 0, 0, 0, 0, km],
+    }
+    valores = np.asarray(list(kpis.values()), dtype=float) @ termos
+    n_paradas = rotas['num_paradas'].sum()
+    valores = np.vstack([
+        valores,
+        valores[0] / km if km > 0 else np.full(len(cenarios), np.nan),
+        valores[0] / n_paradas if n_paradas > 0 else np.full(len(cenarios), np.nan),
+    ])
+    nomes_kpi = list(kpis) + ['custo_por_km', 'custo_por_parada']
+    resultado = pd.DataFrame(valores.T, index=cenarios.index, columns=nomes_kpi)
+    resultado.index.name = 'cenario'
+    return (
+        cenarios.rename_axis('cenario').join(resultado).reset_index()
+        .melt(id_vars=['cenario'] + list(cenarios.columns), value_vars=nomes_kpi, var_name='kpi', value_name='valor')
+    )
+
+
+class AvaliadorIncremental:
+    """
+    KPIs de um plano mantidos por rota (distância, tempo de viagem, tempo de serviço, carga e custo) para
+    edições pontuais: mover uma parada entre veículos atualiza só as duas rotas afetadas, pelos deltas dos
+    arcos removidos e inseridos, sem reavaliar o plano inteiro.
+
+    O estado inicial coincide com simular_cenario; o tempo de serviço fica associado a cada parada (o do
+    VRPTW ou o padrão, conforme a rota de origem) e acompanha a parada quando ela muda de veículo. Rotas com
+    índices inválidos ficam fora das rotas editáveis, mas, como em simular_cenario, o veículo continua
+    contando em veiculos_usados e no custo fixo (veiculos_ignorados).
+    """
+    __slots__ = (
+        'matriz_distancias', 'matriz_tempos', 'velocidade_media_mps', 'custo_por_km', 'custo_por_hora',
+        'custo_fixo_veiculo', 'rotas', 'rota_do_no', 'servico', 'demanda', 'distancia', 'tempo_viagem',
+        'tempo_servico', 'carga', 'soma', 'veiculos_ignorados'
+    )
+
+    def __init__(self, rotas, matriz_distancias, matriz_tempos=None, servico=None, demanda=None, custos=None,
+                 veiculos_ignorados=0):
+        """
+        Args:
+            rotas (dict): Veículo -> lista de nós visitados (sem o depósito 0).
+            matriz_distancias (np.ndarray): Matriz de distâncias (em metros).
+            matriz_tempos (np.ndarray, optional): Matriz de tempos (em segundos). Se None, usa a velocidade média.
+            servico (dict, optional): Nó -> tempo de serviço em segundos (padrão de custos se ausente).
+            demanda (dict, optional): Nó -> demanda.
+            custos (dict, optional): Parâmetros de custo. Usa DEFAULT_COSTS se None.
+            veiculos_ignorados (int): Veículos com paradas fora de rotas (índices inválidos); entram só em
+                                      veiculos_usados e no custo fixo, como em simular_cenario.
+        """
+        custos_usados = custos if custos is not None else DEFAULT_COSTS
+        self.custo_por_km = custos_usados.get('cost_per_km', 0)
+        self.custo_por_hora = custos_usados.get('cost_per_hour', 0)
+        self.custo_fixo_veiculo = custos_usados.get('fixed_cost_per_vehicle', 0)
+        servico_padrao = custos_usados.get('default_service_time_min', 15) * 60
+        self.matriz_distancias = matriz_distancias
+        self.matriz_tempos = matriz_tempos
+        self.velocidade_media_mps = (DEFAULT_COSTS['velocidade_media_kmh'] * 1000) / 3600 if DEFAULT_COSTS['velocidade_media_kmh'] > 0 else 0
+        self.rotas = {v: [int(no) for no in nos] for v, nos in rotas.items()}
+        self.rota_do_no = {no: v for v, nos in self.rotas.items() for no in nos}
+        servico = servico or {}
+        demanda = demanda or {}
+        self.servico = {no: float(servico.get(no, servico_padrao)) for no in self.rota_do_no}
+        self.demanda = {no: float(demanda.get(no, 0)) for no in self.rota_do_no}
+        self.distancia, self.tempo_viagem, self.tempo_servico, self.carga = {}, {}, {}, {}
+        for v, nos in self.rotas.items():
+            caminho = np.asarray([0] + nos + [0], dtype=np.int64)
+            self.distancia[v] = float(matriz_distancias[caminho[:-1], caminho[1:]].sum())
+            self.tempo_viagem[v] = sum(self._tempo(a, b) for a, b in zip(caminho[:-1], caminho[1:]))
+            self.tempo_servico[v] = sum(self.servico[no] for no in nos)
+            self.carga[v] = sum(self.demanda[no] for no in nos)
+        self.veiculos_ignorados = int(veiculos_ignorados)
+        self.soma = np.zeros(len(self._CHAVES_TOTAIS))
+        self.soma[0] = self.veiculos_ignorados
+        self.soma[-1] = self.veiculos_ignorados * self.custo_fixo_veiculo
+        for v in self.rotas:
+            self.soma += self._contribuicao(self.rotas[v], self.distancia[v], self.tempo_viagem[v], self.tempo_servico[v])
+
+    @classmethod
+    def de_pedidos(cls, pedidos_roteirizados, matriz_distancias, matriz_tempos=None, custos=None, coluna_demanda='Demanda'):
+        """
+        Monta o avaliador a partir do mesmo DataFrame usado por simular_cenario. Rotas inválidas ficam fora das
+        rotas editáveis, mas seus veículos entram em veiculos_ignorados.
+        """
+        custos_usados = custos if custos is not None else DEFAULT_COSTS
+        rotas, servico, demanda = {}, {}, {}
+        veiculos_ignorados = 0
+        ordenadas = _paradas_ordenadas(pedidos_roteirizados)
+        if ordenadas is not None:
+            paradas, codigos, veiculos, paradas_por_rota, inicio_rota, nos, nos_validos = ordenadas
+            _, _, arcos_validos = somar_arcos_por_rota(nos, paradas_por_rota, matriz_distancias, matriz_tempos)
+            servico_no = np.full(len(paradas), custos_usados.get('default_service_time_min', 15) * 60.0)
+            if 'tempo_saida' in paradas.columns and 'tempo_chegada' in paradas.columns:
+                servico_vrptw = (paradas['tempo_saida'] - paradas['tempo_chegada']).clip(lower=0).fillna(0).to_numpy(dtype=float)
+                rota_com_servico = np.add.reduceat(servico_vrptw, inicio_rota) > 0
+                servico_no = np.where(rota_com_servico[codigos], servico_vrptw, servico_no)
+            demanda_no = np.zeros(len(paradas))
+            if coluna_demanda in paradas.columns:
+                demanda_no = pd.to_numeric(paradas[coluna_demanda], errors='coerce').fillna(0).to_numpy(dtype=float)
+            for r, veiculo in enumerate(veiculos):
+                if nos_validos[r] and arcos_validos[r]:
+                    fatia = slice(inicio_rota[r], inicio_rota[r] + paradas_por_rota[r])
+                    rotas[veiculo] = nos[fatia].tolist()
+                    servico.update(zip(rotas[veiculo], servico_no[fatia].tolist()))
+                    demanda.update(zip(rotas[veiculo], demanda_no[fatia].tolist()))
+                else:
+                    veiculos_ignorados += 1
+                    logging.warning(f"Avaliador incremental: rota do veículo {veiculo} com índices inválidos ignorada.")
+        return cls(rotas, matriz_distancias, matriz_tempos, servico, demanda, custos, veiculos_ignorados)
+
+    def _tempo(self, a, b):
+        if self.matriz_tempos is not None:
+            return float(self.matriz_tempos[a, b])
+        return float(self.matriz_distancias[a, b]) / self.velocidade_media_mps if self.velocidade_media_mps > 0 else 0.0
+
+    def _custo_rota(self, distancia_m, tempo_viagem_seg, tempo_servico_seg):
+        return (distancia_m / 1000) * self.custo_por_km + ((tempo_viagem_seg + tempo_servico_seg) / 3600) * self.custo_por_hora
+
+    def _delta_arcos(self, a, u, b):
+        """Distância e tempo acrescentados ao passar por u entre a e b (em vez de ir direto de a para b)."""
+        d = self.matriz_distancias
+        return (
+            float(d[a, u] + d[u, b] - d[a, b]),
+            self._tempo(a, u) + self._tempo(u, b) - self._tempo(a, b),
+        )
+
+    def melhor_posicao(self, no, veiculo):
+        """Posição de menor acréscimo de distância para inserir o nó na rota do veículo."""
+        rota = [x for x in self.rotas.get(veiculo, []) if x != no]
+        if not rota:
+            return 0
+        anteriores = np.asarray([0] + rota)
+        seguintes = np.asarray(rota + [0])
+        d = self.matriz_distancias
+        return int(np.argmin(d[anteriores, no] + d[no, seguintes] - d[anteriores, seguintes]))
+
+    def _movimento(self, no, veiculo_destino, posicao):
+        """Novo estado (rota, distância, tempo de viagem, serviço, carga) das rotas de origem e destino."""
+        origem = self.rota_do_no[no]
+        if posicao is None:
+            posicao = self.melhor_posicao(no, veiculo_destino)
+        rota_origem = self.rotas[origem]
+        i = rota_origem.index(no)
+        anterior = rota_origem[i - 1] if i > 0 else 0
+        seguinte = rota_origem[i + 1] if i + 1 < len(rota_origem) else 0
+        delta_dist, delta_tempo = self._delta_arcos(anterior, no, seguinte)
+        nova_origem = rota_origem[:i] + rota_origem[i + 1:]
+        estados = {origem: [
+            nova_origem, self.distancia[origem] - delta_dist, self.tempo_viagem[origem] - delta_tempo,
+            self.tempo_servico[origem] - self.servico[no], self.carga[origem] - self.demanda[no],
+        ]}
+        if veiculo_destino in estados:
+            estado = estados[veiculo_destino]
+        else:
+            estado = [list(self.rotas.get(veiculo_destino, [])), self.distancia.get(veiculo_destino, 0.0),
+                      self.tempo_viagem.get(veiculo_destino, 0.0), self.tempo_servico.get(veiculo_destino, 0.0),
+                      self.carga.get(veiculo_destino, 0.0)]
+            estados[veiculo_destino] = estado
+        rota_destino = estado[0]
+        posicao = max(0, min(posicao, len(rota_destino)))
+        anterior = rota_destino[posicao - 1] if posicao > 0 else 0
+        seguinte = rota_destino[posicao] if posicao < len(rota_destino) else 0
+        delta_dist, delta_tempo = self._delta_arcos(anterior, no, seguinte)
+        estado[0] = rota_destino[:posicao] + [no] + rota_destino[posicao:]
+        estado[1] += delta_dist
+        estado[2] += delta_tempo
+        estado[3] += self.servico[no]
+        estado[4] += self.demanda[no]
+        return estados
+
+    _CHAVES_TOTAIS = ('veiculos_usados', 'distancia_total_km', 'tempo_viagem_total_h', 'tempo_servico_total_h',
+                      'tempo_operacao_total_h', 'custo_total')
+
+    def _contribuicao(self, rota, distancia, tempo_viagem, tempo_servico):
+        """Parcela de uma rota em cada total (na ordem de _CHAVES_TOTAIS); rota vazia não conta."""
+        if not rota:
+            return np.zeros(len(self._CHAVES_TOTAIS))
+        return np.array([
+            1, distancia / 1000, tempo_viagem / 3600, tempo_servico / 3600, (tempo_viagem + tempo_servico) / 3600,
+            self._custo_rota(distancia, tempo_viagem, tempo_servico) + self.custo_fixo_veiculo,
+        ])
+
+    def _soma_com(self, estados):
+        """Somas dos totais trocando a parcela das rotas alteradas pela do novo estado."""
+        soma = self.soma.copy()
+        for v, (rota, distancia, tempo_viagem, tempo_servico, _) in estados.items():
+            if v in self.rotas:
+                soma -= self._contribuicao(self.rotas[v], self.distancia[v], self.tempo_viagem[v], self.tempo_servico[v])
+            soma += self._contribuicao(rota, distancia, tempo_viagem, tempo_servico)
+        return soma
+
+    def _totais(self, soma):
+        totais = dict(zip(self._CHAVES_TOTAIS, soma.tolist()))
+        totais['veiculos_usados'] = int(round(totais['veiculos_usados']))
+        return totais
+
+    def totais(self):
+        """Totais do plano atual, com as mesmas chaves de simular_cenario (sem 'rotas_info')."""
+        return self._totais(self.soma)
+
+    def avaliar_movimento(self, no, veiculo_destino, posicao=None):
+        """Totais do plano se o nó fosse para veiculo_destino (na posição dada ou na de menor custo), sem aplicar."""
+        return self._totais(self._soma_com(self._movimento(no, veiculo_destino, posicao)))
+
+    def mover(self, no, veiculo_destino, posicao=None):
+        """Move o nó para veiculo_destino (na posição dada ou na de menor custo) e retorna os novos totais."""
+        estados = self._movimento(no, veiculo_destino, posicao)
+        self.soma = self._soma_com(estados)
+        for v, (rota, distancia, tempo_viagem, tempo_servico, carga) in estados.items():
+            self.rotas[v] = rota
+            self.distancia[v], self.tempo_viagem[v], self.tempo_servico[v], self.carga[v] = distancia, tempo_viagem, tempo_servico, carga
+        self.rota_do_no[no] = veiculo_destino
+        return self.totais()
+
+    def rotas_info(self):
+        """Rotas no formato de simular_cenario['rotas_info'] (mais 'carga'), em ordem de veículo."""
+        info = []
+        for v in sorted(self.rotas, key=str):
+            rota = self.rotas[v]
+            if not rota:
+                continue
+            distancia, tempo_viagem, tempo_servico = self.distancia[v], self.tempo_viagem[v], self.tempo_servico[v]
+            info.append({
+                'veiculo_id': v,
+                'num_paradas': len(rota),
+                'distancia_km': distancia / 1000,
+                'tempo_viagem_h': tempo_viagem / 3600,
+                'tempo_servico_h': tempo_servico / 3600,
+                'tempo_operacao_h': (tempo_viagem + tempo_servico) / 3600,
+                'custo_estimado': self._custo_rota(distancia, tempo_viagem, tempo_servico),
+                'carga': self.carga[v],
+                'sequencia_indices': [0] + rota + [0],
+            })
+        return info
+
+
+def _propagar_chegadas(viagem, servico, inicio_jornada, janela_inicio, paradas_na_posicao):
+    """
+    Horário de chegada (início do atendimento) de cada parada em cada replicação: parte do início da jornada
+    da rota, soma viagem e serviço da parada anterior e espera a abertura da janela. As paradas de mesma
+    posição em todas as rotas são processadas juntas. viagem/servico: (replicações x paradas).
+    """
+    chegada = np.empty_like(viagem)
+    for k, idx in enumerate(paradas_na_posicao):
+        if k == 0:
+            base = inicio_jornada[idx]
+        else:
+            base = chegada[:, idx - 1] + servico[:, idx - 1]
+        chegada[:, idx] = np.maximum(base + viagem[:, idx], janela_inicio[idx])
+    return chegada
+
+
+def _replicar_atrasos(dados, n_replicacoes, semente):
+    """Um lote de replicações de Monte Carlo; retorna somas por parada e valores por replicação x rota."""
+    rng = np.random.default_rng(semente)
+    sigma_v, sigma_s = dados['sigma_viagem'], dados['sigma_servico']
+    n_paradas = len(dados['viagem'])
+    # Fatores lognormais com média 1
+    if dados['faixa_do_arco'] is None:
+        fator_viagem = rng.lognormal(-sigma_v ** 2 / 2, sigma_v, (n_replicacoes, n_paradas))
+    else:
+        fator_faixa = rng.lognormal(-sigma_v ** 2 / 2, sigma_v, (n_replicacoes, dados['n_faixas']))
+        fator_viagem = fator_faixa[:, dados['faixa_do_arco']]
+    fator_servico = rng.lognormal(-sigma_s ** 2 / 2, sigma_s, (n_replicacoes, n_paradas))
+    chegada = _propagar_chegadas(
+        dados['viagem'] * fator_viagem, dados['servico'] * fator_servico, dados['inicio_jornada'],
+        dados['janela_inicio'], dados['paradas_na_posicao']
+    )
+    atraso = np.maximum(chegada - dados['janela_fim'], 0)
+    atrasada = atraso > 0
+    return {
+        'atrasos_por_parada': atrasada.sum(axis=0),
+        'atraso_total_por_parada': atraso.sum(axis=0),
+        'paradas_atrasadas_por_rota': np.add.reduceat(atrasada, dados['inicio_rota'], axis=1),
+        'atraso_por_rota': np.add.reduceat(atraso, dados['inicio_rota'], axis=1),
+    }
+
+
+def simular_risco_atraso(pedidos_roteirizados, matriz_distancias, matriz_tempos=None, n_replicacoes=2000,
+                         sigma_viagem=0.25, sigma_servico=0.3, modo='arco', duracao_faixa_min=60,
+                         inicio_jornada_seg=5 * 3600, custos=None, tamanho_lote=500, n_processos=1, semente=None):
+    """
+    Simulação de Monte Carlo do risco de atraso de um plano pronto.
+
+    Os tempos de viagem e de serviço nominais (mesmos de simular_cenario) são multiplicados por fatores
+    lognormais de média 1: com modo='arco' um fator independente por arco e replicação; com modo='faixa' um
+    fator por faixa horária (duracao_faixa_min) e replicação, comum a todos os arcos que partem nessa faixa
+    (trânsito correlacionado). Cada parada espera a abertura de 'Janela Início' e está atrasada quando o
+    atendimento começa depois de 'Janela Fim' (janelas ausentes usam 05:00-18:00). A jornada da rota começa
+    em tempo_chegada da primeira parada menos a viagem até ela, ou em inicio_jornada_seg.
+    As replicações são geradas em lotes de tamanho_lote (matrizes replicações x paradas), distribuídos em
+    n_processos processos quando > 1; o resultado é o mesmo para a mesma semente.
+
+    Returns:
+        dict: 'por_parada' (DataFrame com o índice dos pedidos: 'Veículo', 'node_index', 'Chegada_Nominal_Seg',
+              'Janela_Fim_Seg', 'Prob_Atraso', 'Atraso_Medio_Min'), 'por_rota' (DataFrame com 'veiculo_id',
+              'num_paradas', 'prob_atraso', 'paradas_atrasadas_media', 'atraso_medio_min', 'atraso_p95_min')
+              e 'n_replicacoes'; ou None em caso de erro.
+    """
+    if not isinstance(pedidos_roteirizados, pd.DataFrame) or 'Veículo' not in pedidos_roteirizados.columns:
+        logging.error("Erro: 'pedidos_roteirizados' inválido ou sem coluna 'Veículo'.")
+        return None
+    if modo not in ('arco', 'faixa'):
+        raise ValueError(f"Modo de perturbação desconhecido: {modo}")
+    ordenadas = _paradas_ordenadas(pedidos_roteirizados)
+    if ordenadas is None:
+        return None
+    paradas, codigos, veiculos, paradas_por_rota, inicio_rota, nos, nos_validos = ordenadas
+    origens, destinos, inicio_arcos, arco_valido = _arcos_das_rotas(nos, paradas_por_rota, matriz_distancias.shape)
+    rota_valida = nos_validos & np.logical_and.reduceat(arco_valido, inicio_arcos)
+    if not rota_valida.all():
+        logging.warning(f"Risco de atraso: {int((~rota_valida).sum())} rota(s) com índices inválidos ignorada(s).")
+        manter = rota_valida[codigos]
+        paradas, nos = paradas[manter], nos[manter]
+        codigos = pd.factorize(codigos[manter], sort=True)[0]
+        veiculos, paradas_por_rota = veiculos[rota_valida], paradas_por_rota[rota_valida]
+        inicio_rota = np.cumsum(paradas_por_rota) - paradas_por_rota
+        origens, destinos, inicio_arcos, _ = _arcos_das_rotas(nos, paradas_por_rota, matriz_distancias.shape)
+    if paradas.empty:
+        return None
+
+    # Viagem nominal do arco que chega a cada parada (arco p + r na sequência concatenada)
+    posicao_global = np.arange(len(paradas))
+    arco_chegada = posicao_global + codigos
+    tempo_arcos = _tempo_dos_arcos(matriz_distancias[origens, destinos], origens, destinos, matriz_tempos)
+    viagem = np.asarray(tempo_arcos[arco_chegada], dtype=float)
+
+    # Serviço nominal por parada, com o mesmo critério de simular_cenario
+    custos_usados = custos if custos is not None else DEFAULT_COSTS
+    tempo_servico_padrao_seg = custos_usados.get('default_service_time_min', 15) * 60
+    servico = np.full(len(paradas), float(tempo_servico_padrao_seg))
+    if 'tempo_saida' in paradas.columns and 'tempo_chegada' in paradas.columns:
+        servico_vrptw = (paradas['tempo_saida'] - paradas['tempo_chegada']).clip(lower=0).fillna(0).to_numpy(dtype=float)
+        rota_com_servico = np.add.reduceat(servico_vrptw, inicio_rota) > 0
+        servico = np.where(rota_com_servico[codigos], servico_vrptw, servico)
+
+    from routing.utils import adicionar_janelas_em_minutos
+    paradas = adicionar_janelas_em_minutos(paradas)
+    janela_inicio = paradas['Janela_Inicio_Min'].to_numpy(dtype=float) * 60
+    janela_fim = paradas['Janela_Fim_Min'].to_numpy(dtype=float) * 60
+    janela_inicio = np.where(np.isnan(janela_inicio), -np.inf, janela_inicio)
+    janela_fim = np.where(np.isnan(janela_fim), np.inf, janela_fim)
+
+    inicio_jornada = np.full(len(paradas), float(inicio_jornada_seg))
+    if 'tempo_chegada' in paradas.columns:
+        primeira_chegada = pd.to_numeric(paradas['tempo_chegada'], errors='coerce').to_numpy(dtype=float)[inicio_rota]
+        inicio_rotas = np.where(np.isnan(primeira_chegada), inicio_jornada_seg, primeira_chegada - viagem[inicio_rota])
+        inicio_jornada = inicio_rotas[codigos]
+
+    posicao_na_rota = posicao_global - inicio_rota[codigos]
+    ordem = np.argsort(posicao_na_rota, kind='stable')
+    paradas_na_posicao = np.split(ordem, np.flatnonzero(np.diff(posicao_na_rota[ordem])) + 1)
+    chegada_nominal = _propagar_chegadas(viagem[None, :], servico[None, :], inicio_jornada, janela_inicio, paradas_na_posicao)[0]
+
+    faixa_do_arco, n_faixas = None, 0
+    if modo == 'faixa':
+        duracao_faixa_seg = duracao_faixa_min * 60
+        n_faixas = int(np.ceil(24 * 3600 / duracao_faixa_seg))
+        partida_nominal = chegada_nominal - viagem
+        faixa_do_arco = (np.floor(partida_nominal / duracao_faixa_seg).astype(np.int64)) % n_faixas
+
+    dados = {
+        'viagem': viagem, 'servico': servico, 'inicio_jornada': inicio_jornada, 'janela_inicio': janela_inicio,
+        'janela_fim': janela_fim, 'paradas_na_posicao': paradas_na_posicao, 'inicio_rota': inicio_rota,
+        'faixa_do_arco': faixa_do_arco, 'n_faixas': n_faixas, 'sigma_viagem': sigma_viagem, 'sigma_servico': sigma_servico,
+    }
+    lotes = [min(tamanho_lote, n_replicacoes - i) for i in range(0, n_replicacoes, tamanho_lote)]
+    sementes = np.random.SeedSequence(semente).spawn(len(lotes))
+    if n_processos and n_processos > 1 and len(lotes) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(n_processos, len(lotes))) as executor:
+            resultados = list(executor.map(_replicar_atrasos, [dados] * len(lotes), lotes, sementes))
+    else:
+        resultados = [_replicar_atrasos(dados, n, s) for n, s in zip(lotes, sementes)]
+
+    atrasos_por_parada = sum(r['atrasos_por_parada'] for r in resultados)
+    atraso_total_por_parada = sum(r['atraso_total_por_parada'] for r in resultados)
+    paradas_atrasadas_por_rota = np.concatenate([r['paradas_atrasadas_por_rota'] for r in resultados])
+    atraso_por_rota = np.concatenate([r['atraso_por_rota'] for r in resultados])
+
+    por_parada = pd.DataFrame({
+        'Veículo': paradas['Veículo'].to_numpy(),
+        'node_index': nos,
+        'Chegada_Nominal_Seg': chegada_nominal,
+        'Janela_Fim_Seg': paradas['Janela_Fim_Min'].to_numpy(dtype=float) * 60,
+        'Prob_Atraso': atrasos_por_parada / n_replicacoes,
+        'Atraso_Medio_Min': atraso_total_por_parada / n_replicacoes / 60,
+    }, index=paradas.index)
+    por_rota = pd.DataFrame({
+        'veiculo_id': np.asarray(veiculos, dtype=object),
+        'num_paradas': paradas_por_rota,
+        'prob_atraso': (paradas_atrasadas_por_rota > 0).mean(axis=0),
+        'paradas_atrasadas_media': paradas_atrasadas_por_rota.mean(axis=0),
+        'atraso_medio_min': atraso_por_rota.mean(axis=0) / 60,
+        'atraso_p95_min': np.percentile(atraso_por_rota, 95, axis=0) / 60,
+    })
+    logging.info(f"Risco de atraso: {n_replicacoes} replicações, {int((por_rota['prob_atraso'] > 0.5).sum())} rota(s) com probabilidade de atraso acima de 50%.")
+    return {'por_parada': por_parada, 'por_rota': por_rota, 'n_replicacoes': n_replicacoes}
+
+
+def balancear_carga(rotas_info, frota, matriz_distancias, matriz_tempos=None, demandas=None, capacidade_veiculo=None,
+                    max_iter=100, tolerancia_distancia=0.10, custos=None):
     """
-    Tenta balancear a carga movendo uma parada da rota mais longa para a mais curta.
-    Heurística muito simples, pode não ser ótima e requer dados adicionais.
+    Balanceia o tempo de operação entre as rotas. A cada iteração considera a rota mais longa e a mais curta
+    (por tempo de operação) e avalia, em bloco, mover cada parada da longa para cada posição da curta e trocar
+    cada par de paradas entre as duas, pelos deltas O(1) dos arcos removidos/inseridos em matriz_distancias e
+    matriz_tempos (ou velocidade média). Aplica o candidato que mais reduz o maior dos dois tempos, desde que a
+    distância das duas rotas não aumente mais que tolerancia_distancia e nenhuma rota que ganhe carga passe da
+    capacidade. Para quando nenhum candidato melhora ou após max_iter movimentos.
 
     Args:
         rotas_info (list): Lista de dicionários, como a gerada por `simular_cenario['rotas_info']`.
-        frota (pd.DataFrame): DataFrame da frota.
+        frota (pd.DataFrame): DataFrame da frota; 'Capacidade (Kg)' (ou 'Capacidade') por veículo, se houver,
+                              substitui capacidade_veiculo.
         matriz_distancias (np.ndarray): Matriz de distâncias.
         matriz_tempos (np.ndarray, optional): Matriz de tempos.
         demandas (dict or list/array, optional): Demandas por nó (índice=nó). Necessário para verificar capacidade.
-        capacidade_veiculo (int or float, optional): Capacidade padrão do veículo. Necessário se `demandas` for fornecido.
+        capacidade_veiculo (int or float, optional): Capacidade padrão do veículo.
+        max_iter (int): Número máximo de movimentos aplicados.
+        tolerancia_distancia (float): Aumento máximo de distância das duas rotas, como fração da distância delas.
+        custos (dict, optional): Parâmetros de custo para recalcular 'custo_estimado'. Usa DEFAULT_COSTS se None.
 
     Returns:
-        list: A lista `rotas_info` potencialmente modificada.
+        list: Cópia de `rotas_info`, na mesma ordem, com sequências e métricas de cada rota recalculadas.
     """
     if not rotas_info or len(rotas_info) < 2:
         logging.info("Balanceamento de carga requer pelo menos duas rotas.")
         return rotas_info # Nada a fazer
 
-    # Ordena rotas por tempo de operação (ou distância se tempo não disponível)
-    key_sort = 'tempo_operacao_h' if 'tempo_operacao_h' in rotas_info[0] else 'distancia_km'
-    rotas_ordenadas = sorted(rotas_info, key=lambda x: x.get(key_sort, 0))
-
-    rota_mais_curta = rotas_ordenadas[0]
-    rota_mais_longa = rotas_ordenadas[-1]
-
-    # Verifica se há paradas para mover na rota mais longa (além do depósito)
-    if rota_mais_longa.get('num_paradas', 0) <= 0:
-        logging.info("Rota mais longa não tem paradas para mover.")
-        return rotas_info
-
-    # Pega a última parada da rota mais longa (antes do depósito final)
-    indice_no_mover = rota_mais_longa['sequencia_indices'][-2]
-
-    # Verifica se o nó a mover é válido
-    if indice_no_mover == 0: # Não mover o depósito
-         logging.warning("Tentativa de mover depósito no balanceamento.")
-         return rotas_info
+    rotas = {info['veiculo_id']: [no for no in info['sequencia_indices'] if no != 0] for info in rotas_info}
+    # Tempo de serviço por parada a partir do total da rota (rotas_info não guarda o valor de cada parada)
+    servico = {}
+    for info in rotas_info:
+        if info.get('num_paradas', 0) > 0 and 'tempo_servico_h' in info:
+            servico.update(dict.fromkeys(rotas[info['veiculo_id']], info['tempo_servico_h'] * 3600 / info['num_paradas']))
 
     # Verifica capacidade se demandas e capacidade foram fornecidas
-    if demandas is not None and capacidade_veiculo is not None:
+    demanda, capacidades = None, None
+    if demandas is not None:
         try:
-            demanda_no = demandas[indice_no_mover]
-
-            # Calcula demanda atual da rota mais curta
-            demanda_atual_curta = sum(demandas[node] for node in rota_mais_curta['sequencia_indices'] if node != 0)
-
-            if demanda_atual_curta + demanda_no > capacidade_veiculo:
-                logging.info(f"Balanceamento: Mover nó {indice_no_mover} excede capacidade da rota {rota_mais_curta['veiculo_id']}.")
-                return rotas_info # Não move
-        except (KeyError, IndexError, TypeError) as e:
+            demanda = {no: float(demandas[no]) for nos in rotas.values() for no in nos}
+        except (KeyError, IndexError, TypeError, ValueError) as e:
             logging.warning(f"Erro ao verificar demandas/capacidade no balanceamento: {e}. Não foi possível balancear com restrição.")
-            # Prossegue sem garantia de capacidade se houve erro
-            pass
-
-
-    # Cria as novas sequências propostas
-    nova_seq_longa = rota_mais_longa['sequencia_indices'][:-2] + [0] # Remove a última parada e o depósito final, adiciona depósito
-    nova_seq_curta = rota_mais_curta['sequencia_indices'][:-1] + [indice_no_mover] + [0] # Insere antes do depósito final
-
-    # Recalcula distância/tempo das rotas modificadas
-    dist_orig_longa, tempo_orig_longa = calcular_distancia_tempo_rota(rota_mais_longa['sequencia_indices'], matriz_distancias, matriz_tempos)
-    dist_orig_curta, tempo_orig_curta = calcular_distancia_tempo_rota(rota_mais_curta['sequencia_indices'], matriz_distancias, matriz_tempos)
-
-    dist_nova_longa, tempo_nova_longa = calcular_distancia_tempo_rota(nova_seq_longa, matriz_distancias, matriz_tempos)
-    dist_nova_curta, tempo_nova_curta = calcular_distancia_tempo_rota(nova_seq_curta, matriz_distancias, matriz_tempos)
-
-    # Verifica se o movimento é válido e se melhora (ou não piora muito) o total
-    if np.inf not in [dist_nova_longa, tempo_nova_longa, dist_nova_curta, tempo_nova_curta]:
-        delta_dist = (dist_nova_longa + dist_nova_curta) - (dist_orig_longa + dist_orig_curta)
-        delta_tempo = (tempo_nova_longa + tempo_nova_curta) - (tempo_orig_longa + tempo_orig_curta)
-
-        # Critério de aceitação: não piorar muito a distância total (ex: tolerância de 10%)
-        TOLERANCIA_DIST = 0.10
-        dist_total_original = dist_orig_longa + dist_orig_curta
-        if delta_dist <= dist_total_original * TOLERANCIA_DIST:
-            logging.info(f"Balanceamento: Movendo nó {indice_no_mover} da rota {rota_mais_longa['veiculo_id']} para {rota_mais_curta['veiculo_id']}. Delta Dist: {delta_dist:.2f}m")
-
-            # Atualiza as informações das rotas modificadas na lista original
-            # Encontra os dicts originais e atualiza 'sequencia_indices' e outras métricas recalculadas
-            for i, info in enumerate(rotas_info):
-                if info['veiculo_id'] == rota_mais_longa['veiculo_id']:
-                    rotas_info[i]['sequencia_indices'] = nova_seq_longa
-                    # Recalcular e atualizar outras métricas (dist, tempo, custo) seria ideal aqui
-                    # Por simplicidade, apenas atualizamos a sequência por enquanto
-                    rotas_info[i]['num_paradas'] -= 1
-                    break
-            for i, info in enumerate(rotas_info):
-                 if info['veiculo_id'] == rota_mais_curta['veiculo_id']:
-                    rotas_info[i]['sequencia_indices'] = nova_seq_curta
-                    rotas_info[i]['num_paradas'] += 1
-                    break
-            # Idealmente, chamar simular_cenario novamente com as rotas atualizadas
-            return rotas_info # Retorna a lista modificada
-        else:
-            logging.info(f"Balanceamento: Mover nó {indice_no_mover} aumentaria muito a distância total ({delta_dist:.2f}m). Não movendo.")
+    if demanda is not None:
+        capacidades = dict.fromkeys(rotas, np.inf if capacidade_veiculo is None else float(capacidade_veiculo))
+        if isinstance(frota, pd.DataFrame) and not frota.empty:
+            id_col = 'ID Veículo' if 'ID Veículo' in frota.columns else 'Placa'
+            cap_col = 'Capacidade (Kg)' if 'Capacidade (Kg)' in frota.columns else 'Capacidade'
+            if id_col in frota.columns and cap_col in frota.columns:
+                cap_frota = pd.to_numeric(frota.drop_duplicates(id_col).set_index(id_col)[cap_col], errors='coerce').dropna()
+                capacidades.update({v: float(c) for v, c in cap_frota.items() if v in capacidades})
+
+    avaliador = AvaliadorIncremental(rotas, matriz_distancias, matriz_tempos, servico, demanda, custos)
+    d = matriz_distancias
+    if matriz_tempos is not None:
+        tempo = lambda a, b: matriz_tempos[a, b]
     else:
-        logging.warning("Balanceamento: Erro ao recalcular distância/tempo das rotas propostas.")
-
-    return rotas_info # Retorna original se não houve mudança
+        tempo = lambda a, b: d[a, b] / avaliador.velocidade_media_mps if avaliador.velocidade_media_mps > 0 else np.zeros(np.broadcast(a, b).shape)
+
+    veiculos = list(rotas)
+    movimentos = 0
+    while movimentos < max_iter:
+        operacao = {v: avaliador.tempo_viagem[v] + avaliador.tempo_servico[v] for v in veiculos}
+        longa = max(veiculos, key=operacao.get)
+        curta = min(veiculos, key=operacao.get)
+        rota_l, rota_c = np.asarray(avaliador.rotas[longa], dtype=np.int64), np.asarray(avaliador.rotas[curta], dtype=np.int64)
+        if longa == curta or len(rota_l) == 0:
+            break
+        limite_distancia = tolerancia_distancia * (avaliador.distancia[longa] + avaliador.distancia[curta])
+        serv_l = np.asarray([avaliador.servico[no] for no in rota_l])
+        serv_c = np.asarray([avaliador.servico[no] for no in rota_c])
+        carga_l, carga_c = avaliador.carga[longa], avaliador.carga[curta]
+        candidatos = []  # (maior tempo, delta distância, tipo, i, j)
+
+        # Mover a parada i da longa para a posição k da curta
+        ant_l = np.r_[0, rota_l[:-1]]
+        seg_l = np.r_[rota_l[1:], 0]
+        rem_dist = d[ant_l, rota_l] + d[rota_l, seg_l] - d[ant_l, seg_l]
+        rem_tempo = tempo(ant_l, rota_l) + tempo(rota_l, seg_l) - tempo(ant_l, seg_l) + serv_l
+        ant_c = np.r_[0, rota_c][None, :]
+        seg_c = np.r_[rota_c, 0][None, :]
+        u = rota_l[:, None]
+        ins_dist = d[ant_c, u] + d[u, seg_c] - d[ant_c, seg_c]
+        ins_tempo = tempo(ant_c, u) + tempo(u, seg_c) - tempo(ant_c, seg_c) + serv_l[:, None]
+        maior = np.maximum(operacao[longa] - rem_tempo[:, None], operacao[curta] + ins_tempo)
+        delta_dist = ins_dist - rem_dist[:, None]
+        viavel = delta_dist <= limite_distancia
+        if capacidades is not None:
+            demanda_l = np.asarray([avaliador.demanda[no] for no in rota_l])
+            viavel &= (carga_c + demanda_l <= capacidades[curta] + 1e-9)[:, None]
+        if viavel.any():
+            i, k = np.unravel_index(np.argmin(np.where(viavel, maior, np.inf)), maior.shape)
+            candidatos.append((maior[i, k], delta_dist[i, k], 'mover', int(i), int(k)))
+
+        # Trocar a parada i da longa com a parada j da curta
+        if len(rota_c):
+            ant_cj = np.r_[0, rota_c[:-1]][None, :]
+            seg_cj = np.r_[rota_c[1:], 0][None, :]
+            v = rota_c[None, :]
+            a, b = ant_l[:, None], seg_l[:, None]
+            dist_l = d[a, v] + d[v, b] - d[a, u] - d[u, b]
+            dist_c = d[ant_cj, u] + d[u, seg_cj] - d[ant_cj, v] - d[v, seg_cj]
+            tempo_l = tempo(a, v) + tempo(v, b) - tempo(a, u) - tempo(u, b) + serv_c[None, :] - serv_l[:, None]
+            tempo_c = tempo(ant_cj, u) + tempo(u, seg_cj) - tempo(ant_cj, v) - tempo(v, seg_cj) + serv_l[:, None] - serv_c[None, :]
+            maior = np.maximum(operacao[longa] + tempo_l, operacao[curta] + tempo_c)
+            delta_dist = dist_l + dist_c
+            viavel = delta_dist <= limite_distancia
+            if capacidades is not None:
+                diferenca = demanda_l[:, None] - np.asarray([avaliador.demanda[no] for no in rota_c])[None, :]
+                viavel &= ((diferenca <= 0) | (carga_c + diferenca <= capacidades[curta] + 1e-9))
+                viavel &= ((diferenca >= 0) | (carga_l - diferenca <= capacidades[longa] + 1e-9))
+            if viavel.any():
+                i, j = np.unravel_index(np.argmin(np.where(viavel, maior, np.inf)), maior.shape)
+                candidatos.append((maior[i, j], delta_dist[i, j], 'trocar', int(i), int(j)))
+
+        if not candidatos:
+            break
+        maior, delta, tipo, i, j = min(candidatos)
+        if maior >= operacao[longa] - 1e-9:
+            break
+        if tipo == 'mover':
+            avaliador.mover(int(rota_l[i]), curta, j)
+        else:
+            # u entra no lugar de v na curta; v entra no lugar de u na longa
+            avaliador.mover(int(rota_l[i]), curta, j)
+            avaliador.mover(int(rota_c[j]), longa, i)
+        movimentos += 1
+        logging.info(f"Balanceamento: {tipo} parada(s) entre {longa} e {curta}. Maior tempo de operação {operacao[longa] / 3600:.2f} h -> {maior / 3600:.2f} h, delta dist: {delta:.2f}m")
+
+    atualizadas = {info['veiculo_id']: info for info in avaliador.rotas_info()}
+    resultado = []
+    for info in rotas_info:
+        nova = dict(info)
+        nova.update(atualizadas.get(info['veiculo_id'], {
+            'num_paradas': 0, 'distancia_km': 0.0, 'tempo_viagem_h': 0.0, 'tempo_servico_h': 0.0,
+            'tempo_operacao_h': 0.0, 'custo_estimado': 0.0, 'sequencia_indices': [0, 0],
+        }))
+        if demanda is None:
+            nova.pop('carga', None)
+        resultado.append(nova)
+    logging.info(f"Balanceamento de carga: {movimentos} movimento(s) aplicado(s).")
+    return resultado
 
 
 # Exemplo de uso
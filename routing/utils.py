@@ -29,6 +29,8 @@ import logging
 import pandas as pd
 import numpy as np
 
+RAIO_TERRA_KM = 6371.0088
+
 def get_logger(name=__name__):
     """Retorna logger padronizado para o projeto."""
     logger = logging.getLogger(name)
@@ -36,6 +38,49 @@ def get_logger(name=__name__):
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     return logger
 
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Distância de grande círculo (km) entre coordenadas em graus. Aceita escalares ou arrays NumPy com
+    broadcasting (ex.: pedidos[:, None] x centroides[None, :]); coordenadas NaN resultam em NaN.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RAIO_TERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+COLUNAS_JANELA_MINUTOS = {'Janela Início': 'Janela_Inicio_Min', 'Janela Fim': 'Janela_Fim_Min'}
+
+def janela_em_minutos(valores):
+    """
+    Converte horários 'HH:MM' (ou 'HH:MM:SS') em minutos desde a meia-noite, de forma vetorizada.
+    Valores vazios ou inválidos viram NaN. Retorna um array float.
+    """
+    partes = pd.Series(valores, dtype=object).astype(str).str.extract(r'^\s*(\d{1,2}):(\d{2})(?::\d{2})?\s*$')
+    horas = pd.to_numeric(partes[0], errors='coerce').to_numpy(dtype=float)
+    minutos = pd.to_numeric(partes[1], errors='coerce').to_numpy(dtype=float)
+    total = horas * 60 + minutos
+    total[(horas > 23) | (minutos > 59)] = np.nan
+    return total
+
+def adicionar_janelas_em_minutos(df, padrao_inicio='05:00', padrao_fim='18:00'):
+    """
+    Retorna uma cópia do df com as colunas 'Janela_Inicio_Min' e 'Janela_Fim_Min' (minutos desde a
+    meia-noite de 'Janela Início' e 'Janela Fim'; colunas ausentes usam os padrões). O df original não é
+    alterado. Se o df já trouxer as colunas calculadas para as mesmas janelas (assinatura em df.attrs),
+    elas não são recalculadas.
+    """
+    padroes = {'Janela Início': padrao_inicio, 'Janela Fim': padrao_fim}
+    df = df.copy(deep=False)
+    df.attrs = dict(df.attrs)
+    for coluna, coluna_min in COLUNAS_JANELA_MINUTOS.items():
+        origem = df[coluna].to_numpy(dtype=object) if coluna in df.columns else np.full(len(df), padroes[coluna], dtype=object)
+        # Guarda só o hash das janelas de origem (attrs é copiado junto com o DataFrame)
+        assinatura = hash(tuple(origem.tolist()))
+        if coluna_min in df.columns and df.attrs.get(coluna_min) == assinatura:
+            continue
+        df[coluna_min] = janela_em_minutos(origem)
+        df.attrs[coluna_min] = assinatura
+    return df
+
 def validar_dataframe(df, colunas_obrigatorias=None, nome_df='DataFrame'):
     """Valida se o DataFrame possui as colunas obrigatórias e não está vazio."""
     if df is None or df.empty:
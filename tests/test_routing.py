@@ -1,7 +1,10 @@
+import os
+import tempfile
+import threading
 import unittest
 import numpy as np
 import pandas as pd
-from routing import pos_processamento, utils
+from routing import pos_processamento, utils, ortools_utils, cache_resultados, decomposicao, busca_local, busca_inter_rotas, plano_rotas, lns, pipeline, simulador, repositorio_cenarios
 
 class TestPosProcessamento(unittest.TestCase):
     def setUp(self):
@@ -23,12 +26,72 @@ class TestPosProcessamento(unittest.TestCase):
         sub_rotas = pos_processamento.split(self.rota, max_paradas_por_subrota=2)
         self.assertTrue(all(r[0] == 0 and r[-1] == 0 for r in sub_rotas))
 
+    def test_split_otimo(self):
+        demandas = [0, 5, 8, 3]
+        sub_rotas = pos_processamento.split(self.rota, matriz_distancias=self.dist_matrix, demandas=demandas, capacidade_maxima=11)
+        self.assertEqual([n for r in sub_rotas for n in r[1:-1]], [1, 2, 3])
+        self.assertTrue(all(sum(demandas[n] for n in r) <= 11 for r in sub_rotas))
+        # Opções: [1][2][3] = 20+30+40 = 90; [1][2,3] = 20+(15+30+20) = 85 (1+2 excede a capacidade)
+        self.assertEqual(sub_rotas, [[0, 1, 0], [0, 2, 3, 0]])
+
     def test_merge(self):
         rotas = [[0, 1, 0], [0, 2, 3, 0]]
         demandas = [0, 5, 8, 3]
         rotas_merged = pos_processamento.merge(rotas, self.dist_matrix, capacidade_maxima=20, demandas=demandas)
         self.assertTrue(isinstance(rotas_merged, list))
 
+    def test_checar_e_corrigir_excesso_carga(self):
+        frota = pd.DataFrame({'ID Veículo': ['A', 'B'], 'Capacidade (Kg)': [10, 10]})
+        rotas_df = pd.DataFrame({
+            'Veículo': ['A', 'A', 'A', 'B'], 'Sequencia': [1, 2, 3, 1], 'Node_Index_OR': [1, 2, 3, 4], 'Demanda': [6, 4, 3, 2]
+        })
+        corrigido, excesso = pos_processamento.checar_e_corrigir_excesso_carga(rotas_df, frota, limite_pct=100)
+        self.assertEqual(excesso, [])
+        # O pedido de 3 kg sai do veículo A (6 + 4 = 10) e vai para B, que tem espaço
+        self.assertEqual(corrigido['Veículo'].tolist(), ['A', 'A', 'B', 'B'])
+        self.assertEqual(corrigido.groupby('Veículo')['Demanda'].sum().to_dict(), {'A': 10, 'B': 5})
+        # Com matriz o pedido é inserido na melhor posição da rota de B (nós em linha: 0-4-3 fica 0-3-4)
+        pos = np.array([0, 1, 2, 3, 4])
+        matriz = np.abs(pos[:, None] - pos[None, :])
+        corrigido, _ = pos_processamento.checar_e_corrigir_excesso_carga(rotas_df, frota, limite_pct=100, matriz_distancias=matriz)
+        rota_b = corrigido[corrigido['Veículo'] == 'B'].sort_values('Sequencia')['Node_Index_OR'].tolist()
+        self.assertEqual(rota_b, [3, 4])
+
+    def test_balancear_carga(self):
+        frota = pd.DataFrame({'ID Veículo': ['A', 'B', 'C'], 'Capacidade (Kg)': [100, 100, 12]})
+        rotas_df = pd.DataFrame({
+            'Veículo': ['A'] * 6 + ['B'], 'Sequencia': [1, 2, 3, 4, 5, 6, 1], 'Node_Index_OR': range(1, 8),
+            'Demanda': [10, 10, 10, 10, 10, 10, 5]
+        })
+        balanceado = pos_processamento.balancear_carga_e_usar_todos_veiculos(rotas_df, frota, None)
+        cargas = balanceado.groupby('Veículo')['Demanda'].sum()
+        # C (capacidade 12) recebe um único pedido; A e B ficam equilibrados
+        self.assertEqual(cargas.to_dict(), {'A': 30, 'B': 25, 'C': 10})
+        self.assertEqual(sorted(balanceado['Node_Index_OR']), list(range(1, 8)))
+
+    def test_centroides_por_regiao(self):
+        pedidos = pd.DataFrame({'Região': ['Norte', 'norte', 'Sul'], 'Latitude': [1.0, 3.0, 5.0], 'Longitude': [2.0, 4.0, 6.0]})
+        self.assertEqual(pos_processamento.centroides_por_regiao(pedidos, minusculas=True), {'norte': (2.0, 3.0), 'sul': (5.0, 6.0)})
+        self.assertEqual(pos_processamento.centroides_por_regiao(pedidos.drop(columns='Latitude')), {})
+
+    def test_realocar_pedidos_restritos_ordem_dos_candidatos(self):
+        rotas_df = pd.DataFrame({
+            'Veículo': ['V1', 'V3', 'V2', 'V1', 'V1', 'V3'], 'Sequencia': [1, 1, 1, 2, 3, 2], 'Node_Index_OR': range(1, 7),
+            'Demanda': [1] * 6, 'Região': ['Norte'] * 6, 'Latitude': [0.0] * 6, 'Longitude': [0.0] * 6,
+            'Alocacao_Restrita': [True, False, False, False, False, True],
+        })
+        pedidos = rotas_df[['Região', 'Latitude', 'Longitude']].copy()
+        frota = pd.DataFrame({'ID Veículo': ['V1', 'V2', 'V3'], 'Capacidade (Kg)': [100] * 3})
+        realocado, n = pos_processamento.realocar_pedidos_restritos(rotas_df, frota, pedidos)
+        # Depois que o pedido 0 vai para V3, V1 passa a aparecer por último: o pedido 5 vai para V2
+        self.assertEqual(n, 2)
+        self.assertEqual(realocado.sort_index()['Veículo'].tolist(), ['V3', 'V3', 'V2', 'V1', 'V1', 'V2'])
+        # As entradas não são alteradas e, sem nada a realocar, o próprio rotas_df é devolvido
+        self.assertNotIn('Janela Início', frota.columns)
+        self.assertNotIn('Janela Início', rotas_df.columns)
+        sem_restritos = rotas_df.assign(Alocacao_Restrita=False)
+        self.assertIs(pos_processamento.realocar_pedidos_restritos(sem_restritos, frota, pedidos)[0], sem_restritos)
+
 class TestUtils(unittest.TestCase):
     def test_validar_dataframe(self):
         df = pd.DataFrame({'A': [1], 'B': [2]})
@@ -44,5 +107,435 @@ class TestUtils(unittest.TestCase):
         ok, msg = utils.validar_matriz(mat, tamanho_esperado=4)
         self.assertFalse(ok)
 
+    def test_haversine_km(self):
+        # 1 grau de latitude ~ 111,2 km; broadcasting pedidos x centroides
+        self.assertAlmostEqual(float(utils.haversine_km(0, 0, 1, 0)), 111.19, places=1)
+        dist = utils.haversine_km(np.array([[-23.5], [-23.6]]), np.array([[-46.6], [-46.6]]), np.array([[-23.5, np.nan]]), np.array([[-46.6, -46.6]]))
+        self.assertEqual(dist.shape, (2, 2))
+        self.assertAlmostEqual(dist[0, 0], 0.0)
+        self.assertTrue(np.isnan(dist[:, 1]).all())
+
+    def test_janelas_em_minutos(self):
+        np.testing.assert_array_equal(utils.janela_em_minutos(['05:00', '7:30', '18:00:00', '25:00', '']), [300, 450, 1080, np.nan, np.nan])
+        df = pd.DataFrame({'Janela Início': ['06:00', '08:15']})
+        janelas = utils.adicionar_janelas_em_minutos(df)
+        self.assertEqual(janelas['Janela_Inicio_Min'].tolist(), [360, 495])
+        self.assertEqual(janelas['Janela_Fim_Min'].tolist(), [1080, 1080])
+        self.assertEqual(list(df.columns), ['Janela Início'])
+        # O cache é invalidado quando a janela de origem muda
+        janelas.loc[0, 'Janela Início'] = '09:00'
+        janelas = utils.adicionar_janelas_em_minutos(janelas)
+        self.assertEqual(janelas['Janela_Inicio_Min'].tolist(), [540, 495])
+
+class TestOrtoolsUtils(unittest.TestCase):
+    def test_classes_de_veiculos(self):
+        frota = pd.DataFrame({
+            'Placa': ['A1', 'B2', 'C3', 'D4'],
+            'Regiões Preferidas': ['Mooca, Osasco', None, 'osasco,mooca', ''],
+        })
+        classes = ortools_utils.agrupar_veiculos_em_classes(frota, [3000, 2500, 3000, 2500])
+        self.assertEqual(classes[0], classes[2])
+        self.assertEqual(classes[1], classes[3])
+        self.assertNotEqual(classes[0], classes[1])
+        ordem = ortools_utils.ordenar_e_limitar_frota_por_classe(classes, n_pedidos=1)
+        self.assertEqual(ordem.tolist(), [0, 1])
+
+    def test_mapear_rotas_para_placas(self):
+        # Classe 0 = veículos 0 e 1; o veículo 1 (mais carregado) recebe a primeira placa da classe
+        placas = ortools_utils.mapear_rotas_para_placas([0, 0, 1], [10, 50, 5], ['A1', 'C3', 'B2'])
+        self.assertEqual(placas, ['C3', 'A1', 'B2'])
+
+    def test_calcular_cargas_e_custos(self):
+        dist = np.array([
+            [0, 10, 15, 20],
+            [10, 0, 35, 25],
+            [15, 35, 0, 30],
+            [20, 25, 30, 0]
+        ])
+        veiculo = np.array([0, 0, 2], dtype=np.int32)
+        sequencia = np.array([1, 2, 1], dtype=np.int32)
+        no = np.array([1, 3, 2], dtype=np.int32)
+        resumo = ortools_utils.calcular_cargas_e_custos(veiculo, sequencia, no, np.array([0, 5, 8, 3]), dist, n_veiculos=3)
+        self.assertEqual(resumo['carga_acumulada'].tolist(), [0, 5, 0])
+        self.assertEqual(resumo['distancia_por_veiculo'].tolist(), [55, 0, 30])
+        self.assertEqual(resumo['carga_por_veiculo'].tolist(), [8, 0, 8])
+
+    def test_parar_sem_melhoria(self):
+        self.assertIsNone(ortools_utils.parar_sem_melhoria(0))
+        criterio = ortools_utils.parar_sem_melhoria(10)
+        self.assertFalse(criterio({'tempo_sem_melhoria_s': 3.0}))
+        self.assertTrue(criterio({'tempo_sem_melhoria_s': 10.5}))
+
+class TestCacheResultados(unittest.TestCase):
+    def test_executar_com_cache(self):
+        chamadas = []
+        def solver_fake(pedidos, frota, matriz, **kwargs):
+            chamadas.append(kwargs)
+            return pd.DataFrame({'Veículo': ['A', 'A'], 'Demanda': [1, 2]})
+        pedidos = pd.DataFrame({'Peso dos Itens': [1, 2]})
+        frota = pd.DataFrame({'Placa': ['A'], 'Capacidade (Kg)': [10]})
+        matriz = np.zeros((3, 3), dtype=int)
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, 'cache.db')
+            _, _, hit = cache_resultados.executar_com_cache(solver_fake, pedidos, frota, matriz, db_path=db, tempo_limite_s=5, progress_callback=print)
+            self.assertFalse(hit)
+            rotas, metricas, hit = cache_resultados.executar_com_cache(solver_fake, pedidos, frota, matriz, db_path=db, tempo_limite_s=5)
+            self.assertTrue(hit)
+            pd.testing.assert_frame_equal(rotas, solver_fake(pedidos, frota, matriz))
+            chamadas.pop()
+            self.assertEqual(metricas['n_paradas'], 2)
+            self.assertEqual(len(chamadas), 1)
+            cache_resultados.executar_com_cache(solver_fake, pedidos, frota, matriz, db_path=db, tempo_limite_s=10)
+            cache_resultados.executar_com_cache(solver_fake, pedidos, frota, matriz, db_path=db, usar_cache=False, tempo_limite_s=5)
+            self.assertEqual(len(chamadas), 3)
+
+    def test_executar_com_cache_nao_grava_busca_interrompida(self):
+        def solver_interrompido(pedidos, frota, matriz, **kwargs):
+            rotas_df = pd.DataFrame({'Veículo': ['A'], 'Demanda': [1]})
+            rotas_df.attrs['busca_interrompida'] = True
+            return rotas_df
+        pedidos = pd.DataFrame({'Peso dos Itens': [1]})
+        frota = pd.DataFrame({'Placa': ['A'], 'Capacidade (Kg)': [10]})
+        matriz = np.zeros((2, 2), dtype=int)
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, 'cache.db')
+            cache_resultados.executar_com_cache(solver_interrompido, pedidos, frota, matriz, db_path=db)
+            _, _, hit = cache_resultados.executar_com_cache(solver_interrompido, pedidos, frota, matriz, db_path=db)
+            self.assertFalse(hit)
+            # Cancelamento via Event: cancelar não entra na chave, então a execução seguinte não pode ser um acerto
+            def solver_fake(pedidos, frota, matriz, **kwargs):
+                return pd.DataFrame({'Veículo': ['A'], 'Demanda': [1]})
+            cancelar = threading.Event()
+            cancelar.set()
+            cache_resultados.executar_com_cache(solver_fake, pedidos, frota, matriz, db_path=db, cancelar=cancelar)
+            _, _, hit = cache_resultados.executar_com_cache(solver_fake, pedidos, frota, matriz, db_path=db)
+            self.assertFalse(hit)
+
+def _solver_primeiro_encaixe(pedidos, frota, matriz_distancias, **kwargs):
+    """Solver de teste: encaixa os pedidos em ordem no primeiro veículo com espaço; sem solução se algum não couber."""
+    cargas = np.zeros(len(frota))
+    linhas = []
+    for i, peso in enumerate(pedidos['Peso dos Itens']):
+        livres = np.flatnonzero(cargas + peso <= frota['Capacidade (Kg)'].to_numpy())
+        if not len(livres):
+            return pd.DataFrame()
+        cargas[livres[0]] += peso
+        linhas.append({'Veículo': frota['ID Veículo'].iloc[livres[0]], 'Sequencia': i + 1, 'Pedido_Index_DF': i, 'Node_Index_OR': i + 1})
+    return pd.DataFrame(linhas)
+
+class TestDecomposicao(unittest.TestCase):
+    def test_particionar_por_varredura(self):
+        rng = np.random.default_rng(1)
+        pedidos = pd.DataFrame({
+            'Latitude': rng.uniform(-1, 1, 100), 'Longitude': rng.uniform(-1, 1, 100), 'Peso dos Itens': rng.integers(1, 10, 100)
+        })
+        setores, _ = decomposicao.particionar_por_varredura(pedidos, max_pedidos_por_subproblema=30, coord_deposito=(0, 0))
+        contagem = np.bincount(setores)
+        self.assertEqual(contagem.sum(), 100)
+        self.assertTrue((contagem <= 30).all())
+        setor_veiculo = decomposicao.particionar_frota(np.full(10, 100), np.bincount(setores, weights=pedidos['Peso dos Itens']))
+        self.assertEqual(set(setor_veiculo.tolist()), set(range(len(contagem))))
+
+    def test_custo_rotas_df(self):
+        dist = np.array([
+            [0, 10, 15, 20],
+            [10, 0, 35, 25],
+            [15, 35, 0, 30],
+            [20, 25, 30, 0]
+        ])
+        rotas = pd.DataFrame({'Veículo': ['A', 'A', 'B'], 'Sequencia': [2, 1, 1], 'Node_Index_OR': [3, 1, 2]})
+        self.assertEqual(decomposicao.custo_rotas_df(rotas, dist), 10 + 25 + 20 + 15 + 15)
+
+    def test_setor_inviavel_fundido_com_vizinho(self):
+        pedidos = pd.DataFrame({'Peso dos Itens': [30] * 4 + [5] * 4 + [10] * 2})
+        frota = pd.DataFrame({'ID Veículo': ['A', 'B', 'C'], 'Capacidade (Kg)': [100, 60, 20]})
+        matriz = np.arange(11)[:, None] + np.arange(11)[None, :]
+        setores = np.array([0] * 4 + [1] * 4 + [2] * 2)
+        # O setor 0 (120 kg) só tem o veículo A (100 kg): é re-resolvido junto com o setor 1
+        rotas = decomposicao._resolver_setores(_solver_primeiro_encaixe, pedidos, frota, matriz, setores,
+                                               np.array([0, 1, 2]), 1, {})
+        self.assertEqual(sorted(rotas['Pedido_Index_DF']), list(range(10)))
+        self.assertEqual(rotas.groupby('Setor')['Pedido_Index_DF'].apply(sorted).tolist(), [list(range(8)), [8, 9]])
+        self.assertTrue((rotas['Node_Index_OR'] == rotas['Pedido_Index_DF'] + 1).all())
+
+class TestBuscaLocal(unittest.TestCase):
+    def test_dois_opt_delta(self):
+        rng = np.random.default_rng(0)
+        coords = rng.uniform(0, 100, (41, 2))
+        dist = np.sqrt(((coords[:, None] - coords[None]) ** 2).sum(-1))
+        assimetrica = (dist * rng.uniform(1, 1.3, dist.shape)).round()
+        rota = [0] + rng.permutation(np.arange(1, 41)).tolist() + [0]
+        for matriz in (dist.round(), assimetrica):
+            nova, ganho = busca_local.dois_opt(rota, matriz, k_vizinhos=8)
+            self.assertEqual(sorted(nova), sorted(rota))
+            self.assertEqual((nova[0], nova[-1]), (0, 0))
+            custo_antes = pos_processamento.calcular_distancia_rota(rota, matriz)
+            custo_depois = pos_processamento.calcular_distancia_rota(nova, matriz)
+            self.assertAlmostEqual(custo_antes - custo_depois, ganho)
+            self.assertGreater(ganho, 0)
+
+    def test_or_opt_e_tres_opt_delta(self):
+        rng = np.random.default_rng(1)
+        coords = rng.uniform(0, 100, (21, 2))
+        matriz = (np.sqrt(((coords[:, None] - coords[None]) ** 2).sum(-1)) * rng.uniform(1, 1.3, (21, 21))).round()
+        rota = [0] + rng.permutation(np.arange(1, 21)).tolist() + [0]
+        custo_antes = pos_processamento.calcular_distancia_rota(rota, matriz)
+        for operador in (busca_local.or_opt, busca_local.tres_opt):
+            for modo in ('first', 'best'):
+                nova, ganho = operador(rota, matriz, modo=modo)
+                self.assertEqual(sorted(nova), sorted(rota))
+                self.assertAlmostEqual(custo_antes - pos_processamento.calcular_distancia_rota(nova, matriz), ganho)
+                self.assertGreater(ganho, 0)
+
+    def test_otimizar_rotas_df(self):
+        rotas = pd.DataFrame({'Veículo': ['A'] * 3, 'Sequencia': [1, 2, 3], 'Node_Index_OR': [3, 1, 2], 'Demanda': [5, 1, 2]})
+        dist = np.abs(np.subtract.outer(np.arange(4), np.arange(4)))
+        resultado = busca_local.otimizar_rotas_df(rotas, dist)
+        self.assertIn(resultado['Node_Index_OR'].tolist(), ([1, 2, 3], [3, 2, 1]))
+        self.assertEqual(resultado['Sequencia'].tolist(), [1, 2, 3])
+
+    def test_otimizar_rotas_em_paralelo(self):
+        rng = np.random.default_rng(2)
+        coords = rng.uniform(0, 100, (31, 2))
+        matriz = np.sqrt(((coords[:, None] - coords[None]) ** 2).sum(-1)).round()
+        rotas = [[0] + parte.tolist() + [0] for parte in np.array_split(rng.permutation(np.arange(1, 31)), 3)] + [[0, 0]]
+        sequencial, stats_seq = busca_local.otimizar_rotas(rotas, matriz, n_processos=1)
+        paralelo, stats_par = busca_local.otimizar_rotas(rotas, matriz, n_processos=2)
+        self.assertEqual(paralelo, sequencial)
+        self.assertEqual(paralelo[-1], [0, 0])
+        for rota, nova, stats in zip(rotas, paralelo, stats_par):
+            self.assertEqual(sorted(nova), sorted(rota))
+            self.assertAlmostEqual(stats['custo_inicial'], pos_processamento.calcular_distancia_rota(rota, matriz))
+            self.assertAlmostEqual(stats['custo_final'], pos_processamento.calcular_distancia_rota(nova, matriz))
+        self.assertGreater(sum(s['ganho'] for s in stats_par), 0)
+
+class TestBuscaInterRotas(unittest.TestCase):
+    def setUp(self):
+        # Depósito na origem, pedidos 1-3 à esquerda e 4-6 à direita, trocados entre os veículos
+        x = np.array([0, -1, -2, -3, 1, 2, 3])
+        self.dist = np.abs(np.subtract.outer(x, x)) * 10
+        self.rotas = pd.DataFrame({
+            'Veículo': ['A', 'A', 'A', 'B', 'B', 'B'],
+            'Sequencia': [1, 2, 3, 1, 2, 3],
+            'Node_Index_OR': [1, 4, 2, 5, 3, 6],
+            'Demanda': [1, 1, 1, 1, 1, 1],
+            'Carga_Acumulada': [0, 1, 2, 0, 1, 2],
+        })
+        self.frota = pd.DataFrame({'Placa': ['A', 'B'], 'Capacidade (Kg)': [3, 3]})
+
+    def test_plano_rotas(self):
+        plano = plano_rotas.PlanoRotas.de_rotas_df(self.rotas, self.dist, self.frota)
+        self.assertEqual(plano.cargas.tolist(), [3, 3])
+        self.assertEqual(plano.custo_total(), decomposicao.custo_rotas_df(self.rotas, self.dist))
+        self.assertEqual(plano.rota_do_no[[1, 5]].tolist(), [0, 1])
+
+    def test_melhorar_rotas_df(self):
+        resultado = busca_inter_rotas.melhorar_rotas_df(self.rotas, self.dist, frota=self.frota)
+        self.assertEqual(decomposicao.custo_rotas_df(resultado, self.dist), 120)
+        self.assertTrue((resultado.groupby('Veículo')['Demanda'].sum() <= 3).all())
+        conjuntos = sorted(sorted(s) for s in resultado.groupby('Veículo')['Node_Index_OR'].apply(list))
+        self.assertEqual(conjuntos, [[1, 2, 3], [4, 5, 6]])
+        self.assertEqual(resultado['Carga_Acumulada'].tolist(), [0, 1, 2, 0, 1, 2])
+
+    def test_lns(self):
+        plano = plano_rotas.PlanoRotas.de_rotas_df(self.rotas, self.dist, self.frota)
+        melhor, stats = lns.lns(plano, tempo_limite_s=5, max_iter=50, semente=0)
+        self.assertEqual(stats['custo_final'], 120)
+        self.assertEqual(melhor.custo_total(), 120)
+        self.assertTrue((melhor.cargas <= melhor.capacidades).all())
+        self.assertEqual(plano.custo_total(), stats['custo_inicial'])
+
+class TestPipeline(unittest.TestCase):
+    def test_pipeline_pos_processamento(self):
+        pos = np.array([0, 1, 2, 3, 4])
+        matriz = np.abs(pos[:, None] - pos[None, :])
+        frota = pd.DataFrame({'ID Veículo': ['A', 'B'], 'Capacidade (Kg)': [10, 10]})
+        rotas_df = pd.DataFrame({
+            'Veículo': ['A', 'A', 'A', 'B'], 'Sequencia': [1, 2, 3, 1], 'Node_Index_OR': [1, 2, 3, 4], 'Demanda': [6, 4, 3, 2]
+        })
+        checar = pos_processamento.checar_e_corrigir_excesso_carga
+        etapas = [
+            pipeline.Etapa('checar', lambda rotas_df, frota: checar(rotas_df, frota, limite_pct=100),
+                           entradas=('rotas_df', 'frota'), saidas=('rotas_df', 'excesso_final')),
+            pipeline.Etapa('desligada', lambda rotas_df: rotas_df, ativa=False),
+        ]
+        p = pipeline.PipelinePosProcessamento(etapas)
+        contexto, relatorio = p.executar({'rotas_df': rotas_df, 'frota': frota, 'matriz_distancias': matriz})
+        self.assertEqual(relatorio['Status'].tolist(), ['executada', 'pulada'])
+        self.assertEqual(contexto['excesso_final'], [])
+        self.assertEqual(contexto['rotas_df'].groupby('Veículo')['Demanda'].sum().to_dict(), {'A': 10, 'B': 5})
+        self.assertEqual(relatorio.loc[0, 'Distância antes'], 14)
+        self.assertEqual(relatorio.loc[0, 'Δ Distância'], -2)
+        # Rodando sobre o resultado, a etapa não altera nada; na terceira vez é pulada pelas mesmas entradas
+        _, relatorio = p.executar(contexto)
+        self.assertEqual(relatorio.loc[0, 'Status'], 'sem alteração')
+        _, relatorio = p.executar(contexto)
+        self.assertEqual(relatorio.loc[0, 'Status'], 'pulada')
+        # A memória compartilhada vale para um pipeline novo (como a página faz a cada execução)
+        memoria = {}
+        pipeline.PipelinePosProcessamento(etapas, memoria=memoria).executar(contexto)
+        _, relatorio = pipeline.PipelinePosProcessamento(etapas, memoria=memoria).executar(contexto)
+        self.assertEqual(relatorio.loc[0, 'Status'], 'pulada')
+        self.assertNotIn('_plano', contexto)
+
+    def test_pipeline_etapa_que_altera_entrada_em_place(self):
+        pos = np.array([0, 1, 2])
+        matriz = np.abs(pos[:, None] - pos[None, :])
+        frota = pd.DataFrame({'ID Veículo': ['A', 'B'], 'Capacidade (Kg)': [10, 10]})
+        rotas_df = pd.DataFrame({'Veículo': ['A', 'B'], 'Sequencia': [1, 1], 'Node_Index_OR': [1, 2], 'Demanda': [7, 4]})
+
+        def reduzir_capacidade(frota):
+            frota['Capacidade (Kg)'] = 5
+            return 0
+        etapas = [
+            pipeline.Etapa('reduzir', reduzir_capacidade, entradas=('frota',), saidas=('n',)),
+            pipeline.Etapa('checar', lambda rotas_df, frota: pos_processamento.checar_e_corrigir_excesso_carga(rotas_df, frota, limite_pct=100),
+                           entradas=('rotas_df', 'frota'), saidas=('rotas_df', 'excesso_final'), condicao=pipeline._com_excesso),
+        ]
+        _, relatorio = pipeline.PipelinePosProcessamento(etapas).executar(
+            {'rotas_df': rotas_df, 'frota': frota.copy(), 'matriz_distancias': matriz})
+        # A alteração em place da frota conta como alteração e invalida o plano usado pela condição da checagem
+        self.assertEqual(relatorio['Status'].tolist(), ['executada', 'executada'])
+
+    def test_etapas_padrao_propagam_regiao_antes_da_restricao(self):
+        pedidos = pd.DataFrame({'Região': ['Norte', 'Sul', 'Leste', 'Norte', 'Sul'], 'Latitude': [0.0, 1.0, 2.0, 0.0, 1.0],
+                                'Longitude': [0.0, 1.0, 2.0, 0.0, 1.0]})
+        rotas_df = pd.DataFrame({'Veículo': ['A'] * 5, 'Sequencia': range(1, 6), 'Pedido_Index_DF': range(5), 'Demanda': [1] * 5})
+        com_regiao = pipeline.adicionar_regiao_e_coordenadas(rotas_df, pedidos)
+        self.assertEqual(com_regiao['Região'].tolist(), pedidos['Região'].tolist())
+        self.assertIs(pipeline.adicionar_regiao_e_coordenadas(com_regiao, pedidos), com_regiao)
+        frota = pd.DataFrame({'ID Veículo': ['A'], 'Capacidade (Kg)': [10], 'Regiões Preferidas': ['Norte, Sul, Leste']})
+        contexto, relatorio = pipeline.PipelinePosProcessamento(pipeline.etapas_padrao(balanceamento_auto=False)).executar(
+            {'rotas_df': rotas_df, 'frota': frota, 'pedidos': pedidos, 'raio_km': 500})
+        status = relatorio.set_index('Etapa')['Status']
+        self.assertEqual(status['Restringir regiões por veículo'], 'executada')
+        self.assertEqual(contexto['rotas_df']['Alocacao_Restrita'].fillna(False).tolist(), [False, False, True, False, False])
+
+class TestSimulador(unittest.TestCase):
+    def setUp(self):
+        self.pedidos = pd.DataFrame({
+            'Veículo': ['V1', 'V2', 'V1', 'V2'], 'node_index': [3, 2, 1, 4],
+            'tempo_chegada': [36000, 33000, 30000, 39000], 'tempo_saida': [36900, 33900, 30900, 39900],
+        })
+        self.dist = np.array([
+            [0, 10000, 12000, 15000, 18000],
+            [10000, 0, 5000, 7000, 9000],
+            [12000, 5000, 0, 4000, 10000],
+            [15000, 7000, 4000, 0, 6000],
+            [18000, 9000, 10000, 6000, 0],
+        ])
+
+    def test_simular_cenario(self):
+        custos = {'cost_per_km': 1.0, 'cost_per_hour': 0.0, 'fixed_cost_per_vehicle': 10.0}
+        metricas = simulador.simular_cenario(self.pedidos, None, self.dist, custos=custos)
+        self.assertEqual([r['sequencia_indices'] for r in metricas['rotas_info']], [[0, 1, 3, 0], [0, 2, 4, 0]])
+        self.assertEqual([r['distancia_km'] for r in metricas['rotas_info']], [32, 40])
+        self.assertAlmostEqual(metricas['distancia_total_km'], 72)
+        self.assertAlmostEqual(metricas['tempo_servico_total_h'], 1)
+        self.assertAlmostEqual(metricas['custo_total'], 92)
+        # Rota com nó fora da matriz é ignorada, mas o veículo continua contado
+        pedidos = self.pedidos.assign(node_index=[3, 2, 1, 9])
+        metricas = simulador.simular_cenario(pedidos, None, self.dist, custos=custos)
+        self.assertEqual([r['veiculo_id'] for r in metricas['rotas_info']], ['V1'])
+        self.assertEqual(metricas['veiculos_usados'], 2)
+
+    def test_simular_risco_atraso(self):
+        # V1 chega ao nó 1 às 8:20 e ao nó 3 às 8:45:30 (15 min de serviço + 7 km a 40 km/h)
+        pedidos = self.pedidos.assign(**{'Janela Fim': ['08:40', '18:00', '18:00', '18:00']})
+        nominal = simulador.simular_risco_atraso(pedidos, self.dist, n_replicacoes=10, sigma_viagem=0, sigma_servico=0)
+        self.assertEqual(nominal['por_parada'].loc[0, 'Prob_Atraso'], 1)
+        self.assertAlmostEqual(nominal['por_parada'].loc[0, 'Atraso_Medio_Min'], 5.5)
+        self.assertEqual(nominal['por_rota']['prob_atraso'].tolist(), [1, 0])
+        risco = simulador.simular_risco_atraso(pedidos, self.dist, n_replicacoes=400, tamanho_lote=100, semente=3)
+        self.assertTrue(0 < risco['por_parada'].loc[0, 'Prob_Atraso'] < 1)
+        self.assertEqual(risco['por_parada'].loc[[1, 2, 3], 'Prob_Atraso'].tolist(), [0, 0, 0])
+        paralelo = simulador.simular_risco_atraso(pedidos, self.dist, n_replicacoes=400, tamanho_lote=100, semente=3, n_processos=2)
+        pd.testing.assert_frame_equal(paralelo['por_parada'], risco['por_parada'])
+
+    def test_varrer_custos(self):
+        grade = simulador.grade_custos(cost_per_km=[1.0, 2.0], default_service_time_min=[10, 20])
+        self.assertEqual(len(grade), 4)
+        pedidos = self.pedidos.drop(columns='tempo_saida')
+        resultado = simulador.varrer_custos(pedidos, self.dist, grade)
+        custo_total = resultado[resultado['kpi'] == 'custo_total'].set_index('cenario')['valor']
+        for cenario, custos in grade.iterrows():
+            esperado = simulador.simular_cenario(pedidos, None, self.dist, custos=custos.to_dict())['custo_total']
+            self.assertAlmostEqual(custo_total[cenario], esperado)
+
+    def test_avaliador_incremental(self):
+        pedidos = self.pedidos.assign(Demanda=[15, 20, 10, 25])
+        avaliador = simulador.AvaliadorIncremental.de_pedidos(pedidos, self.dist)
+        inicial = simulador.simular_cenario(pedidos, None, self.dist)
+        for chave, valor in avaliador.totais().items():
+            self.assertAlmostEqual(valor, inicial[chave])
+        # A menor inserção do nó 4 em V1 é entre 1 e 3; aqui ele vai para o fim (0-1-3-4-0) e V2 fica 0-2-0
+        self.assertEqual(avaliador.melhor_posicao(4, 'V1'), 1)
+        previsto = avaliador.avaliar_movimento(4, 'V1', posicao=2)
+        self.assertEqual(avaliador.rotas['V1'], [1, 3])
+        totais = avaliador.mover(4, 'V1', posicao=2)
+        self.assertEqual(totais, previsto)
+        self.assertEqual(avaliador.rotas, {'V1': [1, 3, 4], 'V2': [2]})
+        self.assertAlmostEqual(totais['distancia_total_km'], 65)
+        self.assertEqual(avaliador.carga, {'V1': 50, 'V2': 20})
+        novo = pedidos.assign(Veículo=['V1', 'V2', 'V1', 'V1'], tempo_chegada=[36000, 33000, 30000, 40000],
+                              tempo_saida=[36900, 33900, 30900, 40900])
+        for chave, valor in simulador.simular_cenario(novo, None, self.dist).items():
+            if chave != 'rotas_info':
+                self.assertAlmostEqual(totais[chave], valor)
+        # Esvaziar uma rota também tira o custo fixo do veículo
+        self.assertEqual(avaliador.mover(2, 'V1')['veiculos_usados'], 1)
+        # Rota com índice fora da matriz: fora das rotas editáveis, mas o veículo conta como em simular_cenario
+        invalida = pd.concat([self.pedidos, pd.DataFrame({'Veículo': ['V3'], 'node_index': [99], 'tempo_chegada': [30000]})])
+        avaliador = simulador.AvaliadorIncremental.de_pedidos(invalida, self.dist)
+        self.assertNotIn('V3', avaliador.rotas)
+        esperado = simulador.simular_cenario(invalida, None, self.dist)
+        for chave, valor in avaliador.totais().items():
+            self.assertAlmostEqual(valor, esperado[chave])
+
+    def test_balancear_carga_simulador(self):
+        rotas_info = simulador.simular_cenario(self.pedidos, None, self.dist)['rotas_info']
+        # Trocar 1 e 2 encurta a rota mais longa (V2, 40 km) e reduz a distância total (72 -> 68 km)
+        balanceadas = simulador.balancear_carga(rotas_info, None, self.dist)
+        self.assertEqual([r['sequencia_indices'] for r in balanceadas], [[0, 2, 3, 0], [0, 1, 4, 0]])
+        self.assertEqual([r['distancia_km'] for r in balanceadas], [31, 37])
+        self.assertEqual(rotas_info[0]['sequencia_indices'], [0, 1, 3, 0])
+        # Sem folga de capacidade nenhum movimento é aceito
+        demandas = {0: 0, 1: 10, 2: 20, 3: 15, 4: 25}
+        presas = simulador.balancear_carga(rotas_info, None, self.dist, demandas=demandas, capacidade_veiculo=25)
+        self.assertEqual([r['sequencia_indices'] for r in presas], [[0, 1, 3, 0], [0, 2, 4, 0]])
+
+class TestRepositorioCenarios(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.diretorio = tmp.name
+        self.rotas = pd.DataFrame({'Veículo': ['V1', 'V1', 'V2'], 'Node_Index_OR': [1, 3, 2], 'Demanda': [10.5, 15.0, 20.0],
+                                   'Sequência': [[0, 1], [0, 1, 3], None], 7: pd.to_datetime(['2024-05-01'] * 3)},
+                                  index=pd.Index([4, 8, 9], name='Pedido'))
+
+    def test_salvar_carregar_comparar(self):
+        matriz = np.arange(16, dtype=float).reshape(4, 4)
+        base = repositorio_cenarios.salvar_cenario(
+            self.rotas, metricas={'distancia_total_real_m': 1000, 'qtd_veiculos_utilizados': 2, 'status': 'ok'},
+            parametros={'lat_partida': -23.5}, matriz_distancias=matriz, tipo='VRP',
+            data='2024-05-01 10:00', diretorio=self.diretorio)
+        outro = repositorio_cenarios.salvar_cenario(
+            self.rotas.head(2), metricas={'distancia_total_real_m': 800, 'qtd_veiculos_utilizados': 1},
+            data='2024-05-02 10:00', diretorio=self.diretorio)
+        self.assertEqual(len(os.listdir(self.diretorio)), 2)
+        cenario = repositorio_cenarios.carregar_cenario(base, diretorio=self.diretorio)
+        # Mesmo DataFrame de volta: tipos das colunas e dos rótulos, listas e índice (sem pickle)
+        pd.testing.assert_frame_equal(cenario['rotas'], self.rotas, check_column_type=True)
+        self.assertEqual(cenario['metricas'], {'distancia_total_real_m': 1000, 'qtd_veiculos_utilizados': 2})
+        self.assertEqual(cenario['parametros'], {'lat_partida': -23.5})
+        self.assertEqual(cenario['impressao_matriz'], cache_resultados.impressao_digital_matriz(matriz))
+        comparacao = repositorio_cenarios.comparar_cenarios(referencia=base, diretorio=self.diretorio)
+        self.assertEqual(list(comparacao.index), [outro, base])
+        self.assertAlmostEqual(comparacao.loc[outro, 'Δ% distancia_total_real_m'], -20)
+        self.assertEqual(len(repositorio_cenarios.comparar_cenarios(inicio='2024-05-02', diretorio=self.diretorio)), 1)
+        self.assertTrue(repositorio_cenarios.remover_cenario(base, diretorio=self.diretorio))
+        self.assertIsNone(repositorio_cenarios.carregar_cenario(base, diretorio=self.diretorio))
+        self.assertEqual(list(repositorio_cenarios.listar_cenarios(diretorio=self.diretorio)['id']), [outro])
+
 if __name__ == '__main__':
     unittest.main()